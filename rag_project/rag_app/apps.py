@@ -1,6 +1,57 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RagAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_app'
+
+    def ready(self):
+        if not _is_serving():
+            return
+
+        # Pool-mode jobs queued or running when the server last stopped
+        threading.Thread(target=_recover_jobs, name="rag-recover-jobs", daemon=True).start()
+
+        if not getattr(settings, "RAG_WARMUP_ON_STARTUP", True):
+            return
+
+        from .utils.registry import warmup
+
+        # Load in the background so startup isn't blocked; requests that arrive
+        # early simply wait on the registry lock instead of loading a second copy.
+        threading.Thread(target=warmup, name="rag-warmup", daemon=True).start()
+
+
+def _recover_jobs():
+    from django.db import connection
+
+    from .utils.ingestion import recover_jobs
+
+    try:
+        recovered = recover_jobs()
+        if recovered:
+            print(f"♻️ Re-dispatched {recovered} unfinished ingestion job(s)")
+    except Exception as e:
+        # E.g. the database isn't migrated yet
+        print(f"⚠️ Could not recover ingestion jobs: {e}")
+    finally:
+        connection.close()
+
+
+def _is_serving():
+    """True for web workers, False for one-off management commands (migrate, test, ...) and pool children."""
+    from .utils.workers import is_pool_worker
+
+    if is_pool_worker():
+        return False
+    if not sys.argv or not sys.argv[0].endswith("manage.py"):
+        return True  # gunicorn / uvicorn / daphne
+    if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+        return False
+    # The autoreloader parent process never serves requests
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
@@ -0,0 +1,194 @@
+import argparse
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+# name -> (RAG_EMBEDDING_BACKEND, RAG_ONNX_QUANTIZE)
+BACKENDS = {
+    "torch": ("torch", False),
+    "onnx": ("onnx", False),
+    "onnx-int8": ("onnx", True),
+}
+# The ONNX vectors must point the same way as the PyTorch ones to share an index
+MIN_COSINE = 0.99
+
+
+def make_texts(n, seed):
+    """Chunk-like texts of one to three paragraphs (roughly 60-250 tokens)."""
+    # Not imported at module level: the worker processes shouldn't pay for ragbench's imports
+    from rag_app.management.commands.ragbench import paragraph
+
+    rng = random.Random(seed)
+    texts, parts = [], []
+    for i in range(n):
+        paragraphs = [paragraph(rng, i * 3 + j) for j in range(rng.randint(1, 3))]
+        parts.append(paragraphs[0][0])
+        texts.append(" ".join(text for _, text in paragraphs))
+    return texts, [f"What torque does part {part} need?" for part in parts]
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def run_worker(spec, model_name, data_path, out_path, repeat):
+    """Runs in a fresh interpreter, so imports, memory and start time belong to this backend alone."""
+    from rag_app.utils.embeddings import build_embeddings
+
+    with open(data_path) as f:
+        data = json.load(f)
+    backend, quantize = BACKENDS[spec]
+    with override_settings(RAG_EMBEDDING_BACKEND=backend, RAG_ONNX_QUANTIZE=quantize,
+                           RAG_EMBEDDING_CACHE_PATH=None):
+        start = time.perf_counter()
+        embeddings = build_embeddings(model_name)
+        embeddings.embed_query(data["queries"][0])
+        load = time.perf_counter() - start
+        ready = time.time()
+
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            vectors = embeddings.embed_documents(data["texts"])
+            runs.append(time.perf_counter() - start)
+
+        latencies = []
+        query_vectors = []
+        for query in data["queries"]:
+            start = time.perf_counter()
+            query_vectors.append(embeddings.embed_query(query))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    np.savez(out_path, documents=np.asarray(vectors, dtype=np.float32),
+             queries=np.asarray(query_vectors, dtype=np.float32))
+    return {
+        "backend": spec,
+        "ready_at": ready,
+        "load_seconds": round(load, 3),
+        "chunks_per_sec": round(len(data["texts"]) / statistics.median(runs), 1),
+        "query_ms": {
+            "p50": round(latencies[len(latencies) // 2], 3),
+            "p95": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3),
+        },
+        "peak_rss_mb": round(_max_rss_mb(), 1),
+    }
+
+
+def cosines(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the embedding backends (PyTorch, ONNX Runtime, int8 ONNX): process start time, "
+        f"chunks/sec, query latency and peak memory, and checks the vectors agree (cosine > {MIN_COSINE})."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", default=",".join(BACKENDS),
+                            help=f"Comma-separated list from: {', '.join(BACKENDS)}. "
+                                 "The first one is the reference for the cosine check.")
+        parser.add_argument("--model", help="Defaults to RAG_EMBEDDING_MODEL.")
+        parser.add_argument("--texts", type=int, default=1000)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--check", action="store_true",
+                            help="Fail if a backend's vectors fall below the cosine threshold.")
+        parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+        # Internal: the per-backend child process
+        parser.add_argument("--worker", help=argparse.SUPPRESS)
+        parser.add_argument("--data", help=argparse.SUPPRESS)
+        parser.add_argument("--out", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or getattr(settings, "RAG_EMBEDDING_MODEL",
+                                                 "sentence-transformers/all-MiniLM-L6-v2")
+        if options["worker"]:
+            try:
+                result = run_worker(options["worker"], model_name, options["data"], f"{options['out']}.npz",
+                                    options["repeat"])
+            except Exception as e:
+                result = {"backend": options["worker"], "error": f"{e.__class__.__name__}: {e}"}
+            with open(f"{options['out']}.json", "w") as f:
+                json.dump(result, f)
+            return
+
+        specs = [spec.strip() for spec in options["backends"].split(",") if spec.strip()]
+        unknown = [spec for spec in specs if spec not in BACKENDS]
+        if unknown:
+            raise CommandError(f"Unknown backend(s): {', '.join(unknown)}")
+
+        texts, queries = make_texts(options["texts"], options["seed"])
+        results, vectors = [], {}
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path = f"{tmp}/data.json"
+            with open(data_path, "w") as f:
+                json.dump({"texts": texts, "queries": queries[:options["queries"]]}, f)
+
+            for spec in specs:
+                self.stdout.write(f"Benchmarking {spec}...")
+                out = f"{tmp}/{spec}"
+                spawned = time.time()
+                subprocess.run(
+                    [sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_embedding_backends", "--skip-checks",
+                     "--worker", spec, "--model", model_name, "--data", data_path, "--out", out,
+                     "--repeat", str(options["repeat"])],
+                    check=True,
+                )
+                with open(f"{out}.json") as f:
+                    result = json.load(f)
+                if "error" in result:
+                    self.stdout.write(self.style.WARNING(f"  skipped: {result['error']}"))
+                    continue
+                # Interpreter start, Django setup, imports and model load, up to the first query vector
+                result["start_seconds"] = round(result.pop("ready_at") - spawned, 3)
+                data = np.load(f"{out}.npz")
+                vectors[spec] = np.concatenate([data["documents"], data["queries"]])
+                results.append(result)
+
+        failed = []
+        if results:
+            reference = results[0]["backend"]
+            for result in results:
+                similarity = cosines(vectors[reference], vectors[result["backend"]])
+                result["cosine_vs"] = reference
+                result["cosine_min"] = round(float(similarity.min()), 5)
+                result["cosine_mean"] = round(float(similarity.mean()), 5)
+                if result["cosine_min"] <= MIN_COSINE:
+                    failed.append(result["backend"])
+
+        self.stdout.write(
+            f"\n{'backend':<10} {'start s':>8} {'load s':>7} {'chunks/s':>9} {'query p50':>10} "
+            f"{'query p95':>10} {'peak MB':>8} {'cos min':>8} {'cos mean':>9}"
+        )
+        for row in results:
+            style = self.style.ERROR if row["backend"] in failed else str
+            self.stdout.write(style(
+                f"{row['backend']:<10} {row['start_seconds']:>8} {row['load_seconds']:>7} "
+                f"{row['chunks_per_sec']:>9} {row['query_ms']['p50']:>10} {row['query_ms']['p95']:>10} "
+                f"{row['peak_rss_mb']:>8} {row['cosine_min']:>8} {row['cosine_mean']:>9}"
+            ))
+        if results:
+            self.stdout.write(f"(cosine against {results[0]['backend']}, must stay above {MIN_COSINE})")
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump({"model": model_name,
+                           "options": {key: options[key] for key in ("texts", "queries", "repeat", "seed")},
+                           "results": results}, f, indent=2)
+            self.stdout.write(f"\nWrote {options['json_path']}")
+
+        if failed and options["check"]:
+            raise CommandError(f"Vectors differ from {results[0]['backend']}: {', '.join(failed)}")
@@ -0,0 +1,135 @@
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rag_app.utils.embeddings import get_embeddings
+from rag_app.utils.lexical_index import LexicalIndex, SegmentBuilder
+from rag_app.utils.retrieval import dense_search, hybrid_search, lexical_search
+from rag_app.utils.vector_store import build_backend
+
+TOPICS = [
+    "pump maintenance", "invoice approval", "warranty claims", "network outage",
+    "battery storage", "payroll deductions", "fire safety drills", "data retention",
+    "supplier onboarding", "vehicle inspection", "access badges", "travel expenses",
+]
+FILLER = (
+    "The procedure must be reviewed by the responsible team before it is applied. "
+    "Records are kept for audit purposes and checked during the quarterly review. "
+    "Any deviation has to be reported to the supervisor on duty. "
+)
+
+
+def make_corpus(n_chunks, seed):
+    """Synthetic chunks, each mentioning a unique part number and one topic."""
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(n_chunks):
+        topic = rng.choice(TOPICS)
+        part = f"{rng.choice('ABCDEFGHJK')}{rng.choice('LMNPQRSTUV')}-{1000 + i}"
+        torque = rng.randint(10, 90)
+        text = (
+            f"Section {i // 10}.{i % 10} covers {topic}. "
+            f"Part {part} requires a torque of {torque} Nm. {FILLER}"
+        )
+        chunks.append({"id": f"pdf1_c{i}", "part": part, "topic": topic, "torque": torque, "text": text})
+    return chunks
+
+
+def make_queries(chunks, n_queries, seed):
+    """Exact-term questions: only the chunk with that part number is relevant."""
+    rng = random.Random(seed + 1)
+    picked = rng.sample(chunks, min(n_queries, len(chunks)))
+    return [(f"What torque does part {c['part']} need?", c["id"]) for c in picked]
+
+
+class Command(BaseCommand):
+    help = "Compares recall@k and latency of dense-only, BM25-only and hybrid (RRF) retrieval on a sample corpus."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=2000)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--k", type=int, default=6)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        k = options["k"]
+        chunks = make_corpus(options["chunks"], options["seed"])
+        queries = make_queries(chunks, options["queries"], options["seed"])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.stdout.write(f"Indexing {len(chunks)} chunks...")
+            vectorstore = build_backend(
+                getattr(settings, "RAG_VECTOR_BACKEND", "chroma"), get_embeddings(), f"{tmp}/vectors", "bench",
+                getattr(settings, "RAG_FAISS_INDEX_TYPE", "flat"),
+            )
+            lexical = LexicalIndex(f"{tmp}/lexical")
+            builder = SegmentBuilder(1)
+
+            start = time.perf_counter()
+            for i in range(0, len(chunks), 256):
+                batch = chunks[i:i + 256]
+                vectorstore.add_texts(
+                    texts=[c["text"] for c in batch],
+                    metadatas=[{"pdf_id": 1, "page": 1} for _ in batch],
+                    ids=[c["id"] for c in batch],
+                )
+            dense_ingest = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for c in chunks:
+                builder.add(c["id"], 1, c["text"])
+            lexical.write(builder)
+            lexical_ingest = time.perf_counter() - start
+
+            modes = {
+                "dense": lambda q: dense_search(q, "all", k, vectorstore),
+                "bm25": lambda q: lexical_search(q, "all", k, vectorstore, lexical),
+                "hybrid": lambda q: hybrid_search(q, "all", k, vectorstore=vectorstore, lexical_index=lexical),
+            }
+            results = {
+                "chunks": len(chunks),
+                "queries": len(queries),
+                "k": k,
+                "ingest_seconds": {"dense": round(dense_ingest, 3), "bm25": round(lexical_ingest, 3)},
+                "modes": {},
+            }
+            for name, run in modes.items():
+                run(queries[0][0])  # warm caches
+                latencies, hits, reciprocal_ranks = [], 0, []
+                for question, relevant_id in queries:
+                    start = time.perf_counter()
+                    docs = run(question)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    ids = [doc.id for doc in docs]
+                    if relevant_id in ids:
+                        hits += 1
+                        reciprocal_ranks.append(1 / (ids.index(relevant_id) + 1))
+                    else:
+                        reciprocal_ranks.append(0.0)
+
+                latencies.sort()
+                results["modes"][name] = {
+                    f"recall@{k}": round(hits / len(queries), 4),
+                    "mrr": round(statistics.mean(reciprocal_ranks), 4),
+                    "latency_ms_mean": round(statistics.mean(latencies), 2),
+                    "latency_ms_p50": round(latencies[len(latencies) // 2], 2),
+                    "latency_ms_p95": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+                }
+
+        self.stdout.write(f"\n{'mode':<8} {'recall@' + str(k):>10} {'mrr':>8} {'mean ms':>9} {'p95 ms':>9}")
+        for name, row in results["modes"].items():
+            self.stdout.write(
+                f"{name:<8} {row[f'recall@{k}']:>10} {row['mrr']:>8} "
+                f"{row['latency_ms_mean']:>9} {row['latency_ms_p95']:>9}"
+            )
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"\nWrote {options['json_path']}")
@@ -0,0 +1,195 @@
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app.utils.workers import process_pool
+
+BACKENDS = ["chroma", "numpy", "faiss:flat", "faiss:ivf", "faiss:hnsw", "quantized:int8", "quantized:binary",
+            "partitioned:numpy", "partitioned:chroma"]
+
+
+def make_vectors(n, dim, n_pdfs, seed):
+    """Clustered unit vectors, so ANN indexes face a realistic (non-uniform) layout."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 50, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    pdf_ids = rng.integers(1, n_pdfs + 1, n)
+    return vectors, pdf_ids
+
+
+def make_queries(vectors, n, seed):
+    """Perturbed corpus vectors: like real questions, they land near some chunks."""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(0, len(vectors), n)]
+    queries = picked + 0.05 * rng.normal(size=picked.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def _latency(latencies):
+    latencies = sorted(latencies)
+    return {
+        "mean": round(statistics.mean(latencies), 3),
+        "p50": round(_percentile(latencies, 0.5), 3),
+        "p95": round(_percentile(latencies, 0.95), 3),
+    }
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def run_backend(spec, data_path, n_queries, k, batch_size, directory):
+    """Runs in a fresh process so peak memory belongs to this backend alone."""
+    from rag_app.utils.vector_store import build_backend, build_partitioned
+
+    backend, _, variant = spec.partition(":")
+    data = np.load(data_path)
+    vectors, pdf_ids, queries = data["vectors"], data["pdf_ids"], data["queries"][:n_queries]
+    ids = [f"pdf{p}_c{i}" for i, p in enumerate(pdf_ids)]
+    rss_before = _max_rss_mb()
+
+    def open_store():
+        # Queries are passed as vectors, so no embedding model is needed
+        if backend == "partitioned":
+            # A store per PDF
+            return build_partitioned(lambda d, name: build_backend(variant, None, d, name), variant,
+                                     directory, "bench", 1)
+        if backend == "quantized":
+            return build_backend(backend, None, directory, "bench", quantization=variant)
+        return build_backend(backend, None, directory, "bench", variant or "flat")
+
+    store = open_store()
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch_size):
+        store.add_embeddings(
+            ids=ids[i:i + batch_size],
+            embeddings=vectors[i:i + batch_size].tolist(),
+            texts=[f"chunk {j}" for j in range(i, min(i + batch_size, len(vectors)))],
+            metadatas=[{"pdf_id": int(p), "page": 1} for p in pdf_ids[i:i + batch_size]],
+        )
+    store.persist()
+    ingest = time.perf_counter() - start
+
+    # Save/load: reopen from disk as a new process would
+    del store
+    start = time.perf_counter()
+    store = open_store()
+    store.similarity_search_by_vector(queries[0].tolist(), k=k)
+    load = time.perf_counter() - start
+
+    exact = vectors @ queries.T
+    results = {}
+    for scope in ("all", "pdf"):
+        latencies, recalls = [], []
+        for qi, query in enumerate(queries):
+            where = None
+            candidates = np.arange(len(vectors))
+            if scope == "pdf":
+                pdf_id = int(pdf_ids[qi % len(pdf_ids)])
+                where = {"pdf_id": pdf_id}
+                candidates = np.nonzero(pdf_ids == pdf_id)[0]
+            truth = {ids[i] for i in candidates[np.argsort(-exact[candidates, qi])[:k]]}
+
+            start = time.perf_counter()
+            docs = store.similarity_search_by_vector(query.tolist(), k=k, filter=where)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(truth & {doc.id for doc in docs}) / len(truth))
+        results[scope] = {"latency_ms": _latency(latencies), f"recall@{k}": round(statistics.mean(recalls), 4)}
+
+    # Chroma keeps its index in its own process-wide caches
+    search_bytes = store.search_bytes() if hasattr(store, "search_bytes") else None
+    disk_bytes = sum(os.path.getsize(os.path.join(root, name))
+                     for root, _, names in os.walk(directory) for name in names)
+
+    start = time.perf_counter()
+    store.delete(where={"pdf_id": int(pdf_ids[0])})
+    store.persist()
+    delete = time.perf_counter() - start
+
+    return {
+        "backend": spec,
+        "ingest_seconds": round(ingest, 3),
+        "vectors_per_sec": round(len(vectors) / ingest, 1),
+        "load_seconds": round(load, 3),
+        "delete_pdf_seconds": round(delete, 3),
+        "query_all": results["all"],
+        "query_pdf": results["pdf"],
+        "search_mb": None if search_bytes is None else round(search_bytes / 2**20, 1),
+        "disk_mb": round(disk_bytes / 2**20, 1),
+        "peak_rss_mb": round(_max_rss_mb(), 1),
+        "rss_growth_mb": round(_max_rss_mb() - rss_before, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compares ingest/query latency, recall and memory (RAM scanned per search, disk) of the vector store backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vectors", type=int, default=20000)
+        parser.add_argument("--dim", type=int, default=384)
+        parser.add_argument("--pdfs", type=int, default=20)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=6)
+        parser.add_argument("--batch-size", type=int, default=512)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--backends", default=",".join(BACKENDS),
+                            help=f"Comma-separated list from: {', '.join(BACKENDS)}")
+        parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        specs = [spec.strip() for spec in options["backends"].split(",") if spec.strip()]
+        unknown = [spec for spec in specs if spec not in BACKENDS]
+        if unknown:
+            raise CommandError(f"Unknown backend(s): {', '.join(unknown)}")
+
+        vectors, pdf_ids = make_vectors(options["vectors"], options["dim"], options["pdfs"], options["seed"])
+        queries = make_queries(vectors, options["queries"], options["seed"] + 1)
+        results = []
+
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path = f"{tmp}/data.npz"
+            np.savez(data_path, vectors=vectors, pdf_ids=pdf_ids, queries=queries)
+
+            for spec in specs:
+                self.stdout.write(f"Benchmarking {spec}...")
+                with process_pool(1) as pool:
+                    future = pool.submit(
+                        run_backend, spec, data_path, options["queries"], options["k"],
+                        options["batch_size"], f"{tmp}/{spec.replace(':', '_')}",
+                    )
+                    try:
+                        results.append(future.result())
+                    except ImportError as e:
+                        self.stdout.write(self.style.WARNING(f"  skipped: {e}"))
+
+        k = options["k"]
+        self.stdout.write(
+            f"\n{'backend':<19} {'ingest s':>9} {'load s':>7} {'all p50':>8} {'all p95':>8} "
+            f"{'recall':>7} {'pdf p50':>8} {'search MB':>10} {'disk MB':>8} {'peak MB':>8}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['backend']:<19} {row['ingest_seconds']:>9} {row['load_seconds']:>7} "
+                f"{row['query_all']['latency_ms']['p50']:>8} {row['query_all']['latency_ms']['p95']:>8} "
+                f"{row['query_all'][f'recall@{k}']:>7} {row['query_pdf']['latency_ms']['p50']:>8} "
+                f"{'-' if row['search_mb'] is None else row['search_mb']:>10} {row['disk_mb']:>8} "
+                f"{row['peak_rss_mb']:>8}"
+            )
+        self.stdout.write("(search MB: vectors or codes a search scans, which should stay in RAM)")
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump({"options": {key: options[key] for key in ("vectors", "dim", "pdfs", "queries", "k")},
+                           "results": results}, f, indent=2)
+            self.stdout.write(f"\nWrote {options['json_path']}")
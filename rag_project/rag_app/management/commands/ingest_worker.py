@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag_app.utils.ingestion import process_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Processes queued PDF ingestion jobs from the database (no broker needed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to sleep when there is nothing to do.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ingestion worker started")
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+            job = process_job()
+            if job is not None:
+                style = self.style.SUCCESS if job.status == job.DONE else self.style.ERROR
+                self.stdout.write(style(f"Job {job.id} ({job.pdf.filename}): {job.status} "
+                                        f"in {job.timings.get('total', 0) / 1000:.1f}s"))
+                continue
+
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
@@ -0,0 +1,404 @@
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import fitz  # PyMuPDF
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rag_app.utils import qa
+from rag_app.utils.answer_cache import answer_cache
+from rag_app.utils.embeddings import get_embeddings
+from rag_app.utils.index_state import target_config
+from rag_app.utils.llm import build_llm, get_llm, warm_llm
+from rag_app.utils.lexical_index import SegmentBuilder, get_lexical_index
+from rag_app.utils.page_renderer import RenderOptions, render_page_range
+from rag_app.utils.pdf_loader import extract_text_from_pdf
+from rag_app.utils.registry import registry
+from rag_app.utils.retrieval import dense_search, hybrid_search
+from rag_app.utils.stubs import HashingEmbeddings, StubLLM, StubOllamaServer
+from rag_app.utils.text_splitter import chunk_pages
+from rag_app.utils.vector_store import chunk_id, create_vector_store, delete_from_vector_store, get_vectorstore
+
+GROUPS = ["extract", "split", "embed", "index", "render", "retrieval", "qa", "llm"]
+
+TOPICS = [
+    "pump maintenance", "invoice approval", "warranty claims", "network outage",
+    "battery storage", "payroll deductions", "fire safety drills", "data retention",
+    "supplier onboarding", "vehicle inspection", "access badges", "travel expenses",
+]
+FILLER = (
+    "The procedure must be reviewed by the responsible team before it is applied. "
+    "Records are kept for audit purposes and checked during the quarterly review. "
+    "Any deviation has to be reported to the supervisor on duty. "
+)
+# PDF ids the retrieval corpus is spread over (for pdf-scoped queries)
+CORPUS_PDFS = 20
+# The index/delete benchmark uses ids well clear of the corpus
+INDEX_PDF_ID = 100000
+# Simulated Ollama costs for the llm group: model load, prompt evaluation
+STUB_LOAD_MS = 200
+STUB_PROMPT_MS_PER_1K_CHARS = 20
+# Calls that pay a model load each; more only make the run longer
+COLD_CALLS = 10
+
+
+def paragraph(rng, n):
+    topic = rng.choice(TOPICS)
+    part = f"{rng.choice('ABCDEFGHJK')}{rng.choice('LMNPQRSTUV')}-{1000 + n}"
+    return part, f"Section {n // 10}.{n % 10} covers {topic}. Part {part} requires a torque of " \
+                 f"{rng.randint(10, 90)} Nm. {FILLER}"
+
+
+def split_text(pages_data):
+    """Chunks with the splitter and sizes the settings ask for."""
+    return list(chunk_pages(pages_data, target_config()))
+
+
+def make_pdf(path, pages, seed):
+    """A text PDF with three paragraphs per page, each naming a unique part number."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    n = 0
+    for _ in range(pages):
+        page = doc.new_page()
+        text = []
+        for _ in range(3):
+            text.append(paragraph(rng, n)[1])
+            n += 1
+        page.insert_textbox(fitz.Rect(56, 56, page.rect.width - 56, page.rect.height - 56),
+                            "\n\n".join(text), fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def summarize(samples_ms):
+    samples = sorted(samples_ms)
+    return {
+        "runs": len(samples),
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(int(len(samples) * 0.95), len(samples) - 1)], 3),
+        "min_ms": round(samples[0], 3),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _int_list(value):
+    try:
+        return [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma-separated list of integers, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the ingestion and Q&A hot paths on synthetic PDFs and corpora, offline "
+        "(hashing embeddings and a stub LLM unless --embeddings model), and writes JSON for comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", default="5,50,250", help="Page counts of the synthetic PDFs.")
+        parser.add_argument("--corpus-sizes", default="1000,10000,100000",
+                            help="Chunk counts the retrieval and Q&A benchmarks run at.")
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--k", type=int, default=6)
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement.")
+        parser.add_argument("--render-pages", type=int, default=10, help="Pages rendered per PDF.")
+        parser.add_argument("--embeddings", choices=["stub", "model"], default="stub",
+                            help="stub: deterministic hashing embeddings (no download); "
+                                 "model: the configured RAG_EMBEDDING_MODEL.")
+        parser.add_argument("--only", help=f"Comma-separated groups from: {', '.join(GROUPS)}")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--json", dest="json_path", help="Write the results to this file.")
+        parser.add_argument("--compare", help="A previous --json file to show changes against.")
+
+    def handle(self, *args, **options):
+        groups = GROUPS
+        if options["only"]:
+            groups = [g.strip() for g in options["only"].split(",") if g.strip()]
+            unknown = [g for g in groups if g not in GROUPS]
+            if unknown:
+                raise CommandError(f"Unknown group(s): {', '.join(unknown)}")
+        self.options = options
+        self.results = {}
+        # The synthetic retrieval corpus, shared by the retrieval and qa groups
+        self._corpus_size = 0
+        self._parts = []
+        self._builders = {}
+
+        with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+            # Everything the benchmark writes goes to the temp dir, never the real index
+            stack.enter_context(override_settings(
+                MEDIA_ROOT=f"{tmp}/media",
+                RAG_CHROMA_DIR=f"{tmp}/chroma",
+                RAG_FAISS_INDEX_DIR=f"{tmp}/faiss",
+                RAG_NUMPY_INDEX_DIR=f"{tmp}/numpy",
+                RAG_LEXICAL_INDEX_DIR=f"{tmp}/lexical",
+                RAG_EMBEDDING_CACHE_PATH=None,
+                RAG_RERANK_ENABLED=False,
+            ))
+            if options["embeddings"] == "stub":
+                stack.enter_context(registry.override("embeddings", HashingEmbeddings()))
+            # Unique questions never hit the exact cache; this keeps reworded ones from hitting it
+            stack.enter_context(mock.patch.object(answer_cache, "threshold", None))
+            stack.callback(answer_cache.invalidate)
+
+            pdfs = self.make_pdfs(tmp)
+            for group in groups:
+                self.stdout.write(f"Running {group}...")
+                getattr(self, f"bench_{group}")(pdfs)
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "vector_backend": getattr(settings, "RAG_VECTOR_BACKEND", "chroma"),
+                "embeddings": "stub" if options["embeddings"] == "stub" else
+                              getattr(settings, "RAG_EMBEDDING_MODEL", None),
+                "llm": "stub",
+                "options": {key: options[key] for key in
+                            ("pages", "corpus_sizes", "queries", "k", "repeat", "render_pages", "seed")},
+            },
+            "results": self.results,
+        }
+        self.print_table(report)
+        if options["compare"]:
+            self.print_comparison(options["compare"])
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"\nWrote {options['json_path']}")
+
+    # --- Inputs -----------------------------------------------------------
+
+    def make_pdfs(self, tmp):
+        pdfs = []
+        for i, pages in enumerate(_int_list(self.options["pages"])):
+            path = f"{tmp}/synthetic_{pages}p.pdf"
+            make_pdf(path, pages, self.options["seed"] + i)
+            pdfs.append((pages, path))
+        return pdfs
+
+    def record(self, name, result, **extra):
+        self.results[name] = {**result, **extra}
+
+    # --- Ingestion --------------------------------------------------------
+
+    def bench_extract(self, pdfs):
+        for pages, path in pdfs:
+            result = measure(lambda: extract_text_from_pdf(path), self.options["repeat"])
+            self.record(f"extract/{pages}p", result, pages_per_sec=round(pages / (result["p50_ms"] / 1000), 1))
+
+    def bench_split(self, pdfs):
+        for pages, path in pdfs:
+            pages_data = extract_text_from_pdf(path)
+            chunks = len(split_text(pages_data))
+            result = measure(lambda: split_text(pages_data), self.options["repeat"])
+            self.record(f"split/{pages}p", result, chunks=chunks,
+                        chunks_per_sec=round(chunks / (result["p50_ms"] / 1000), 1))
+
+    def bench_embed(self, pdfs):
+        _, path = pdfs[-1]
+        texts = [doc.page_content for doc in split_text(extract_text_from_pdf(path))]
+        embeddings = get_embeddings()
+        batch_size = getattr(settings, "RAG_EMBED_BATCH_SIZE", 64)
+
+        def embed_all():
+            for i in range(0, len(texts), batch_size):
+                embeddings.embed_documents(texts[i:i + batch_size])
+
+        result = measure(embed_all, self.options["repeat"])
+        self.record(f"embed/{len(texts)}chunks", result, batch_size=batch_size,
+                    chunks_per_sec=round(len(texts) / (result["p50_ms"] / 1000), 1))
+
+    def bench_index(self, pdfs):
+        """create_vector_store() then delete_from_vector_store() for each PDF's chunks."""
+        for pages, path in pdfs:
+            pages_data = extract_text_from_pdf(path)
+            creates, deletes = [], []
+            for _ in range(self.options["repeat"]):
+                docs = split_text(pages_data)
+                start = time.perf_counter()
+                create_vector_store(docs, INDEX_PDF_ID)
+                creates.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                delete_from_vector_store(INDEX_PDF_ID)
+                deletes.append((time.perf_counter() - start) * 1000)
+            chunks = len(docs)
+            create = summarize(creates)
+            self.record(f"create_vector_store/{pages}p", create, chunks=chunks,
+                        chunks_per_sec=round(chunks / (create["p50_ms"] / 1000), 1))
+            self.record(f"delete_from_vector_store/{pages}p", summarize(deletes), chunks=chunks)
+
+    def bench_render(self, pdfs):
+        opts = RenderOptions.from_settings()
+        media_root = str(settings.MEDIA_ROOT)
+        for pages, path in pdfs:
+            count = min(pages, self.options["render_pages"])
+            result = measure(lambda: render_page_range(path, 1, 1, count + 1, media_root, opts),
+                             self.options["repeat"])
+            self.record(f"render/{pages}p", result, pages_rendered=count,
+                        pages_per_sec=round(count / (result["p50_ms"] / 1000), 1))
+
+    # --- Retrieval and Q&A --------------------------------------------------
+
+    def grow_corpus(self, size):
+        """Adds chunks to the (temporary) index until it holds `size`. Returns query (question, pdf_id) pairs."""
+        vectorstore = get_vectorstore()
+        lexical = get_lexical_index()
+        embeddings = get_embeddings()
+        rng = random.Random(self.options["seed"] + size)
+        parts = []
+        builders = self._builders
+        for start in range(self._corpus_size, size, 512):
+            end = min(start + 512, size)
+            texts, ids, metadatas = [], [], []
+            for n in range(start, end):
+                pdf_id = n % CORPUS_PDFS + 1
+                part, text = paragraph(rng, n)
+                texts.append(text)
+                ids.append(chunk_id(pdf_id, n))
+                metadatas.append({"pdf_id": pdf_id, "page": n // 30 + 1})
+                parts.append((part, pdf_id))
+                builders.setdefault(pdf_id, SegmentBuilder(pdf_id)).add(ids[-1], metadatas[-1]["page"], text)
+            vectorstore.add_embeddings(ids=ids, embeddings=embeddings.embed_documents(texts),
+                                       texts=texts, metadatas=metadatas)
+        vectorstore.persist()
+        # A segment holds a whole PDF, so each one is rewritten with its earlier chunks too
+        for builder in builders.values():
+            lexical.write(builder)
+        self._corpus_size = max(self._corpus_size, size)
+        self._parts.extend(parts)
+
+        picked = random.Random(self.options["seed"]).sample(self._parts, min(self.options["queries"], len(self._parts)))
+        return [(f"What torque does part {part} need?", pdf_id) for part, pdf_id in picked]
+
+    def _corpus_sizes(self):
+        for size in sorted(_int_list(self.options["corpus_sizes"])):
+            self.stdout.write(f"  corpus of {size} chunks")
+            yield size, self.grow_corpus(size)
+
+    def bench_retrieval(self, pdfs):
+        k = self.options["k"]
+        for size, queries in self._corpus_sizes():
+            modes = {
+                "dense": lambda q, pdf_id: dense_search(q, "all", k),
+                "dense_pdf": lambda q, pdf_id: dense_search(q, pdf_id, k),
+                "hybrid": lambda q, pdf_id: hybrid_search(q, "all", k),
+            }
+            for name, search in modes.items():
+                search(*queries[0])  # warm caches
+                samples = []
+                for question, pdf_id in queries:
+                    start = time.perf_counter()
+                    search(question, pdf_id)
+                    samples.append((time.perf_counter() - start) * 1000)
+                self.record(f"retrieval/{name}/{size}", summarize(samples))
+
+    def bench_qa(self, pdfs):
+        """answer_question() end to end with the stub LLM (no Ollama needed)."""
+        with mock.patch.object(qa, "get_llm", lambda: StubLLM()):
+            for size, queries in self._corpus_sizes():
+                samples, stages = [], {}
+                for i, (question, _) in enumerate(queries):
+                    start = time.perf_counter()
+                    # The suffix keeps every question a cache miss across corpus sizes
+                    response = qa.answer_question(f"{question} ({size}/{i})", "all")
+                    samples.append((time.perf_counter() - start) * 1000)
+                    for stage, ms in response.get("timings", {}).items():
+                        stages.setdefault(stage, []).append(ms)
+                self.record(f"qa/{size}", summarize(samples),
+                            stages_p50_ms={stage: round(statistics.median(v), 3) for stage, v in stages.items()})
+
+    def bench_llm(self, pdfs):
+        """
+        Time to first token against a local Ollama stand-in (StubOllamaServer):
+        a new client per call with the model unloaded in between (what a call
+        after an idle spell used to cost), then the shared, warmed client with
+        prompts that do / don't start with the fixed instruction prefix.
+        """
+        rng = random.Random(self.options["seed"])
+        requests = []
+        for i in range(self.options["queries"]):
+            part, _ = paragraph(rng, i)
+            context = "".join(f"[Page {i + 1}] {paragraph(rng, i * 6 + j)[1]}\n\n" for j in range(6))
+            requests.append((f"What torque does part {part} need?", context))
+        with_prefix = [qa.PROMPT_PREFIX + qa.PROMPT_TEMPLATE.format(context=c, question=q) for q, c in requests]
+        # Same text, question first: consecutive prompts share (almost) nothing
+        without_prefix = [f"Question: {q}\n\n{qa.PROMPT_PREFIX}Context:\n{c}" for q, c in requests]
+
+        def ttft(llm, prompt):
+            start = time.perf_counter()
+            first = None
+            # Read the whole stream so the connection goes back to the pool
+            for chunk in llm.stream(prompt):
+                if first is None and chunk.content:
+                    first = (time.perf_counter() - start) * 1000
+            return first
+
+        with StubOllamaServer(load_ms=STUB_LOAD_MS, prompt_ms_per_1k_chars=STUB_PROMPT_MS_PER_1K_CHARS) as server:
+            with override_settings(RAG_OLLAMA_BASE_URL=server.url, RAG_LLM_KEEP_ALIVE=0):
+                samples = [ttft(build_llm(), prompt) for prompt in with_prefix[:COLD_CALLS]]
+            self.record("llm/ttft/new_client_cold", summarize(samples),
+                        calls=len(samples), connections=server.connections, model_loads=server.loads)
+
+            for name, prompts in (("shared_no_prefix", without_prefix), ("shared_prefix", with_prefix)):
+                server.reset()
+                with override_settings(RAG_OLLAMA_BASE_URL=server.url, RAG_LLM_KEEP_ALIVE="30m"):
+                    warm_llm()
+                    llm = get_llm()
+                    samples = [ttft(llm, prompt) for prompt in prompts]
+                self.record(f"llm/ttft/{name}", summarize(samples),
+                            calls=len(samples), connections=server.connections, model_loads=server.loads)
+
+    # --- Output -----------------------------------------------------------
+
+    def print_table(self, report):
+        self.stdout.write(f"\n{'benchmark':<36} {'p50 ms':>10} {'p95 ms':>10} {'throughput':>16}")
+        for name, row in report["results"].items():
+            throughput = next((f"{row[key]} {key.split('_per_')[0]}/s" for key in row if "_per_sec" in key), "")
+            self.stdout.write(f"{name:<36} {row['p50_ms']:>10} {row['p95_ms']:>10} {throughput:>16}")
+
+    def print_comparison(self, path):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"\nChange vs {path} (commit {baseline['meta'].get('commit')}):")
+        self.stdout.write(f"{'benchmark':<36} {'old p50':>10} {'new p50':>10} {'change':>8}")
+        for name, row in self.results.items():
+            old = baseline["results"].get(name)
+            if not old:
+                continue
+            change = (row["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS if change < -10 else str
+            self.stdout.write(style(f"{name:<36} {old['p50_ms']:>10} {row['p50_ms']:>10} {change:>+7.1f}%"))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from rag_app.models import VectorIndex
+from rag_app.utils import reindex
+from rag_app.utils.index_state import active_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the search index for the current chunking/embedding settings from stored page text. "
+        "Builds into a shadow index and switches over when complete; safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="Embedding processes (default RAG_REINDEX_WORKERS).")
+        parser.add_argument("--drop-old", action="store_true",
+                            help="Delete the previous index's vectors and segments after switching.")
+        parser.add_argument("--dry-run", action="store_true", help="Only show what would be rebuilt.")
+
+    def handle(self, *args, **options):
+        active = active_index(refresh=True)
+        self.stdout.write(f"Active index: {active.name} (version {active.version}) {active.config}")
+
+        if options["dry_run"]:
+            current = reindex.plan(dry_run=True)
+            action = "build and switch to" if current.switch else "update in place"
+            self.stdout.write(f"Would {action} {current.index.name} (version {current.index.version}) "
+                              f"{current.index.config}: {len(current.stale)} PDF(s) to index")
+            return
+
+        def progress(done, total, pdf_id, chunks, seconds):
+            self.stdout.write(f"  [{done}/{total}] PDF {pdf_id}: {chunks} chunks in {seconds:.1f}s")
+
+        index = reindex.run(
+            workers=options["workers"],
+            progress=progress,
+            drop_old=options["drop_old"],
+            log=self.stdout.write,
+        )
+        building = VectorIndex.objects.filter(status=VectorIndex.BUILDING).count()
+        style = self.style.SUCCESS if not building else self.style.WARNING
+        self.stdout.write(style(f"Active index: {index.name} (version {index.version}), "
+                                f"{index.entries.count()} PDF(s)"))
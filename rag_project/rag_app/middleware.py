@@ -0,0 +1,122 @@
+# middleware.py
+"""
+Request timing: every request gets a StageTimer (request.timer) that the
+pipeline reports its stages into. When the response is done the stages go
+to the /metrics histograms (labelled with the URL name), and a Server-Timing
+header lets the browser's network panel show where the time went.
+
+Streaming responses send their headers before the body is generated, so
+their Server-Timing only covers the work done up to that point; the full
+breakdown is in the final "answer" event and in /metrics.
+
+With RAG_PROFILE_ENABLED, adding ?profile=1 (or an "X-Profile: 1" header)
+to a request samples it with the built-in profiler; the collapsed stacks
+are written to RAG_PROFILE_DIR and named in the X-Profile response header.
+"""
+import itertools
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import FileResponse
+
+from .utils.metrics import REQUEST_SECONDS, observe_stages
+from .utils.profiler import SamplingProfiler
+from .utils.timing import StageTimer
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]+")
+_profile_ids = itertools.count(1)
+
+
+def server_timing(timer):
+    """Server-Timing header value: one metric per stage, plus the total."""
+    parts = [f"{name};dur={ms}" for name, ms in timer.stages.items()]
+    parts.append(f"total;dur={timer.elapsed_ms()}")
+    return ", ".join(parts)
+
+
+class TimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = self._start(request)
+        with request.timer.activate():
+            response = self.get_response(request)
+        return self._finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self._start(request)
+        with request.timer.activate():
+            response = await self.get_response(request)
+        return self._finish(request, response, profile)
+
+    def _start(self, request):
+        request.timer = StageTimer()
+        if not getattr(settings, "RAG_PROFILE_ENABLED", False):
+            return None
+        if request.GET.get("profile") != "1" and request.headers.get("X-Profile") != "1":
+            return None
+        interval = getattr(settings, "RAG_PROFILE_INTERVAL_MS", 5) / 1000
+        return SamplingProfiler(interval=interval).start()
+
+    def _finish(self, request, response, profile):
+        timer = request.timer
+        if getattr(settings, "RAG_SERVER_TIMING", True):
+            response["Server-Timing"] = server_timing(timer)
+
+        profile_name = None
+        if profile is not None:
+            label = _UNSAFE.sub("_", request.path.strip("/")) or "root"
+            profile_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_ids)}-{label}.folded"
+            response["X-Profile"] = profile_name
+
+        def done():
+            match = request.resolver_match
+            view = (match.url_name or match.view_name) if match else "unmatched"
+            REQUEST_SECONDS.observe(timer.elapsed_ms() / 1000, view=view,
+                                    method=request.method, status=response.status_code)
+            observe_stages(view, timer.stages, timer.samples)
+            if profile is not None:
+                profile.stop()
+                directory = str(getattr(settings, "RAG_PROFILE_DIR", settings.BASE_DIR / "profiles"))
+                path = os.path.join(directory, profile_name)
+                profile.save(path)
+                print(f"🔬 Profiled {request.path} ({profile.samples} samples): {path}")
+
+        if response.streaming and not isinstance(response, FileResponse):
+            _call_at_end(response, done)
+        else:
+            done()
+        return response
+
+
+def _call_at_end(response, callback):
+    """Runs callback once the streaming body has been sent (or the client went away)."""
+    content = response.streaming_content
+
+    if response.is_async:
+        async def wrapped():
+            try:
+                async for part in content:
+                    yield part
+            finally:
+                callback()
+    else:
+        def wrapped():
+            try:
+                yield from content
+            finally:
+                callback()
+
+    response.streaming_content = wrapped()
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0005_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfpage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='pdf_pages/thumbs/'),
+        ),
+        migrations.AddConstraint(
+            model_name='pdfpage',
+            constraint=models.UniqueConstraint(fields=('pdf', 'page_number'), name='unique_pdf_page'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0006_pdfpage_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0007_uploadedpdf_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfpage',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='pdfpage',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='pdf_pages/'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0008_pdfpage_text_alter_pdfpage_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, unique=True)),
+                ('version', models.CharField(db_index=True, max_length=32)),
+                ('config', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('building', 'Building'), ('active', 'Active'), ('retired', 'Retired')], db_index=True, default='building', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='IndexedPDF',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunks', models.IntegerField(default=0)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('pdf', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_entries', to='rag_app.uploadedpdf')),
+                ('index', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='rag_app.vectorindex')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('index', 'pdf'), name='unique_index_pdf')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0009_vectorindex_indexedpdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
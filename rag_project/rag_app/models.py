@@ -1,5 +1,6 @@
 # rag_app/models.py
 from django.db import models
+import hashlib
 import os
 
 class UploadedPDF(models.Model):
@@ -7,6 +8,8 @@ class UploadedPDF(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     summary = models.TextField(blank=True, null=True)
     cover_image = models.ImageField(upload_to='covers/', blank=True, null=True)
+    # Content hash, used to reuse chunks/vectors when the same file is uploaded again
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     def __str__(self):
         return self.file.name
@@ -15,11 +18,144 @@ class UploadedPDF(models.Model):
     def filename(self):
         return os.path.basename(self.file.name)
 
+    def compute_sha256(self):
+        digest = hashlib.sha256()
+        with self.file.open('rb') as f:
+            for chunk in f.chunks():
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @property
+    def latest_job(self):
+        return self.jobs.order_by('-created_at').first()
+
 class PDFPage(models.Model):
     # Notice we refer to 'UploadedPDF' here, which matches the class above
     pdf = models.ForeignKey(UploadedPDF, on_delete=models.CASCADE, related_name='pages')
     page_number = models.IntegerField()
-    image = models.ImageField(upload_to='pdf_pages/')
+    # Empty until the page is rendered (lazily on first view, or at ingest)
+    image = models.ImageField(upload_to='pdf_pages/', blank=True)
+    thumbnail = models.ImageField(upload_to='pdf_pages/thumbs/', blank=True, null=True)
+    # Extracted once at ingest time; transcripts and other readers use this
+    # instead of re-parsing the PDF
+    text = models.TextField(blank=True, default='')
     
     class Meta:
-        ordering = ['page_number']
\ No newline at end of file
+        ordering = ['page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['pdf', 'page_number'], name='unique_pdf_page'),
+        ]
+
+class IngestionJob(models.Model):
+    """
+    One background processing run for an uploaded PDF. Rows double as the
+    work queue: workers claim QUEUED jobs with an atomic status update.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    STAGES = ['extract', 'split', 'embed', 'render', 'summarize']
+
+    pdf = models.ForeignKey(UploadedPDF, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=16, blank=True, default='')
+    # {"extract": {"done": 3, "total": 10}, ...}
+    progress = models.JSONField(default=dict, blank=True)
+    # Milliseconds per stage of the last run: {"extract": 120.5, "embed": 830.1, ..., "total": 1402.7}
+    timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}) for {self.pdf}"
+
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "pdf_id": self.pdf_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "timings": self.timings,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class VectorIndex(models.Model):
+    """
+    One generation of the search index (vector collection + lexical segments),
+    built with a fixed chunking/embedding config. Queries and new uploads use
+    the single ACTIVE index; `manage.py reindex` builds a BUILDING one next to
+    it and flips the statuses in one transaction when it is complete.
+    """
+    BUILDING = 'building'
+    ACTIVE = 'active'
+    RETIRED = 'retired'
+    STATUS_CHOICES = [
+        (BUILDING, 'Building'),
+        (ACTIVE, 'Active'),
+        (RETIRED, 'Retired'),
+    ]
+
+    # Chroma collection name; also the folder name for on-disk backends
+    name = models.CharField(max_length=128, unique=True)
+    # Short hash of `config`
+    version = models.CharField(max_length=32, db_index=True)
+    # {"embedding_model": ..., "splitter": "document", "chunk_tokens": ..., "chunk_overlap_tokens": ...}
+    # or, for the older character splitter, "chunk_size"/"chunk_overlap" instead of the token sizes
+    config = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=BUILDING, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "config": self.config,
+            "status": self.status,
+            "pdfs": self.entries.count() if self.pk else 0,
+            "activated_at": self.activated_at.isoformat() if self.activated_at else None,
+        }
+
+
+class IndexedPDF(models.Model):
+    """Records that a PDF's chunks are complete in an index (what reindex resumes from)."""
+    index = models.ForeignKey(VectorIndex, on_delete=models.CASCADE, related_name='entries')
+    pdf = models.ForeignKey(UploadedPDF, on_delete=models.CASCADE, related_name='index_entries')
+    chunks = models.IntegerField(default=0)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['index', 'pdf'], name='unique_index_pdf'),
+        ]
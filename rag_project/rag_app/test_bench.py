@@ -0,0 +1,116 @@
+"""
+Benchmark smoke tests: the ragbench hot paths at a tiny scale, offline
+(HashingEmbeddings, StubLLM, StubOllamaServer), so `manage.py test` catches a
+broken benchmark and gross regressions without a model or Ollama. For real
+numbers run `manage.py ragbench --json ...` and compare runs.
+"""
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .management.commands.ragbench import make_pdf, measure, split_text
+from .utils import text_splitter
+from .utils.llm import build_llm, get_llm, warm_llm
+from .utils.pdf_loader import extract_text_from_pdf
+from .utils.qa import PROMPT_PREFIX, PROMPT_TEMPLATE
+from .utils.stubs import HashingEmbeddings, StubLLM, StubOllamaServer
+
+
+@override_settings(RAG_VECTOR_BACKEND="numpy")
+class RagbenchTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # Token counts are estimated rather than fetching the embedding model's tokenizer
+        patcher = mock.patch.object(text_splitter, "load_tokenizer", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ragbench(self, **options):
+        out = StringIO()
+        call_command("ragbench", pages="2,6", corpus_sizes="60,120", queries=3, repeat=1,
+                     render_pages=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_runs_offline_and_writes_comparable_json(self):
+        path = os.path.join(self.tmp, "before.json")
+        self.ragbench(json_path=path)
+        with open(path) as f:
+            report = json.load(f)
+
+        self.assertEqual((report["meta"]["embeddings"], report["meta"]["llm"]), ("stub", "stub"))
+        results = report["results"]
+        for name in ("extract/2p", "split/6p", "create_vector_store/6p", "delete_from_vector_store/6p",
+                     "render/2p", "retrieval/dense/60", "retrieval/hybrid/120", "qa/120",
+                     "llm/ttft/new_client_cold", "llm/ttft/shared_prefix"):
+            self.assertIn(name, results)
+            self.assertGreater(results[name]["p50_ms"], 0)
+        self.assertIn("llm", results["qa/120"]["stages_p50_ms"])
+
+        output = self.ragbench(only="extract", compare=path)
+        self.assertIn(f"Change vs {path}", output)
+        self.assertIn("extract/6p", output)
+
+    def test_hot_paths_with_stubs(self):
+        path = os.path.join(self.tmp, "doc.pdf")
+        make_pdf(path, 4, seed=1)
+        pages = extract_text_from_pdf(path)
+        self.assertEqual([page["page"] for page in pages], [1, 2, 3, 4])
+        chunks = split_text(pages)
+        self.assertTrue(chunks)
+
+        embeddings = HashingEmbeddings()
+        result = measure(lambda: embeddings.embed_documents([c.page_content for c in chunks]), repeat=3)
+        self.assertEqual(result["runs"], 3)
+        self.assertLessEqual(result["min_ms"], result["p50_ms"])
+
+        answer = json.loads(StubLLM().invoke(f"Context:\n{chunks[0].page_content}").content)
+        self.assertTrue(answer["content"])
+
+
+def ttft_ms(llm, prompt):
+    start = time.perf_counter()
+    first = None
+    for chunk in llm.stream(prompt):
+        if first is None and chunk.content:
+            first = (time.perf_counter() - start) * 1000
+    return first
+
+
+class LlmTtftTests(SimpleTestCase):
+    def prompts(self, n):
+        return [PROMPT_PREFIX + PROMPT_TEMPLATE.format(context=f"[Page {i}] Part {i} needs {i} Nm.",
+                                                        question=f"What torque does part {i} need?")
+                for i in range(n)]
+
+    def test_warm_shared_client_beats_a_cold_one(self):
+        with StubOllamaServer(load_ms=150, prompt_ms_per_1k_chars=20) as server:
+            with override_settings(RAG_OLLAMA_BASE_URL=server.url, RAG_LLM_KEEP_ALIVE=0):
+                cold = [ttft_ms(build_llm(), prompt) for prompt in self.prompts(3)]
+            self.assertEqual(server.loads, 3)
+
+            server.reset()
+            with override_settings(RAG_OLLAMA_BASE_URL=server.url, RAG_LLM_KEEP_ALIVE="30m"):
+                warm_llm()
+                llm = get_llm()
+                warm = [ttft_ms(llm, prompt) for prompt in self.prompts(3)]
+            self.assertEqual(server.loads, 1)  # Only warm_llm() loaded the model
+            self.assertEqual(server.connections, 1)
+        self.assertLess(max(warm), min(cold))
+
+    def test_keep_alive_setting_reaches_ollama(self):
+        with StubOllamaServer() as server, \
+                mock.patch.object(server, "_prepare", wraps=server._prepare) as prepare, \
+                override_settings(RAG_OLLAMA_BASE_URL=server.url, RAG_LLM_KEEP_ALIVE="7m"):
+            llm = get_llm()
+            self.assertEqual(llm.keep_alive, "7m")
+            self.assertIs(get_llm(), llm)
+            llm.invoke("Hello")
+        self.assertEqual(prepare.call_args.args[1], "7m")
@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk
+
+from .apps import _is_serving
+from .management.commands.bench_embedding_backends import MIN_COSINE, cosines, make_texts
+from . import views
+from .models import IndexedPDF, IngestionJob, PDFPage, UploadedPDF, VectorIndex
+from .utils import index_state, ingestion, page_text, pdf_loader, qa, reindex, retrieval, text_splitter
+from .utils.answer_cache import AnswerCache, answer_cache, corpus_version
+from .utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+from .utils.embeddings import build_embeddings
+from .utils.concurrency import AdmissionQueue
+from .utils.context_builder import drop_near_duplicates, merge_adjacent, merge_overlap, pack_context
+from .utils.index_state import active_index
+from .utils.lexical_index import LexicalIndex, SegmentBuilder, open_lexical_index, tokenize
+from .utils.metrics import _Metric
+from .utils.registry import ResourceRegistry, registry
+from .utils.vector_backends import ChromaBackend, FaissBackend, NumpyBackend, QuantizedBackend
+from .utils.vector_store import build_partitioned, open_vectorstore
+from .utils.retrieval import rrf_fuse
+from .utils.stubs import HashingEmbeddings, StubLLM
+from .utils.summarizer import is_overview_question
+from .utils.text_splitter import Piece, _break_point, _overlap, iter_document_chunks
+from .utils.workers import POOL_WORKER_ENV, is_pool_worker, process_pool
+
+
+class ResourceRegistryTests(SimpleTestCase):
+    def test_config_is_rechecked_only_after_the_ttl(self):
+        registry = ResourceRegistry(config_ttl=60)
+        config_calls = []
+        key = ["a"]
+        registry.register("thing", lambda: object(), config=lambda: config_calls.append(1) or key[0])
+
+        first = registry.get("thing")
+        key[0] = "b"
+        self.assertIs(registry.get("thing"), first)
+        self.assertEqual(len(config_calls), 1)
+
+        registry.config_ttl = 0
+        self.assertIsNot(registry.get("thing"), first)
+        self.assertEqual(registry.stats()["thing"]["loads"], 2)
+
+    def test_reload_and_override_apply_immediately(self):
+        registry = ResourceRegistry(config_ttl=60)
+        registry.register("thing", lambda: object())
+        first = registry.get("thing")
+        registry.reload("thing")
+        second = registry.get("thing")
+        self.assertIsNot(second, first)
+
+        stub = object()
+        with registry.override("thing", stub):
+            self.assertIs(registry.get("thing"), stub)
+        self.assertIsNot(registry.get("thing"), stub)
+
+    def test_hit_counters_are_exact_under_concurrency(self):
+        registry = ResourceRegistry()
+        registry.register("thing", lambda: object())
+        registry.get("thing")
+
+        def hammer():
+            for _ in range(2000):
+                registry.get("thing")
+
+        threads = [threading.Thread(target=hammer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = registry.stats()["thing"]
+        self.assertEqual((stats["loads"], stats["hits"]), (1, 16000))
+
+
+@override_settings(RAG_INGEST_MODE="pool")
+class IngestionRecoveryTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ingestion, "dispatch")
+        self.dispatch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pdf = UploadedPDF.objects.create(file="pdfs/a.pdf")
+
+    def job(self, status, heartbeat_age=None):
+        heartbeat = None if heartbeat_age is None else timezone.now() - timedelta(seconds=heartbeat_age)
+        return IngestionJob.objects.create(pdf=self.pdf, status=status, heartbeat_at=heartbeat,
+                                           started_at=heartbeat)
+
+    def test_retry_accepts_failed_and_stale_running_jobs_only(self):
+        failed = self.job(IngestionJob.FAILED)
+        stale = self.job(IngestionJob.RUNNING, heartbeat_age=ingestion.STALE_AFTER_SECONDS + 60)
+        alive = self.job(IngestionJob.RUNNING, heartbeat_age=5)
+
+        self.assertTrue(ingestion.retry(failed))
+        self.assertTrue(ingestion.retry(stale))
+        self.assertFalse(ingestion.retry(alive))
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, IngestionJob.QUEUED)
+        self.assertEqual(self.dispatch.call_count, 2)
+
+    def test_recover_jobs_redispatches_orphaned_work(self):
+        queued = self.job(IngestionJob.QUEUED)
+        stale = self.job(IngestionJob.RUNNING, heartbeat_age=ingestion.STALE_AFTER_SECONDS + 60)
+        self.job(IngestionJob.RUNNING, heartbeat_age=5)
+        self.job(IngestionJob.DONE)
+
+        self.assertEqual(ingestion.recover_jobs(), 2)
+        self.assertEqual(sorted(call.args[0] for call in self.dispatch.call_args_list),
+                         sorted([queued.id, stale.id]))
+
+    @override_settings(RAG_INGEST_MODE="worker")
+    def test_recover_jobs_leaves_worker_mode_to_ingest_worker(self):
+        self.job(IngestionJob.QUEUED)
+        self.assertEqual(ingestion.recover_jobs(), 0)
+        self.dispatch.assert_not_called()
+
+
+class PoolWorkerTests(SimpleTestCase):
+    def test_pool_children_are_marked(self):
+        with process_pool(1) as pool:
+            self.assertTrue(pool.submit(is_pool_worker).result())
+
+    def test_marked_processes_never_warm_up(self):
+        with mock.patch.object(sys, "argv", ["uvicorn", "rag_project.asgi:application"]):
+            self.assertTrue(_is_serving())
+            with mock.patch.dict(os.environ, {POOL_WORKER_ENV: "1"}):
+                self.assertFalse(_is_serving())
+
+
+def write_pdf(path, pages):
+    """A PDF with one page per [(y, text), ...] list, on US-letter pages."""
+    import fitz
+
+    with fitz.open() as doc:
+        for lines in pages:
+            page = doc.new_page(width=612, height=792)
+            for y, text in lines:
+                page.insert_text((72, y), text, fontsize=11)
+        doc.save(path)
+    return path
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = write_pdf(os.path.join(tmp.name, "doc.pdf"), [
+            [(30, "ACME Corp - Confidential"), (300, f"Body text of page {n}."), (770, f"Page {n}")]
+            for n in range(1, 6)
+        ])
+
+    def test_repeated_headers_and_footers_are_stripped(self):
+        pages = pdf_loader.extract_pages(self.path, workers=1)
+        self.assertEqual([page["page"] for page in pages], [1, 2, 3, 4, 5])
+        self.assertEqual(pages[2]["text"], "Body text of page 3.")
+        self.assertEqual(pages[2]["stripped"], 2)
+
+    @override_settings(RAG_EXTRACT_PARALLEL_MIN_PAGES=1)
+    def test_serial_extraction_reads_the_open_document(self):
+        import fitz
+
+        with fitz.open(self.path) as doc, \
+                mock.patch.object(pdf_loader.fitz, "open") as reopen, \
+                mock.patch.object(pdf_loader, "process_pool") as pool:
+            pages = pdf_loader.extract_pages(self.path, workers=1, doc=doc)
+        reopen.assert_not_called()
+        pool.assert_not_called()
+        self.assertEqual(len(pages), 5)
+
+    def test_headers_are_detected_from_a_sample_and_pages_stream(self):
+        with mock.patch.object(pdf_loader, "HEADER_SAMPLE_PAGES", 3), \
+                mock.patch.object(pdf_loader, "extract_page", wraps=pdf_loader.extract_page) as extract_page:
+            pages = pdf_loader.iter_extracted_pages(self.path, workers=1)
+            first = next(pages)
+            self.assertLess(extract_page.call_count, 5)  # The sample (1, 3, 5) and the first range, not page 4
+            self.assertEqual(first["text"], "Body text of page 1.")
+            rest = list(pages)
+        self.assertEqual(extract_page.call_count, 5)  # Sampled pages aren't read twice
+        self.assertEqual([page["page"] for page in rest], [2, 3, 4, 5])
+        self.assertEqual(rest[2]["text"], "Body text of page 4.")
+        self.assertEqual(pdf_loader.sample_page_numbers(1000, 5), [1, 251, 501, 750, 1000])
+        self.assertEqual(pdf_loader.sample_page_numbers(4, 5), [1, 2, 3, 4])
+
+    @override_settings(RAG_EXTRACT_PARALLEL_MIN_PAGES=1)
+    def test_parallel_extraction_keeps_page_order(self):
+        progress = mock.Mock()
+        pages = pdf_loader.extract_pages(self.path, workers=2, progress=progress)
+        self.assertEqual([page["page"] for page in pages], [1, 2, 3, 4, 5])
+        self.assertEqual(pages[4]["text"], "Body text of page 5.")
+        self.assertEqual(progress.call_args.args, (5, 5))
+
+    def test_iter_pages_streams_without_a_pool(self):
+        with mock.patch.object(pdf_loader, "extract_pages") as extract_pages, \
+                mock.patch.object(pdf_loader, "process_pool") as pool:
+            pages = pdf_loader.iter_pages(self.path)
+            first = next(pages)
+            self.assertEqual(first["page"], 1)
+            self.assertIn("ACME Corp", first["text"])  # Headers need a sample of the document to detect
+            self.assertEqual(len(list(pages)), 4)
+        extract_pages.assert_not_called()
+        pool.assert_not_called()
+
+
+def doc(doc_id, text="", **metadata):
+    return Document(id=doc_id, page_content=text or doc_id, metadata=metadata)
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index = LexicalIndex(tmp.name)
+        for pdf_id, texts in ((1, ["Part XK-142 needs a torque of 40 Nm.", "The pump is serviced yearly.",
+                                   "Invoices are approved by finance."]),
+                              (2, ["Fire drills happen every quarter.", "The pump XK-142 manual."])):
+            builder = SegmentBuilder(pdf_id)
+            for n, text in enumerate(texts):
+                builder.add(f"pdf{pdf_id}_c{n}", n + 1, text)
+            self.index.write(builder)
+
+    def test_tokenize_keeps_identifiers_whole_and_split(self):
+        self.assertEqual(tokenize("What is part XK-142?"), ["part", "xk-142", "xk", "142"])
+
+    def test_bm25_ranks_exact_terms_and_respects_scope(self):
+        hits = self.index.search("torque for XK-142", k=3)
+        self.assertEqual(hits[0][:1] + hits[0][2:], ("pdf1_c0", 1, 1))
+        self.assertEqual({hit[0] for hit in hits}, {"pdf1_c0", "pdf2_c1"})
+        self.assertGreater(hits[0][1], hits[1][1])
+
+        self.assertEqual([hit[0] for hit in self.index.search("XK-142", pdf_ids={2})], ["pdf2_c1"])
+        self.assertEqual(self.index.search("stopwords are what the", k=3), [])
+
+    def test_deleted_segments_stop_matching(self):
+        self.index.delete([1])
+        self.assertEqual([hit[0] for hit in self.index.search("XK-142")], ["pdf2_c1"])
+        self.assertEqual(self.index.stats()["segments"], 1)
+
+
+class RrfFusionTests(SimpleTestCase):
+    def test_agreement_between_rankings_wins(self):
+        dense = [doc("a"), doc("b"), doc("c")]
+        lexical = [doc("c"), doc("d"), doc("a")]
+        # a: 1/61 + 1/63, c: 1/63 + 1/61 tie ahead of the single-list b and d
+        fused = [d.id for d in rrf_fuse([dense, lexical], [1.0, 1.0], 4)]
+        self.assertEqual(set(fused[:2]), {"a", "c"})
+        self.assertEqual(fused[2:], ["b", "d"])
+
+    def test_weights_shift_and_disable_rankings(self):
+        dense = [doc("a"), doc("b")]
+        lexical = [doc("b"), doc("c")]
+        self.assertEqual([d.id for d in rrf_fuse([dense, lexical], [1.0, 0], 3)], ["a", "b"])
+        self.assertEqual([d.id for d in rrf_fuse([dense, lexical], [0.2, 1.0], 1)], ["b"])
+        self.assertEqual([d.id for d in rrf_fuse([dense, lexical], [1.0, 0.01], 1)], ["a"])
+
+    def test_documents_without_ids_are_matched_by_content(self):
+        first = Document(page_content="same", metadata={"pdf_id": 1, "page": 2})
+        second = Document(page_content="same", metadata={"pdf_id": 1, "page": 2})
+        fused = rrf_fuse([[first], [second, doc("x")]], [1.0, 1.0], 5)
+        self.assertEqual(len(fused), 2)
+        self.assertIs(fused[0], first)
+
+
+class WordCounter:
+    """One token per word, so chunk sizes are easy to reason about."""
+
+    def count(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+def piece(tokens, paragraph_start=False, heading=False):
+    return Piece(1, 0, 0, tokens, paragraph_start, heading)
+
+
+class DocumentChunkerTests(SimpleTestCase):
+    def test_break_point_prefers_the_last_paragraph_start_past_half(self):
+        window = [piece(10, True), piece(10), piece(10, True), piece(10, True)]
+        self.assertEqual(_break_point(window, 40), 3)
+        # Paragraph starts before the half-way mark don't count
+        self.assertEqual(_break_point(window, 100), 4)
+        self.assertEqual(_break_point([piece(10), piece(10), piece(10)], 30), 3)
+
+    def test_break_point_never_ends_on_a_heading(self):
+        window = [piece(10, True), piece(10), piece(2, True, heading=True), piece(10, True)]
+        self.assertEqual(_break_point(window, 40), 2)
+
+    def test_overlap_takes_whole_trailing_sentences(self):
+        pieces = [piece(5), piece(5), piece(5)]
+        self.assertEqual(_overlap(pieces, 12), pieces[1:])
+        self.assertEqual(_overlap(pieces, 4), [])
+        # Nothing from before a heading is carried over
+        pieces = [piece(2), piece(2, heading=True), piece(2)]
+        self.assertEqual(_overlap(pieces, 10), pieces[2:])
+
+    def test_chunks_carry_page_ranges_and_offsets(self):
+        sentence = "The pump runs at a steady rate of flow."  # 9 words
+        pages = [
+            {"page": 1, "text": "\n\n".join(" ".join([sentence] * 3) for _ in range(2))},
+            # Starts lower case: the paragraph carries on from page 1
+            {"page": 2, "text": "and then it stops. " + " ".join([sentence] * 4)},
+            {"page": 3, "text": ""},
+            {"page": 4, "text": " ".join([sentence] * 2)},
+        ]
+        texts = {page["page"]: page["text"] for page in pages}
+        chunks = list(iter_document_chunks(pages, chunk_tokens=40, overlap_tokens=10, counter=WordCounter()))
+
+        self.assertGreater(len(chunks), 3)
+        for chunk in chunks:
+            meta = chunk.metadata
+            self.assertLessEqual(meta["tokens"], 38)
+            self.assertEqual(meta["page"], meta["page_start"])
+            self.assertLessEqual(meta["page_start"], meta["page_end"])
+            self.assertTrue(chunk.page_content.startswith(texts[meta["page_start"]][meta["start"]:][:20]))
+            self.assertTrue(chunk.page_content.endswith(texts[meta["page_end"]][:meta["end"]][-20:]))
+        self.assertTrue(any(c.metadata["page_start"] < c.metadata["page_end"] for c in chunks))
+        self.assertEqual(chunks[-1].metadata["page_end"], 4)
+        # Consecutive chunks overlap by a trailing sentence
+        self.assertTrue(chunks[1].page_content.startswith(sentence))
+
+
+class ContextBuilderTests(SimpleTestCase):
+    def test_merge_overlap_drops_repeated_text(self):
+        self.assertEqual(merge_overlap("The pump runs. It stops", "It stops at night."),
+                         "The pump runs. It stops at night.")
+        self.assertEqual(merge_overlap("First part.", "Second part."), "First part. Second part.")
+
+    def test_adjacent_chunks_merge_with_their_page_ranges(self):
+        docs = [
+            doc("pdf3_c8", "Valves are checked. Seals are replaced.", page=5, page_start=5, page_end=6,
+                start=100, end=40),
+            doc("pdf9_c1", "Unrelated text.", page=1, page_start=1, page_end=1, start=0, end=15),
+            doc("pdf3_c7", "Pumps are cleaned. Valves are checked.", page=4, page_start=4, page_end=5,
+                start=10, end=120),
+        ]
+        merged, merges = merge_adjacent(docs)
+        self.assertEqual(merges, 1)
+        self.assertEqual([d.id for d in merged], ["pdf3_c8", "pdf9_c1"])  # Keeps the best member's rank
+        meta = merged[0].metadata
+        self.assertEqual(merged[0].page_content, "Pumps are cleaned. Valves are checked. Seals are replaced.")
+        self.assertEqual((meta["page"], meta["page_start"], meta["start"], meta["page_end"], meta["end"]),
+                         (4, 4, 10, 6, 40))
+
+    def test_per_page_chunks_merge_only_on_the_same_page(self):
+        docs = [doc("pdf3_c1", "Alpha beta.", page=1), doc("pdf3_c2", "Gamma delta.", page=2)]
+        merged, merges = merge_adjacent(docs)
+        self.assertEqual(merges, 0)
+        self.assertEqual(len(merged), 2)
+
+    def test_minhash_drops_near_duplicates_only(self):
+        text = " ".join(f"word{i}" for i in range(60))
+        docs = [
+            doc("pdf1_c0", text),
+            doc("pdf2_c0", text.replace("word30", "other")),  # The same chunk in a re-uploaded PDF
+            doc("pdf1_c9", text[: len(text) // 2]),  # Contained in the first one
+            doc("pdf4_c0", " ".join(f"term{i}" for i in range(60))),
+        ]
+        kept, duplicates = drop_near_duplicates(docs, 0.8)
+        self.assertEqual([d.id for d in kept], ["pdf1_c0", "pdf4_c0"])
+        self.assertEqual(duplicates, 2)
+
+    def test_pack_context_reports_what_it_saved(self):
+        text = " ".join(f"word{i}" for i in range(60))
+        docs = [doc("pdf1_c0", text, page=1), doc("pdf2_c0", text, page=1), doc("pdf1_c1", "Short tail.", page=1)]
+        packed, stats = pack_context(docs, token_budget=1000, dedup_threshold=0.8)
+        self.assertEqual([d.id for d in packed], ["pdf1_c0"])
+        self.assertEqual((stats["merged"], stats["duplicates"]), (1, 1))
+        self.assertGreater(stats["tokens_saved"], 0)
+
+
+def fill(store, vectors, pdfs=4):
+    ids = [f"pdf{n % pdfs + 1}_c{n}" for n in range(len(vectors))]
+    store.add_embeddings(ids=ids, embeddings=vectors.tolist(), texts=ids,
+                         metadatas=[{"pdf_id": n % pdfs + 1, "page": 1} for n in range(len(vectors))])
+    store.persist()
+
+
+def search_ids(store, queries, k, filter=None):
+    return [[doc.id for doc, _ in hits]
+            for hits in store.similarity_search_by_vectors_with_scores(queries, k=k, filter=filter)]
+
+
+class QuantizedBackendTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        rng = np.random.default_rng(7)
+        # Topic clusters, like chunks of the same documents
+        centres = rng.standard_normal((30, 96))
+        self.vectors = (centres[rng.integers(0, 30, 1500)] + rng.standard_normal((1500, 96)) * 0.6).astype(np.float32)
+        # Queries near stored rows, as real questions are near their answers
+        self.queries = self.vectors[rng.choice(len(self.vectors), 20, replace=False)]
+        self.queries = self.queries + rng.standard_normal(self.queries.shape).astype(np.float32) * 0.3
+        self.exact = NumpyBackend(os.path.join(self.tmp, "exact"), HashingEmbeddings(96))
+        fill(self.exact, self.vectors)
+
+    def quantized(self, codes):
+        store = QuantizedBackend(os.path.join(self.tmp, codes), HashingEmbeddings(96), codes=codes)
+        fill(store, self.vectors)
+        return store
+
+    def test_int8_top_k_matches_exact_search(self):
+        store = self.quantized("int8")
+        self.assertEqual(search_ids(store, self.queries, 10), search_ids(self.exact, self.queries, 10))
+        scoped = {"pdf_id": {"$in": [2, 3]}}
+        self.assertEqual(search_ids(store, self.queries, 5, scoped), search_ids(self.exact, self.queries, 5, scoped))
+        # The codes are a quarter of the float32 matrix (plus a scale per row)
+        self.assertLess(store.search_bytes(), self.exact.search_bytes() / 3)
+
+    def test_binary_candidates_are_rescored_exactly(self):
+        store = self.quantized("binary")
+        exact = self.exact.similarity_search_by_vectors_with_scores(self.queries, k=10)
+        found = store.similarity_search_by_vectors_with_scores(self.queries, k=10)
+        recall = np.mean([len({d.id for d, _ in a} & {d.id for d, _ in b}) / 10 for a, b in zip(exact, found)])
+        self.assertGreaterEqual(recall, 0.9)
+        for exact_hits, hits in zip(exact, found):
+            self.assertEqual(hits[0][0].id, exact_hits[0][0].id)
+            exact_scores = {doc.id: score for doc, score in exact_hits}
+            for doc, score in hits:
+                if doc.id in exact_scores:
+                    self.assertAlmostEqual(score, exact_scores[doc.id], places=5)
+        self.assertLess(store.search_bytes(), self.exact.search_bytes() / 25)
+
+    def test_codes_survive_a_reopen_and_cover_new_rows(self):
+        self.quantized("int8")
+        reopened = QuantizedBackend(os.path.join(self.tmp, "int8"), HashingEmbeddings(96), codes="int8")
+        extra = -self.vectors[:1]
+        reopened.add_embeddings(ids=["pdf9_c0"], embeddings=extra.tolist(), texts=["new"],
+                                metadatas=[{"pdf_id": 9, "page": 1}])
+        self.assertEqual(search_ids(reopened, extra, 1), [["pdf9_c0"]])
+        self.assertEqual(search_ids(reopened, self.queries, 10), search_ids(self.exact, self.queries, 10))
+
+
+class PartitionedBackendTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        rng = np.random.default_rng(3)
+        self.vectors = rng.standard_normal((400, 32)).astype(np.float32)
+        self.queries = rng.standard_normal((5, 32)).astype(np.float32)
+        self.embedding = HashingEmbeddings(32)
+        self.whole = NumpyBackend(os.path.join(self.tmp, "whole"), self.embedding)
+        fill(self.whole, self.vectors, pdfs=8)
+
+    def partitioned(self, group_size):
+        directory = os.path.join(self.tmp, f"groups{group_size}")
+        store = build_partitioned(lambda path, name: NumpyBackend(path, self.embedding), "numpy", directory,
+                                  "index", group_size, self.embedding)
+        fill(store, self.vectors, pdfs=8)
+        return store, directory
+
+    def test_fan_out_matches_one_shared_store(self):
+        for group_size in (1, 3):
+            store, directory = self.partitioned(group_size)
+            self.assertEqual(len(os.listdir(directory)), len({pdf_id // group_size for pdf_id in range(1, 9)}))
+            self.assertEqual(store.count(), 400)
+            self.assertEqual(search_ids(store, self.queries, 7), search_ids(self.whole, self.queries, 7))
+            for scope in ({"pdf_id": 5}, {"pdf_id": {"$in": [2, 3, 7]}}):
+                self.assertEqual(search_ids(store, self.queries, 7, scope),
+                                 search_ids(self.whole, self.queries, 7, scope))
+
+    def test_scoped_reads_touch_only_their_partitions(self):
+        store, _ = self.partitioned(1)
+        opened = []
+        open_partition = store.open_partition
+        store.open_partition = lambda key: opened.append(key) or open_partition(key)
+        store._stores.clear()
+
+        store.similarity_search_by_vectors(self.queries, k=3, filter={"pdf_id": 4})
+        self.assertEqual(opened, [4])
+        found = store.get(ids=["pdf2_c1", "pdf6_c5"])
+        self.assertEqual(sorted(found["ids"]), ["pdf2_c1", "pdf6_c5"])
+        self.assertEqual(sorted(opened), [2, 4, 6])
+
+    def test_deleting_a_pdf_drops_its_partition(self):
+        store, directory = self.partitioned(1)
+        store.delete(where={"pdf_id": 3})
+        self.assertNotIn("p3", os.listdir(directory))
+        self.assertEqual(store.count(), 350)
+        self.assertFalse(any(doc.metadata["pdf_id"] == 3
+                             for hits in store.similarity_search_by_vectors(self.queries, k=50) for doc in hits))
+
+        grouped, directory = self.partitioned(3)
+        grouped.delete(where={"pdf_id": 3})  # Shares partition 1 with pdf 4 and 5
+        self.assertIn("p1", os.listdir(directory))
+        self.assertEqual(grouped.get(where={"pdf_id": 3})["ids"], [])
+        self.assertEqual(len(grouped.get(where={"pdf_id": 4})["ids"]), 50)
+
+    def test_partition_list_is_cached_between_writes(self):
+        store, _ = self.partitioned(1)
+        listings = []
+        list_partitions = store.list_partitions
+        store.list_partitions = lambda: listings.append(1) or list_partitions()
+        store._partitions = None
+
+        for _ in range(3):
+            store.similarity_search_by_vectors(self.queries, k=3)
+        self.assertEqual(len(listings), 1)
+
+        store.add_embeddings(ids=["pdf20_c0"], embeddings=[self.queries[0].tolist()], texts=["new"],
+                             metadatas=[{"pdf_id": 20, "page": 1}])
+        self.assertEqual(search_ids(store, self.queries[:1], 1), [["pdf20_c0"]])
+        store.delete(where={"pdf_id": 20})
+        self.assertNotEqual(search_ids(store, self.queries[:1], 1), [["pdf20_c0"]])
+        self.assertEqual(len(listings), 1)
+
+
+def installed(*modules):
+    return all(importlib.util.find_spec(module) for module in modules)
+
+
+
+class BackendRoundTripTests(SimpleTestCase):
+    """Every RAG_VECTOR_BACKEND: add, search against exact cosine, delete by PDF, reopen from disk."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        rng = np.random.default_rng(11)
+        centres = rng.standard_normal((8, 32))
+        vectors = centres[rng.integers(0, 8, 400)] + rng.standard_normal((400, 32)) * 0.5
+        # Unit length, so Chroma's default L2 distance ranks like cosine
+        self.vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+        self.queries = self.vectors[rng.choice(400, 10, replace=False)] + rng.standard_normal((10, 32)) * 0.1
+        self.queries = self.queries.astype(np.float32)
+        self.embedding = HashingEmbeddings(32)
+
+    def exact_ids(self, k, without_pdf=None):
+        ids = np.array([f"pdf{n % 4 + 1}_c{n}" for n in range(len(self.vectors))])
+        queries = self.queries / np.linalg.norm(self.queries, axis=1, keepdims=True)
+        scores = queries @ self.vectors.T
+        if without_pdf is not None:
+            scores[:, np.arange(len(self.vectors)) % 4 + 1 == without_pdf] = -np.inf
+        return [list(ids[np.argsort(-row, kind="stable")[:k]]) for row in scores]
+
+    def assert_matches(self, found, expected, exact):
+        if exact:
+            self.assertEqual(found, expected)
+        else:
+            recall = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)])
+            self.assertGreaterEqual(recall, 0.8)
+
+    def assert_round_trip(self, build, exact=True):
+        store = build()
+        fill(store, self.vectors)
+        self.assertEqual(store.count(), 400)
+        self.assert_matches(search_ids(store, self.queries, 5), self.exact_ids(5), exact)
+        # Scoped searches are exact on every backend
+        scoped = {"pdf_id": 3}
+        self.assertEqual({pdf_id for hits in store.similarity_search_by_vectors(self.queries, k=5, filter=scoped)
+                          for pdf_id in (doc.metadata["pdf_id"] for doc in hits)}, {3})
+
+        store.delete(where={"pdf_id": 2})
+        store.persist()
+        self.assertEqual(store.get(where={"pdf_id": 2})["ids"], [])
+
+        reopened = build()
+        self.assertEqual(reopened.count(), 300)
+        self.assert_matches(search_ids(reopened, self.queries, 5), self.exact_ids(5, without_pdf=2), exact)
+
+    def test_numpy(self):
+        self.assert_round_trip(lambda: NumpyBackend(os.path.join(self.tmp, "numpy"), self.embedding))
+
+    @skipUnless(installed("faiss"), "needs faiss")
+    def test_faiss_flat(self):
+        self.assert_round_trip(lambda: FaissBackend(os.path.join(self.tmp, "flat"), self.embedding))
+
+    @skipUnless(installed("faiss"), "needs faiss")
+    def test_faiss_ivf(self):
+        # Few enough lists for 400 vectors to train them (it is exact below that)
+        self.assert_round_trip(lambda: FaissBackend(os.path.join(self.tmp, "ivf"), self.embedding,
+                                                    index_type="ivf", nlist=4), exact=False)
+
+    @skipUnless(installed("faiss"), "needs faiss")
+    def test_faiss_hnsw(self):
+        self.assert_round_trip(lambda: FaissBackend(os.path.join(self.tmp, "hnsw"), self.embedding,
+                                                    index_type="hnsw"), exact=False)
+
+    @skipUnless(installed("chromadb", "langchain_chroma"), "needs chromadb and langchain-chroma")
+    def test_chroma(self):
+        self.assert_round_trip(lambda: ChromaBackend("round_trip", os.path.join(self.tmp, "chroma"),
+                                                     self.embedding))
+
+
+@skipUnless(installed("onnxruntime", "sentence_transformers"), "needs onnxruntime and sentence-transformers")
+@override_settings(RAG_EMBEDDING_CACHE_PATH=None)
+class OnnxEmbeddingTests(SimpleTestCase):
+    model = "sentence-transformers/all-MiniLM-L6-v2"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        texts, queries = make_texts(40, seed=1)
+        cls.texts = texts + queries[:10]
+        with override_settings(RAG_EMBEDDING_BACKEND="torch"):
+            cls.reference = np.asarray(build_embeddings(cls.model).embed_documents(cls.texts))
+
+    def assert_matches_torch(self, quantize):
+        with override_settings(RAG_EMBEDDING_BACKEND="onnx", RAG_ONNX_QUANTIZE=quantize):
+            vectors = np.asarray(build_embeddings(self.model).embed_documents(self.texts))
+        self.assertGreater(cosines(self.reference, vectors).min(), MIN_COSINE)
+
+    def test_onnx_vectors_match_torch(self):
+        self.assert_matches_torch(False)
+
+    @skipUnless(installed("onnx"), "int8 quantization needs onnx")
+    def test_int8_onnx_vectors_match_torch(self):
+        self.assert_matches_torch(True)
+
+
+def page_lines(text, words_per_line=10):
+    """A page's text as write_pdf lines, wrapped so it stays on the page."""
+    words = text.split()
+    return [(72 + 14 * n, " ".join(words[i:i + words_per_line]))
+            for n, i in enumerate(range(0, len(words), words_per_line))]
+
+
+class PipelineTestCase(TransactionTestCase):
+    """
+    Uploads run the real ingestion pipeline inline, offline: numpy vectors,
+    lexical segments and media files in a temp dir, HashingEmbeddings, and
+    token counts estimated instead of fetching the model's tokenizer.
+
+    Rows are committed (no TestCase transaction) so that the thread pools of
+    the async views, batch answers and summaries can read them.
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        overrides = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp, "media"),
+            RAG_VECTOR_BACKEND="numpy",
+            RAG_NUMPY_INDEX_DIR=os.path.join(self.tmp, "numpy_index"),
+            RAG_LEXICAL_INDEX_DIR=os.path.join(self.tmp, "lexical_index"),
+            RAG_EMBEDDING_CACHE_PATH=None,
+            RAG_SUMMARY_CACHE_PATH=None,
+            RAG_SUMMARY_ENABLED=False,
+            RAG_INGEST_MODE="sync",
+            RAG_PAGE_RENDER_MODE="lazy",
+            RAG_VECTOR_PARTITION_SIZE=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.embeddings = HashingEmbeddings()
+        self.enterContext(registry.override("embeddings", self.embeddings))
+        self.enterContext(mock.patch.object(text_splitter, "load_tokenizer", return_value=None))
+        index_state._cache.update(index=None, expires=0.0)
+        self.addCleanup(index_state._cache.update, index=None, expires=0.0)
+        answer_cache.invalidate()
+
+    def upload(self, name, pages=None, same_as=None):
+        """
+        Saves a PDF with one page per text (or a byte-for-byte copy of the
+        `same_as` upload) and ingests it. Returns the UploadedPDF.
+        """
+        path = os.path.join(settings.MEDIA_ROOT, "pdfs", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if same_as is not None:
+            shutil.copyfile(same_as.file.path, path)
+        else:
+            write_pdf(path, [page_lines(text) for text in pages])
+        pdf = UploadedPDF.objects.create(file=f"pdfs/{name}")
+        job = ingestion.enqueue(pdf)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.DONE, job.error)
+        pdf.refresh_from_db()
+        return pdf
+
+    def search_pdf_ids(self, question, pdf_id="all", k=1):
+        return {doc.metadata["pdf_id"] for doc in retrieval.search(question, pdf_id, k)}
+
+
+PUMP_MANUAL = ["The hydraulic pump needs servicing every 500 hours of operation.",
+               "Replace the pump filter cartridge when the pressure gauge reads red."]
+BOILER_MANUAL = ["The boiler burner ignites after a thirty second purge cycle.",
+                 "Descale the boiler heat exchanger once a year with citric acid."]
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+class ReindexTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        reindex._embedders.clear()
+        self.addCleanup(reindex._embedders.clear)
+        self.enterContext(mock.patch.object(reindex, "build_embeddings", return_value=self.embeddings))
+
+    def stored_pdf_ids(self, index):
+        return {meta["pdf_id"] for meta in open_vectorstore(index).get(include=("metadatas",))["metadatas"]}
+
+    def lexical_pdf_ids(self, index, question):
+        return {hit[2] for hit in open_lexical_index(index).search(question)}
+
+    def serving(self):
+        # The reindex command's switch reaches other processes within ACTIVE_TTL
+        registry.reload()
+        return active_index(refresh=True)
+
+    def test_pdfs_from_before_the_job_queue_survive_a_reindex(self):
+        pdf = UploadedPDF.objects.create(file="pdfs/old.pdf")
+        path = os.path.join(settings.MEDIA_ROOT, "pdfs", "old.pdf")
+        os.makedirs(os.path.dirname(path))
+        write_pdf(path, [page_lines(text) for text in PUMP_MANUAL])
+
+        legacy = active_index(refresh=True)
+        self.assertEqual(legacy.config["splitter"], index_state.LEGACY_SPLITTER)
+        self.assertTrue(legacy.entries.filter(pdf=pdf).exists())
+        ingestion.run_pipeline(pdf, quiet)  # What the pre-queue upload view did
+
+        self.assertEqual(reindex.plan(dry_run=True).stale, [pdf.id])
+        new = reindex.run(workers=1, log=quiet)
+        self.assertNotEqual(new.pk, legacy.pk)
+        self.assertEqual(new.config["splitter"], "document")
+        self.assertEqual(self.serving().pk, new.pk)
+        self.assertEqual(self.search_pdf_ids("How often does the hydraulic pump need servicing?"), {pdf.id})
+
+    def test_shadow_build_resumes_and_switches_atomically(self):
+        pump = self.upload("pump.pdf", PUMP_MANUAL)
+        boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+        old = active_index(refresh=True)
+        self.assertEqual(old.entries.count(), 2)
+
+        with override_settings(RAG_CHUNK_TOKENS=64):
+            building = reindex.plan()
+            self.assertTrue(building.switch)
+            self.assertEqual(building.index.status, VectorIndex.BUILDING)
+            self.assertEqual(building.stale, [pump.id, boiler.id])
+
+            # Interrupted after the first PDF: the old index keeps serving
+            reindex.fill(building.index, building.stale[:1], workers=1)
+            self.assertEqual(self.stored_pdf_ids(building.index), {pump.id})
+            self.assertEqual(self.serving().pk, old.pk)
+            self.assertEqual(self.search_pdf_ids("boiler burner purge cycle"), {boiler.id})
+
+            with mock.patch.object(reindex, "fill", wraps=reindex.fill) as fill:
+                new = reindex.run(workers=1, log=quiet)
+            self.assertEqual(new.pk, building.index.pk)
+            self.assertEqual([call.args[1] for call in fill.call_args_list], [[boiler.id]])
+
+        self.assertEqual(list(VectorIndex.objects.filter(status=VectorIndex.ACTIVE)), [new])
+        old.refresh_from_db()
+        self.assertEqual(old.status, VectorIndex.RETIRED)
+        self.assertEqual(self.stored_pdf_ids(new), {pump.id, boiler.id})
+        self.assertEqual(self.serving().pk, new.pk)
+        self.assertEqual(self.search_pdf_ids("Descale the boiler heat exchanger"), {boiler.id})
+
+    def test_deletes_reach_the_index_being_built(self):
+        pump = self.upload("pump.pdf", PUMP_MANUAL)
+        boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+
+        with override_settings(RAG_CHUNK_TOKENS=64):
+            building = reindex.plan().index
+            reindex.fill(building, [pump.id], workers=1)
+            views._delete_pdfs([pump])
+            self.assertEqual(self.stored_pdf_ids(building), set())
+            self.assertEqual(self.lexical_pdf_ids(building, "hydraulic pump filter"), set())
+
+            # Deleted while its chunks were being embedded
+            embed_pdf = reindex.embed_pdf
+
+            def embed_then_delete(pdf_id, *args):
+                result = embed_pdf(pdf_id, *args)
+                views._delete_pdfs([UploadedPDF.objects.get(id=pdf_id)])
+                return result
+
+            with mock.patch.object(reindex, "embed_pdf", embed_then_delete):
+                reindex.fill(building, [boiler.id], workers=1)
+            self.assertEqual(self.stored_pdf_ids(building), set())
+            self.assertEqual(self.lexical_pdf_ids(building, "boiler burner purge"), set())
+            self.assertFalse(building.entries.exists())
+            self.assertEqual(reindex.plan().stale, [])
+
+
+class SummaryTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(RAG_SUMMARY_ENABLED=True, RAG_SUMMARY_SECTION_CHARS=80,
+                                            RAG_SUMMARY_FAN_IN=2))
+        self.llm = StubLLM()
+        self.enterContext(registry.override("llm", self.llm))
+        self.invoke = self.enterContext(mock.patch.object(self.llm, "invoke", wraps=self.llm.invoke))
+
+    def test_overview_questions_must_be_about_the_whole_document(self):
+        for question in ("What is this document about?", "Summarize the PDF.", "TL;DR?",
+                         "What are the main points of this paper?", "Give me an overview of the report"):
+            self.assertTrue(is_overview_question(question), question)
+        for question in ("What is the gist of clause 7?", "main points of section 3",
+                         "Summarize page 4 of the document", "What is the summary of the penalties?",
+                         "What does the report say about penalties?"):
+            self.assertFalse(is_overview_question(question), question)
+
+    def test_sections_are_mapped_and_reduced_into_one_summary(self):
+        pump = self.upload("pump.pdf", PUMP_MANUAL + BOILER_MANUAL)
+        # Four sections of one page each, then 2 + 1 combining calls
+        self.assertEqual(self.invoke.call_count, 7)
+        self.assertTrue(pump.summary)
+        job = pump.latest_job
+        self.assertEqual(job.status, IngestionJob.DONE)
+        self.assertEqual(job.progress["summarize"], {"done": 7, "total": 7})
+        self.assertIn("summarize", job.timings)
+
+    def test_a_duplicate_upload_reuses_the_summary(self):
+        first = self.upload("pump.pdf", PUMP_MANUAL)
+        calls = self.invoke.call_count
+        copy = self.upload("pump-copy.pdf", same_as=first)
+        self.assertEqual(self.invoke.call_count, calls)
+        self.assertEqual(copy.summary, first.summary)
+        self.assertEqual(copy.latest_job.progress["summarize"]["reused_from"], first.id)
+
+    def test_a_failed_summary_leaves_the_job_done(self):
+        statuses = []
+
+        def unavailable(prompt, **kwargs):
+            statuses.append(IngestionJob.objects.get().status)
+            raise ConnectionError("Ollama is not running")
+
+        self.invoke.side_effect = unavailable
+        pump = self.upload("pump.pdf", PUMP_MANUAL)
+        self.assertEqual(set(statuses), {IngestionJob.DONE})  # Searchable before the summary starts
+        self.assertIsNone(pump.summary)
+        job = pump.latest_job
+        self.assertEqual(job.status, IngestionJob.DONE)
+        self.assertEqual(job.progress["summarize"]["error"], "Ollama is not running")
+        self.assertEqual(self.search_pdf_ids("hydraulic pump servicing"), {pump.id})
+
+    def test_overview_questions_about_one_pdf_get_its_summary(self):
+        pump = self.upload("pump.pdf", PUMP_MANUAL)
+        answer = qa.summary_answer("What is this document about?", "all")
+        self.assertTrue(answer["summary"])
+        self.assertEqual(answer["answer"]["content"], pump.summary)
+        self.assertIsNone(qa.summary_answer("How often does the pump need servicing?", "all"))
+
+        boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+        self.assertIsNone(qa.summary_answer("What is this document about?", "all"))
+        answer = qa.summary_answer("What is this document about?", str(boiler.id))
+        self.assertEqual(answer["answer"]["content"], boiler.summary)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(max_entries=3, ttl=60, threshold=0.9)
+
+    def test_exact_hits_ignore_case_and_trailing_punctuation(self):
+        self.cache.put("What is the torque?", "all", 1, {"answer": "40 Nm"})
+        self.assertEqual(self.cache.get("  what is the TORQUE", "all", 1), ({"answer": "40 Nm"}, "exact"))
+        self.assertEqual(self.cache.get("What is the torque?", "7", 1), (None, None))
+        self.assertEqual(self.cache.get("What is the torque?", "all", 2), (None, None))
+
+    def test_semantic_hits_need_the_threshold(self):
+        self.cache.put("What is the torque?", "all", 1, {"answer": "40 Nm"}, embedding=[1.0, 0.0])
+        close = [0.95, np.sqrt(1 - 0.95 ** 2)]
+        far = [0.85, np.sqrt(1 - 0.85 ** 2)]
+        self.assertEqual(self.cache.get("Torque value?", "all", 1, embed=lambda: close),
+                         ({"answer": "40 Nm"}, "semantic"))
+        self.assertEqual(self.cache.get("Bolt size?", "all", 1, embed=lambda: far), (None, None))
+        self.assertEqual(self.cache.get("Torque value?", "all", 2, embed=lambda: close), (None, None))
+        stats = self.cache.stats()
+        self.assertEqual((stats["semantic_hits"], stats["misses"]), (1, 2))
+
+    def test_entries_expire_after_the_ttl(self):
+        now = 1000.0
+        with mock.patch("rag_app.utils.answer_cache.time.time", side_effect=lambda: now):
+            self.cache.put("q", "all", 1, {"answer": "a"}, embedding=[1.0, 0.0])
+            now += 59
+            self.assertEqual(self.cache.get("q", "all", 1)[1], "exact")
+            now += 2
+            self.assertEqual(self.cache.get("q", "all", 1), (None, None))
+            self.assertEqual(self.cache.get("q?", "all", 1, embed=lambda: [1.0, 0.0]), (None, None))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for question in ("a", "b", "c"):
+            self.cache.put(question, "all", 1, question)
+        self.cache.get("a", "all", 1)
+        self.cache.put("d", "all", 1, "d")
+        self.assertEqual([self.cache.get(q, "all", 1)[0] for q in ("a", "b", "c", "d")], ["a", None, "c", "d"])
+
+    def test_a_missing_scope_means_all_pdfs(self):
+        self.cache.put("q", None, 1, "a")
+        self.assertEqual(self.cache.get("q", "all", 1)[0], "a")
+        self.cache.invalidate([5])
+        self.assertEqual(self.cache.get("q", None, 1), (None, None))
+
+    def test_invalidate_drops_the_pdf_and_all_scopes(self):
+        for scope in ("all", "1", "2"):
+            self.cache.put("q", scope, 1, scope)
+        self.cache.invalidate([1])
+        self.assertEqual([self.cache.get("q", scope, 1)[0] for scope in ("all", "1", "2")], [None, None, "2"])
+
+
+class AnswerCacheVersionTests(PipelineTestCase):
+    def test_ingest_and_delete_change_the_corpus_version(self):
+        pump = self.upload("pump.pdf", PUMP_MANUAL)
+        versions = [corpus_version("all"), corpus_version(pump.id)]
+        self.assertEqual(corpus_version(None), versions[0])
+        answer_cache.put("q", "all", versions[0], {"answer": "cached"})
+        answer_cache.put("q", str(pump.id), versions[1], {"answer": "cached"})
+
+        boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+        self.assertNotEqual(corpus_version("all"), versions[0])
+        self.assertEqual(corpus_version(pump.id), versions[1])  # Other PDFs' entries stay valid
+        self.assertEqual(answer_cache.get("q", "all", versions[0]), (None, None))  # Dropped by the ingest
+        self.assertEqual(answer_cache.get("q", str(pump.id), versions[1])[1], "exact")
+
+        before = corpus_version("all")
+        views._delete_pdfs([boiler])
+        self.assertNotEqual(corpus_version("all"), before)
+        views._delete_pdfs([pump])
+        self.assertNotEqual(corpus_version(pump.id), versions[1])
+        self.assertEqual(answer_cache.get("q", str(pump.id), versions[1]), (None, None))
+
+
+async def read_stream(response):
+    return b"".join([part async for part in response.streaming_content]).decode("utf-8")
+
+
+class AskQuestionViewTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(registry.override("llm", StubLLM()))
+        self.pump = self.upload("pump.pdf", PUMP_MANUAL)
+        self.boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+
+    async def test_async_view_answers_through_the_asgi_client(self):
+        response = await self.async_client.get("/ask_question/", {"q": "When does the burner ignite?",
+                                                                  "pdf_id": str(self.boiler.id)})
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload["answer"]["title"], "Stub answer")
+        self.assertIn("burner", payload["answer"]["content"])
+        self.assertIsNotNone(payload["page_number"])
+        self.assertTrue(payload["pdf_url"].endswith("boiler.pdf"))
+        self.assertIn("llm", payload["timings"])
+
+        again = await self.async_client.get("/ask_question/", {"q": "when does the burner ignite",
+                                                               "pdf_id": str(self.boiler.id)})
+        self.assertEqual(again.json()["cached"], "exact")
+
+    async def test_a_full_admission_queue_answers_503(self):
+        queue = AdmissionQueue(limit=1, max_waiting=0, timeout=1)
+        with mock.patch.object(qa, "llm_admission", queue):
+            async with queue:  # The only LLM slot is taken and nobody may wait
+                response = await self.async_client.get("/ask_question/", {"q": "How often is the pump serviced?"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(response.json()["answer"]["title"], "Busy")
+        self.assertEqual(queue.rejected, 1)
+
+    async def test_missing_question_is_rejected(self):
+        response = await self.async_client.get("/ask_question/")
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchViewTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = StubLLM()
+        self.enterContext(registry.override("llm", self.llm))
+        self.invoke = self.enterContext(mock.patch.object(self.llm, "invoke", wraps=self.llm.invoke))
+        self.pump = self.upload("pump.pdf", PUMP_MANUAL)
+        self.boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+
+    async def batch(self, questions, **body):
+        response = await self.async_client.post("/ask_question/batch/", json.dumps({"questions": questions, **body}),
+                                                content_type="application/json")
+        if response.status_code != 200:
+            return response.status_code, response.json()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = (await read_stream(response)).splitlines()
+        return 200, sorted((json.loads(line) for line in lines), key=lambda result: result["index"])
+
+    async def test_one_ndjson_line_per_question(self):
+        status, results = await self.batch([
+            "How often is the hydraulic pump serviced?",
+            {"id": "burner", "question": "When does the burner ignite?", "pdf_id": self.boiler.id},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual([result["index"] for result in results], [0, 1])
+        self.assertNotIn("id", results[0])
+        self.assertEqual((results[1]["id"], results[1]["pdf_id"]), ("burner", self.boiler.id))
+        self.assertTrue(all(result["answer"]["title"] == "Stub answer" for result in results))
+
+    async def test_invalid_entries_are_rejected(self):
+        for questions in (["ok", ""], ["ok", 3], [{"question": 5}], [{"id": "no question"}], "not a list"):
+            status, body = await self.batch(questions)
+            self.assertEqual(status, 400, questions)
+            self.assertIn("Invalid batch", body["error"])
+
+    async def test_a_failed_llm_call_fails_only_its_question(self):
+        def invoke(prompt, **kwargs):
+            if "burner" in str(prompt).split("Question:")[-1]:
+                raise TimeoutError("model timed out")
+            return StubLLM().invoke(prompt)
+
+        self.invoke.side_effect = invoke
+        status, results = await self.batch(["How often is the hydraulic pump serviced?",
+                                            "When does the burner ignite?"])
+        self.assertEqual(status, 200)
+        self.assertEqual(results[0]["answer"]["title"], "Stub answer")
+        self.assertEqual(results[1]["error"], "model timed out")
+        self.assertNotIn("answer", results[1])
+
+    async def test_cached_answers_skip_the_llm(self):
+        questions = ["How often is the hydraulic pump serviced?", "When does the burner ignite?"]
+        await self.batch(questions)
+        calls = self.invoke.call_count
+        self.assertEqual(calls, 2)
+
+        status, results = await self.batch(questions + ["Descale the heat exchanger how often?"])
+        self.assertEqual(self.invoke.call_count, calls + 1)
+        self.assertEqual([result["cached"] for result in results], ["exact", "exact", None])
+
+
+def sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+class StreamViewTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = StubLLM()
+        self.enterContext(registry.override("llm", self.llm))
+        self.pump = self.upload("pump.pdf", PUMP_MANUAL)
+
+    async def stream(self, question):
+        response = await self.async_client.get("/ask_question/stream/", {"q": question, "pdf_id": "all"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return sse_events(await read_stream(response))
+
+    async def test_sources_then_tokens_then_the_answer(self):
+        events = await self.stream("How often is the hydraulic pump serviced?")
+        names = [name for name, _ in events]
+        self.assertEqual(names[0], "retrieval")
+        self.assertEqual(names[-1], "answer")
+        self.assertEqual(set(names[1:-1]), {"token"})
+        self.assertGreater(len(names), 3)
+
+        sources = events[0][1]["sources"]
+        self.assertEqual(sources[0]["pdf_id"], self.pump.id)
+        self.assertIn("hydraulic pump", sources[0]["snippet"])
+        answer = events[-1][1]
+        streamed = "".join(data["text"] for name, data in events if name == "token")
+        self.assertEqual(json.loads(streamed)["content"], answer["answer"]["content"])
+
+    async def test_a_failing_model_ends_the_stream_with_an_error_event(self):
+        async def broken(prompt, **kwargs):
+            yield AIMessageChunk(content='{"title": ')
+            raise ConnectionError("Ollama went away")
+
+        with mock.patch.object(self.llm, "astream", broken):
+            events = await self.stream("How often is the hydraulic pump serviced?")
+        self.assertEqual([name for name, _ in events], ["retrieval", "token", "error"])
+        self.assertEqual(events[-1][1]["answer"]["title"], "Error")
+
+
+PROMETHEUS_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_]\w*="(?:[^"\\]|\\.)*",?)*\})? '
+                               r'(-?\d+(?:\.\d+)?(?:e[-+]?\d+)?|\+Inf|NaN)$')
+
+
+def parse_prometheus(text):
+    """{metric name: kind} and [(sample name, labels text, value)], failing on anything malformed."""
+    kinds, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert kind in ("counter", "gauge", "histogram"), line
+            kinds[name] = kind
+        elif not line.startswith("# HELP "):
+            match = PROMETHEUS_SAMPLE.match(line)
+            assert match, f"Malformed sample: {line!r}"
+            name = match.group(1)
+            assert name in kinds or re.sub(r"_(bucket|sum|count)$", "", name) in kinds, f"Untyped: {line!r}"
+            samples.append((name, match.group(2) or "", float(match.group(3))))
+    return kinds, samples
+
+
+class MetricsViewTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(registry.override("llm", StubLLM()))
+        self.upload("pump.pdf", PUMP_MANUAL)
+
+    async def test_metrics_are_valid_prometheus_text(self):
+        await self.async_client.get("/ask_question/", {"q": "How often is the pump serviced?", "pdf_id": "all"})
+        response = await self.async_client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        kinds, samples = parse_prometheus(response.content.decode("utf-8"))
+
+        for name, kind in (("rag_request_duration_seconds", "histogram"), ("rag_stage_duration_seconds", "histogram"),
+                           ("rag_page_extract_duration_seconds", "histogram"), ("rag_llm_tokens_total", "counter"),
+                           ("rag_answer_cache_lookups_total", "counter"), ("rag_llm_rejected_total", "counter")):
+            self.assertEqual(kinds.get(name), kind, name)
+        stages = {labels for name, labels, _ in samples if name == "rag_stage_duration_seconds_count"}
+        self.assertIn('{pipeline="ask_question",stage="llm"}', stages)
+        self.assertIn('{pipeline="ingest",stage="embed"}', stages)
+
+        # Buckets are cumulative and end in +Inf == _count
+        series = {}
+        for name, labels, value in samples:
+            if name == "rag_request_duration_seconds_bucket":
+                series.setdefault(re.sub(r',?le="[^"]*"', "", labels), []).append(value)
+        counts = {labels: value for name, labels, value in samples if name == "rag_request_duration_seconds_count"}
+        self.assertTrue(series)
+        for labels, buckets in series.items():
+            self.assertEqual(buckets, sorted(buckets))
+            self.assertEqual(buckets[-1], counts[labels])
+
+    async def test_responses_carry_server_timing(self):
+        response = await self.async_client.get("/ask_question/", {"q": "How often is the pump serviced?",
+                                                                  "pdf_id": "all"})
+        timing = dict(part.split(";dur=") for part in response["Server-Timing"].split(", "))
+        for stage in ("cache", "retrieve", "context", "llm", "parse", "total"):
+            self.assertGreaterEqual(float(timing[stage]), 0, stage)
+        self.assertEqual(response.json()["timings"].keys() - timing.keys(), set())
+
+    def test_metric_types_must_render_their_samples(self):
+        class Incomplete(_Metric):
+            kind = "gauge"
+
+        with self.assertRaises(TypeError):
+            Incomplete("rag_incomplete", "Never renders.")
+
+
+class DeletePdfsTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pump = self.upload("pump.pdf", PUMP_MANUAL)
+        self.boiler = self.upload("boiler.pdf", BOILER_MANUAL)
+        self.kept = self.upload("kept.pdf", ["The conveyor belt tension is checked weekly."])
+        for pdf in (self.pump, self.boiler, self.kept):
+            for size in ("", "thumb"):
+                self.assertEqual(self.client.get(f"/page_image/{pdf.id}/1/", {"size": size}).status_code, 200)
+
+    def files_of(self, pdf):
+        names = {pdf.file.name}
+        for page in PDFPage.objects.filter(pdf=pdf):
+            names.update(name for name in (page.image.name, page.thumbnail.name) if name)
+        return {os.path.join(settings.MEDIA_ROOT, name) for name in names}
+
+    def test_bulk_delete_removes_everything_of_the_selected_pdfs_only(self):
+        deleted = self.files_of(self.pump) | self.files_of(self.boiler)
+        kept = self.files_of(self.kept)
+        self.assertEqual(len(deleted), 6)
+        self.assertTrue(all(os.path.exists(path) for path in deleted | kept))
+
+        response = self.client.post("/delete/", {"pdf_ids": [self.pump.id, self.boiler.id]})
+        self.assertEqual(sorted(response.json()["deleted"]), [self.pump.id, self.boiler.id])
+
+        self.assertEqual(list(UploadedPDF.objects.values_list("id", flat=True)), [self.kept.id])
+        for model in (PDFPage, IngestionJob, IndexedPDF):
+            self.assertEqual(set(model.objects.values_list("pdf_id", flat=True)), {self.kept.id}, model.__name__)
+        self.assertFalse(any(os.path.exists(path) for path in deleted))
+        self.assertTrue(all(os.path.exists(path) for path in kept))
+
+        store = open_vectorstore(active_index())
+        self.assertEqual({meta["pdf_id"] for meta in store.get(include=("metadatas",))["metadatas"]}, {self.kept.id})
+        lexical = open_lexical_index(active_index())
+        self.assertEqual(lexical.search("hydraulic pump boiler burner"), [])
+        self.assertEqual({hit[2] for hit in lexical.search("conveyor belt tension")}, {self.kept.id})
+        self.assertEqual(self.search_pdf_ids("hydraulic pump boiler burner conveyor", k=6), {self.kept.id})
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self, dim=384):
+        super().__init__(dim)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "embeddings.sqlite3")
+        self.inner = CountingEmbeddings(64)
+
+    def test_repeated_chunks_are_embedded_once(self):
+        embeddings = CachedEmbeddings(self.inner, EmbeddingCache(self.path), "hashing")
+        texts = ["Pump filter", "Boiler  burner\n", "Pump filter"]
+        first = embeddings.embed_documents(texts)
+        self.assertEqual(self.inner.embedded, ["Pump filter", "Boiler  burner\n"])
+
+        # Another process reading the same file, with whitespace-only differences
+        cache = EmbeddingCache(self.path)
+        again = CachedEmbeddings(self.inner, cache, "hashing").embed_documents(["Pump filter", "Boiler burner"])
+        self.assertEqual(len(self.inner.embedded), 2)
+        np.testing.assert_allclose(again, first[:2], rtol=1e-6)
+        self.assertEqual(cache.stats()["hit_ratio"], 1.0)
+
+        CachedEmbeddings(self.inner, cache, "other-model").embed_documents(["Pump filter"])
+        self.assertEqual(len(self.inner.embedded), 3)
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (2, 1))
+
+
+class UploadReuseTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(RAG_EMBEDDING_CACHE_PATH=os.path.join(self.tmp, "embeddings.sqlite3")))
+        self.inner = CountingEmbeddings()
+        self.enterContext(registry.override(
+            "embeddings", CachedEmbeddings(self.inner, registry.get("embedding_cache"), "hashing")))
+
+    def test_reingested_text_hits_the_embedding_cache(self):
+        self.upload("pump.pdf", PUMP_MANUAL)
+        embedded = len(self.inner.embedded)
+        self.upload("pump-v2.pdf", PUMP_MANUAL)  # Same text, different file bytes: no sha256 match
+        self.assertEqual(len(self.inner.embedded), embedded)
+
+        stats = self.client.get("/stats/resources/").json()["embedding_cache_hits"]
+        self.assertEqual((stats["hits"], stats["misses"]), (embedded, embedded))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_a_duplicate_upload_is_cloned(self):
+        first = self.upload("pump.pdf", PUMP_MANUAL)
+        embedded = len(self.inner.embedded)
+        with mock.patch.object(ingestion, "iter_extracted_pages") as extract:
+            copy = self.upload("pump-copy.pdf", same_as=first)
+        extract.assert_not_called()
+        self.assertEqual(len(self.inner.embedded), embedded)
+        self.assertEqual(copy.sha256, first.sha256)
+        self.assertEqual(copy.latest_job.progress["embed"]["reused_from"], first.id)
+
+        pages = [(page.page_number, page.text) for page in PDFPage.objects.filter(pdf=first)]
+        self.assertEqual([(page.page_number, page.text) for page in PDFPage.objects.filter(pdf=copy)], pages)
+        store = open_vectorstore(active_index())
+        original = store.get(where={"pdf_id": first.id})
+        cloned = store.get(where={"pdf_id": copy.id})
+        self.assertEqual(sorted(cloned["documents"]), sorted(original["documents"]))
+        self.assertTrue(all(doc_id.startswith(f"pdf{copy.id}_") for doc_id in cloned["ids"]))
+        self.assertEqual(self.search_pdf_ids("hydraulic pump servicing", pdf_id=copy.id), {copy.id})
+
+
+class TranscriptTests(PipelineTestCase):
+    def test_transcript_streams_the_text_stored_at_ingest(self):
+        pages = PUMP_MANUAL + BOILER_MANUAL
+        pdf = self.upload("manual.pdf", pages)
+        stored = list(PDFPage.objects.filter(pdf=pdf).order_by("page_number").values_list("page_number", "text"))
+        self.assertEqual([(n, " ".join(text.split())) for n, text in stored], list(enumerate(pages, start=1)))
+
+        os.remove(pdf.file.path)  # Anything re-reading the PDF would now fail
+        with mock.patch.object(page_text, "iter_pages") as iter_pages:
+            response = self.client.get(f"/download_transcript/{pdf.id}/")
+            self.assertIsInstance(response, StreamingHttpResponse)
+            body = b"".join(response.streaming_content).decode("utf-8")
+        iter_pages.assert_not_called()
+
+        self.assertIn('filename="transcript_manual.pdf.txt"', response["Content-Disposition"])
+        self.assertNotIn("[Transcript incomplete", body)
+        transcript = body.split("=" * 50 + "\n\n", 1)[1]
+        self.assertEqual(transcript, "".join(f"--- Page {n} ---\n{text}\n\n" for n, text in stored))
+
+
+class StubScorer:
+    """Cross-encoder stand-in: prefers longer chunks, taking `seconds` per batch."""
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.batches = 0
+
+    def predict(self, pairs, batch_size=None):
+        self.batches += 1
+        time.sleep(self.seconds)
+        return [len(text) for _, text in pairs]
+
+
+@override_settings(RAG_RERANK_ENABLED=True, RAG_RERANK_BATCH_SIZE=2, RAG_RERANK_BUDGET_MS=50)
+class RerankerBudgetTests(SimpleTestCase):
+    def setUp(self):
+        # Fused order: shortest first, so a reranking is easy to tell apart
+        self.docs = [doc(f"pdf1_c{n}", "word " * (n + 1)) for n in range(8)]
+        patcher = mock.patch.object(qa.retrieval, "search", return_value=self.docs)
+        self.search = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def retrieve(self, scorer):
+        with registry.override("reranker", scorer):
+            return qa.retrieve("word?", "all", k=3)
+
+    def test_a_slow_scorer_falls_back_to_the_fused_order(self):
+        scorer = StubScorer(seconds=0.03)
+        docs, info = self.retrieve(scorer)
+        self.assertEqual([d.id for d in docs], ["pdf1_c0", "pdf1_c1", "pdf1_c2"])
+        self.assertEqual(info, {"applied": False, "reason": "budget", "scored": 2})
+        self.assertEqual(scorer.batches, 1)  # Stopped as soon as the pace projected past the budget
+
+    def test_a_fast_scorer_reranks(self):
+        docs, info = self.retrieve(StubScorer())
+        self.assertEqual([d.id for d in docs], ["pdf1_c7", "pdf1_c6", "pdf1_c5"])
+        self.assertEqual(info, {"applied": True, "reason": None, "scored": 8})
+        self.assertEqual(self.search.call_args.args[2], 24)  # Over-fetched RAG_RERANK_CANDIDATES
@@ -5,6 +5,14 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('app/', views.upload_pdf, name='upload_pdf'),
     path('ask_question/', views.ask_question, name='ask_question'), # Matches fetch('/ask_question/...')
+    path('ask_question/stream/', views.ask_question_stream, name='ask_question_stream'),
+    path('ask_question/batch/', views.ask_question_batch, name='ask_question_batch'),
+    path('page_image/<int:pdf_id>/<int:page_number>/', views.page_image, name='page_image'),
     path('delete/<int:pdf_id>/', views.delete_pdf, name='delete_pdf'),
+    path('delete/', views.delete_pdfs, name='delete_pdfs'),
     path('download_transcript/<int:pdf_id>/', views.download_transcript, name='download_transcript'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/retry/', views.retry_job, name='retry_job'),
+    path('stats/resources/', views.resource_stats, name='resource_stats'),
+    path('metrics', views.metrics, name='metrics'),  # No trailing slash: Prometheus' default path
 ]
\ No newline at end of file
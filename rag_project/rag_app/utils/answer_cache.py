@@ -0,0 +1,157 @@
+# answer_cache.py
+"""
+Two-tier cache for /ask_question/ answers.
+
+1. Exact: (normalised question, pdf scope, corpus version).
+2. Semantic: a cached question for the same scope and corpus version whose
+   embedding is within RAG_ANSWER_CACHE_THRESHOLD cosine similarity.
+
+The corpus version is derived from the database (number of PDFs, newest id,
+newest finished ingestion, active index version), so entries go stale in
+every worker as soon as a PDF in scope is uploaded or deleted, or `reindex`
+switches to a new index. Entries are also evicted LRU-first and
+after RAG_ANSWER_CACHE_TTL seconds.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from ..models import IngestionJob, UploadedPDF
+from .index_state import active_index
+from .metrics import REGISTRY
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCT = re.compile(r"[\s?.!]+$")
+
+
+def normalize_question(question):
+    return _TRAILING_PUNCT.sub("", _WHITESPACE.sub(" ", question.strip().lower()))
+
+
+def cache_scope(pdf_id):
+    """"all" for every PDF (also when no pdf_id was given), else the id as a string."""
+    return "all" if pdf_id in (None, "", "all") else str(pdf_id)
+
+
+def corpus_version(pdf_id):
+    """Changes whenever a PDF in scope ("all" or one id) is added, re-ingested or deleted, or the index switches."""
+    pdfs = UploadedPDF.objects.all()
+    if cache_scope(pdf_id) != "all":
+        pdfs = pdfs.filter(id=int(pdf_id))
+    agg = pdfs.aggregate(
+        n=Count("id", distinct=True),
+        last_id=Max("id"),
+        last_ingest=Max("jobs__finished_at", filter=Q(jobs__status=IngestionJob.DONE)),
+    )
+    last_ingest = agg["last_ingest"].timestamp() if agg["last_ingest"] else None
+    return (agg["n"], agg["last_id"], last_ingest, active_index().version)
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries=512, ttl=3600, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # key -> (created, embedding, payload)
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, question, scope, version, embed=None):
+        """
+        Returns (payload, "exact" | "semantic") or (None, None).
+        embed: callable returning the question embedding, only called when the
+        exact tier misses and semantic matching is enabled.
+        """
+        key = (normalize_question(question), cache_scope(scope), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits["exact"] += 1
+                return entry[2], "exact"
+
+        if self.threshold is None or embed is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        query = _unit(embed())
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for other_key, (created, embedding, _) in self._entries.items():
+                if other_key[1:] != key[1:] or embedding is None or self._expired(created):
+                    continue
+                score = float(np.dot(query, embedding))
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(best_key)
+            self.hits["semantic"] += 1
+            return self._entries[best_key][2], "semantic"
+
+    def put(self, question, scope, version, payload, embedding=None):
+        key = (normalize_question(question), cache_scope(scope), version)
+        with self._lock:
+            self._entries[key] = (time.time(), _unit(embedding) if embedding is not None else None, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, pdf_ids=None):
+        """Drops entries scoped to the given PDFs and every "all" entry (or everything)."""
+        with self._lock:
+            if pdf_ids is None:
+                self._entries.clear()
+                return
+            scopes = {"all", *(str(pdf_id) for pdf_id in pdf_ids)}
+            for key in [k for k in self._entries if k[1] in scopes]:
+                del self._entries[key]
+
+    def stats(self):
+        lookups = self.hits["exact"] + self.hits["semantic"] + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.hits["exact"],
+            "semantic_hits": self.hits["semantic"],
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else None,
+        }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_cache = AnswerCache(
+    max_entries=getattr(settings, "RAG_ANSWER_CACHE_SIZE", 512),
+    ttl=getattr(settings, "RAG_ANSWER_CACHE_TTL", 3600),
+    threshold=getattr(settings, "RAG_ANSWER_CACHE_THRESHOLD", 0.95),
+)
+
+
+def _cache_metrics():
+    stats = answer_cache.stats()
+    lookups = [({"result": "exact_hit"}, stats["exact_hits"]), ({"result": "semantic_hit"}, stats["semantic_hits"]),
+               ({"result": "miss"}, stats["misses"])]
+    return [
+        ("rag_answer_cache_lookups_total", "counter", "Answer cache lookups by result.", lookups),
+        ("rag_answer_cache_entries", "gauge", "Answers currently cached.", [({}, stats["entries"])]),
+    ]
+
+
+REGISTRY.add_collector(_cache_metrics)
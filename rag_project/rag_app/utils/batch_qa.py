@@ -0,0 +1,168 @@
+# batch_qa.py
+"""
+Answers many questions in one go (evaluations, bulk extraction).
+
+Compared with one /ask_question/ call per question, the batch shares work:
+
+* every question is embedded in a single encoder batch, and that vector
+  also serves the semantic answer-cache lookup;
+* questions are grouped by pdf scope and each group is searched with one
+  vectorized similarity search;
+* LLM calls run on a small thread pool (RAG_BATCH_LLM_CONCURRENCY at once),
+  starting as soon as a group's retrieval is done.
+
+Results are yielded as each answer finishes, so they are not in input order;
+each carries the index of its question.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .embeddings import embed_queries
+from .llm import get_llm, record_generation_stats
+from .qa import (NO_INFO_ANSWER, build_payload, build_prompt, cite, lookup_cache, parse_answer,
+                 retrieve_batch, summary_answer)
+from .timing import StageTimer
+
+
+class BatchItem:
+    def __init__(self, index, question, pdf_id, item_id=None):
+        self.index = index
+        self.question = question
+        self.pdf_id = pdf_id
+        self.id = item_id
+        self.timer = StageTimer()
+
+    def result(self, **data):
+        result = {"index": self.index, "question": self.question, "pdf_id": self.pdf_id}
+        if self.id is not None:
+            result["id"] = self.id
+        return {**result, **data}
+
+
+def parse_items(questions, pdf_id="all"):
+    """
+    questions: strings, or dicts with "question" (or "q") and optionally
+    "pdf_id" (defaults to `pdf_id`) and "id" (echoed back in the result).
+    Raises ValueError for an entry without a question.
+    """
+    items = []
+    for index, entry in enumerate(questions):
+        if isinstance(entry, str):
+            entry = {"question": entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f"Question {index} must be a string or an object")
+        question = entry.get("question") or entry.get("q")
+        if not question or not isinstance(question, str):
+            raise ValueError(f"Question {index} is empty")
+        scope = entry.get("pdf_id", pdf_id)
+        items.append(BatchItem(index, question, "all" if scope in (None, "", "all") else int(scope), entry.get("id")))
+    return items
+
+
+def _generate(item, prompt, citation, rerank_info, context_stats, store):
+    """LLM call, parsing and citation for one question (runs on the batch pool)."""
+    timer = item.timer
+    try:
+        with timer.stage("llm"):
+            response = get_llm().invoke(prompt)
+        record_generation_stats(response, timer)
+        answer_json = parse_answer(getattr(response, "content", str(response)), timer)
+        with timer.stage("citation"):
+            payload = build_payload(answer_json, *citation)
+        store(payload)
+        return item.result(**payload, cached=None, rerank=rerank_info, context=context_stats,
+                           timings=timer.as_dict())
+    finally:
+        # Pool threads outlive the request; don't leave their DB connections open
+        close_old_connections()
+
+
+def _failed(item, error):
+    print(f"❌ Batch question {item.index} failed: {error}")
+    return item.result(error=str(error) or error.__class__.__name__, timings=item.timer.as_dict())
+
+
+def answer_batch(questions, pdf_id="all", weights=None, k=6, concurrency=None, timer=None):
+    """
+    Generator of result dicts, one per question, in completion order. Each is
+    the answer_question() payload plus "index", "question", "pdf_id" (and
+    "id" if given), or {"error": ...} when that question failed.
+
+    Batch-wide stages (query embedding, retrieval) are timed into `timer`;
+    each result's "timings" covers its own LLM call, parsing and citation.
+    """
+    timer = timer or StageTimer()
+    items = parse_items(questions, pdf_id)
+    if not items:
+        return
+    concurrency = concurrency or getattr(settings, "RAG_BATCH_LLM_CONCURRENCY", 2)
+
+    # Overview questions with a stored document summary need no retrieval at all
+    remaining = []
+    for item in items:
+        summary = summary_answer(item.question, item.pdf_id, item.timer)
+        if summary is not None:
+            yield item.result(**summary, cached=None, timings=item.timer.as_dict())
+        else:
+            remaining.append(item)
+    items = remaining
+    if not items:
+        return
+
+    with timer.stage("embed_query"):
+        vectors = embed_queries([item.question for item in items])
+
+    # Cache hits are answered straight away; misses are grouped by scope
+    groups = {}
+    for item, vector in zip(items, vectors):
+        with timer.stage("cache"):
+            cached, tier, store = lookup_cache(item.question, item.pdf_id, embedding=vector)
+        if cached is not None:
+            yield item.result(**cached, cached=tier, timings=item.timer.as_dict())
+        else:
+            groups.setdefault(item.pdf_id, []).append((item, vector, store))
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rag-batch")
+    pending = {}
+    try:
+        for scope, group in groups.items():
+            try:
+                retrieved = timer.bind(retrieve_batch)(
+                    [item.question for item, _, _ in group], scope, k=k, weights=weights,
+                    vectors=[vector for _, vector, _ in group], timer=timer,
+                )
+            except Exception as e:
+                for item, _, _ in group:
+                    yield _failed(item, e)
+                continue
+
+            for (item, _, store), (docs, rerank_info) in zip(group, retrieved):
+                if not docs:
+                    yield item.result(answer=NO_INFO_ANSWER, timings=item.timer.as_dict())
+                    continue
+                prompt, context_stats = build_prompt(item.question, docs, item.timer)
+                future = executor.submit(_generate, item, prompt, cite(docs), rerank_info, context_stats, store)
+                pending[future] = item
+
+            # Hand over what finished while this group was being retrieved
+            yield from _collect(pending, block=False)
+
+        while pending:
+            yield from _collect(pending, block=True)
+    finally:
+        # Stop queued LLM calls if the consumer went away early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _collect(pending, block):
+    done = [future for future in pending if future.done()]
+    if block and not done:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        item = pending.pop(future)
+        try:
+            yield future.result()
+        except Exception as e:
+            yield _failed(item, e)
@@ -0,0 +1,129 @@
+# concurrency.py
+"""
+Helpers for the async Q&A path:
+
+* run_blocking() runs sync work (Chroma search, embedding, ORM) on a bounded
+  thread pool, so a burst of requests can't spawn unbounded threads.
+* AdmissionQueue caps concurrent LLM calls. Callers beyond the limit wait in a
+  bounded queue; when that queue is full they are rejected immediately with
+  Overloaded instead of piling up behind a slow model.
+"""
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import REGISTRY
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    """Raised when the LLM admission queue is full (maps to HTTP 503)."""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "RAG_QA_EXECUTOR_WORKERS", 8),
+                thread_name_prefix="rag-qa",
+            )
+    return _executor
+
+
+def _call_with_db_cleanup(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        # Pool threads are long-lived; drop connections past CONN_MAX_AGE
+        close_old_connections()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(_call_with_db_cleanup, fn, *args, **kwargs))
+
+
+class AdmissionQueue:
+    """
+    Semaphore-based admission control. `limit` calls run at once, at most
+    `max_waiting` more may wait (for up to `timeout` seconds); anything else
+    raises Overloaded straight away.
+
+    asyncio primitives belong to one event loop, so a semaphore is kept per
+    loop. Under ASGI that is one per worker process, which is what we want.
+    """
+
+    def __init__(self, limit, max_waiting, timeout=None):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+    async def __aenter__(self):
+        semaphore = self._semaphore()
+        if semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded("Too many questions in progress, try again shortly")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded("Timed out waiting for a free model slot")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore().release()
+        return False
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "max_waiting": self.max_waiting,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+llm_admission = AdmissionQueue(
+    limit=getattr(settings, "RAG_LLM_CONCURRENCY", 2),
+    max_waiting=getattr(settings, "RAG_LLM_QUEUE_SIZE", 8),
+    timeout=getattr(settings, "RAG_LLM_QUEUE_TIMEOUT", 30),
+)
+
+
+def _admission_metrics():
+    stats = llm_admission.stats()
+    return [
+        ("rag_llm_active_calls", "gauge", "LLM calls running now.", [({}, stats["active"])]),
+        ("rag_llm_waiting_calls", "gauge", "Requests queued for an LLM slot.", [({}, stats["waiting"])]),
+        ("rag_llm_rejected_total", "counter", "Requests turned away with a 503 because the LLM queue was full.",
+         [({}, stats["rejected"])]),
+    ]
+
+
+REGISTRY.add_collector(_admission_metrics)
@@ -0,0 +1,195 @@
+# context_builder.py
+"""
+Packs retrieved chunks into the prompt context under a token budget.
+
+1. Adjacent chunks (pdf3_c7, pdf3_c8) of the same PDF page - or of the same
+   PDF, for chunks that may cross pages - are merged, with the splitter's
+   overlap removed, so the shared text is only sent once.
+2. Near-duplicates (e.g. the same boilerplate on every page, or an identical
+   PDF uploaded twice) are dropped using MinHash over word shingles.
+3. What is left is added best-first until RAG_CONTEXT_TOKEN_BUDGET is reached.
+
+Prompt evaluation time on a CPU model grows with prompt length, so the stats
+returned with each request report how many tokens this saved.
+"""
+import math
+import re
+import zlib
+
+import numpy as np
+from django.conf import settings
+from langchain_core.documents import Document
+
+CHARS_PER_TOKEN = 4  # Rough average for English text with Llama-style tokenizers
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+MIN_OVERLAP_CHARS = 5  # Shorter matches are more likely coincidence than overlap
+MAX_OVERLAP_CHARS = 300
+
+_CHUNK_ID_RE = re.compile(r"^pdf(\d+)_c(\d+)$")
+_WORD_RE = re.compile(r"\w+")
+
+_rng = np.random.default_rng(1)
+_PRIME = (1 << 61) - 1
+# a < 2**31 and crc32 hashes < 2**32 keep a * x + b inside uint64
+_PERM_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_chunk(doc):
+    first, last = doc.metadata.get("page", "?"), doc.metadata.get("page_end")
+    pages = f"Pages {first}-{last}" if last and last != first else f"Page {first}"
+    return f"[{pages}] {doc.page_content}\n\n"
+
+
+def _position(doc):
+    """(pdf_id, chunk index) from a deterministic chunk id, or None."""
+    match = _CHUNK_ID_RE.match(doc.id or "")
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def merge_overlap(first, second):
+    """Joins two consecutive chunks, dropping the text the splitter repeated."""
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first} {second}"
+
+
+def merge_adjacent(docs):
+    """
+    Merges runs of consecutive chunks from the same PDF page (from the same
+    PDF for the document splitter's chunks, which carry "page_start"). The
+    merged chunk takes the rank of its best member. Returns (docs, merges).
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        position = _position(doc)
+        page = None if "page_start" in doc.metadata else doc.metadata.get("page")
+        key = (position[0], page) if position else ("rank", rank)
+        groups.setdefault(key, []).append((position[1] if position else 0, rank, doc))
+
+    merged = []
+    for members in groups.values():
+        members.sort(key=lambda member: member[0])
+        run = [members[0]]
+        for member in members[1:]:
+            if _position(member[2]) and member[0] == run[-1][0] + 1:
+                run.append(member)
+                continue
+            merged.append(_join_run(run))
+            run = [member]
+        merged.append(_join_run(run))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged], len(docs) - len(merged)
+
+
+def _join_run(run):
+    best_rank = min(rank for _, rank, _ in run)
+    if len(run) == 1:
+        return best_rank, run[0][2]
+
+    text = run[0][2].page_content
+    for _, _, doc in run[1:]:
+        text = merge_overlap(text, doc.page_content)
+    best = next(doc for _, rank, doc in run if rank == best_rank)
+    metadata = dict(best.metadata)
+    if "page_start" in metadata:
+        first, last = run[0][2].metadata, run[-1][2].metadata
+        metadata.update(page=first["page_start"], page_start=first["page_start"], start=first["start"],
+                        page_end=last["page_end"], end=last["end"])
+    return best_rank, Document(id=best.id, page_content=text, metadata=metadata)
+
+
+def minhash(text):
+    """
+    MinHash signature over word shingles (equal positions estimate Jaccard
+    similarity) and the number of distinct shingles.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+    # (a * x + b) mod p for every permutation at once
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _PRIME
+    return permuted.min(axis=0), len(shingles)
+
+
+def _redundancy(new, kept):
+    """
+    How much of `new` is already in `kept`: the larger of the Jaccard
+    estimate and the containment |new & kept| / |new| derived from it, so a
+    chunk swallowed by a larger merged chunk also counts as a duplicate.
+    """
+    (sig_new, n_new), (sig_kept, n_kept) = new, kept
+    jaccard = float(np.mean(sig_new == sig_kept))
+    containment = jaccard * (n_new + n_kept) / ((1 + jaccard) * n_new)
+    return max(jaccard, min(containment, 1.0))
+
+
+def drop_near_duplicates(docs, threshold):
+    """Keeps the best-ranked chunk of every group that is at least `threshold` redundant."""
+    kept, signatures = [], []
+    for doc in docs:
+        signature = minhash(doc.page_content)
+        if any(_redundancy(signature, other) >= threshold for other in signatures):
+            continue
+        kept.append(doc)
+        signatures.append(signature)
+    return kept, len(docs) - len(kept)
+
+
+def pack_context(docs, token_budget=None, dedup_threshold=None):
+    """
+    docs: retrieved chunks, best first.
+    Returns (packed_docs, stats); packed_docs keep the best-first order.
+    """
+    token_budget = token_budget if token_budget is not None else getattr(settings, "RAG_CONTEXT_TOKEN_BUDGET", 1500)
+    dedup_threshold = dedup_threshold or getattr(settings, "RAG_CONTEXT_DEDUP_THRESHOLD", 0.8)
+    tokens_in = sum(estimate_tokens(format_chunk(doc)) for doc in docs)
+
+    originals = {}
+    for doc in docs:
+        originals.setdefault(doc.id, doc)
+
+    candidates, merges = merge_adjacent(docs)
+    candidates, duplicates = drop_near_duplicates(candidates, dedup_threshold)
+
+    packed, used, over_budget = [], 0, 0
+    for doc in candidates:
+        tokens = estimate_tokens(format_chunk(doc))
+        if token_budget and used + tokens > token_budget:
+            # A merged chunk that doesn't fit falls back to its best member
+            original = originals.get(doc.id, doc)
+            if original is not doc and used + estimate_tokens(format_chunk(original)) <= token_budget:
+                doc = original
+            elif packed:
+                over_budget += 1
+                continue
+            else:
+                # Always keep the best chunk, cut down to the budget
+                doc = Document(id=original.id, metadata=original.metadata,
+                               page_content=original.page_content[:token_budget * CHARS_PER_TOKEN])
+            tokens = estimate_tokens(format_chunk(doc))
+        packed.append(doc)
+        used += tokens
+
+    return packed, {
+        "chunks_in": len(docs),
+        "chunks_out": len(packed),
+        "merged": merges,
+        "duplicates": duplicates,
+        "over_budget": over_budget,
+        "tokens_in": tokens_in,
+        "tokens_out": used,
+        "tokens_saved": tokens_in - used,
+        "token_budget": token_budget,
+    }
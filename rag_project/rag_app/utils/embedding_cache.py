@@ -0,0 +1,125 @@
+# embedding_cache.py
+"""
+Persistent embedding cache keyed by (model name, hash of normalised chunk text).
+
+Re-uploaded documents and boilerplate pages shared between PDFs (headers,
+disclaimers, ...) are embedded once; later requests read the float32 vector
+back from a local SQLite file.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text):
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed vector store for embeddings. One connection per thread."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, hash))"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model, hashes):
+        """Returns {hash: vector} for the hashes that are cached."""
+        found = {}
+        conn = self._connect()
+        unique = list(dict.fromkeys(hashes))
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(unique), 500):
+            part = unique[i:i + 500]
+            rows = conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                [model, *part],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        hits = sum(1 for h in hashes if h in found)
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(hashes) - hits
+        return found
+
+    def put_many(self, model, items):
+        """items: iterable of (hash, vector)."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items],
+            )
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps another Embeddings and only sends cache misses to it."""
+
+    def __init__(self, inner, cache, model_name):
+        self.inner = inner
+        self.cache = cache
+        self.model_name = model_name
+
+    def _embed(self, texts, key, embed_fn):
+        hashes = [text_hash(t) for t in texts]
+        cached = self.cache.get_many(key, hashes)
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(key, fresh.items())
+            cached.update(fresh)
+
+        return [list(cached[h]) for h in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, self.model_name, self.inner.embed_documents)
+
+    def embed_query(self, text):
+        # Some models embed queries differently, so they get their own namespace
+        return self._embed([text], f"{self.model_name}#query", lambda ts: [self.inner.embed_query(ts[0])])[0]
+
+    def embed_queries(self, texts):
+        from .embeddings import embed_queries
+        return self._embed(list(texts), f"{self.model_name}#query", lambda ts: embed_queries(ts, self.inner))
@@ -1,7 +1,102 @@
+from django.conf import settings
 from langchain_huggingface import HuggingFaceEmbeddings
 
-def get_embeddings():
-    return HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}  # or "cuda" if you have GPU
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+from .registry import registry
+
+
+def _encoder_config():
+    return (
+        getattr(settings, "RAG_EMBEDDING_DEVICE", "cpu"),  # or "cuda" if you have GPU
+        getattr(settings, "RAG_ENCODER_BATCH_SIZE", 32),
+        getattr(settings, "RAG_ENCODER_THREADS", None),
+    )
+
+
+def _backend_config():
+    # "torch" (sentence-transformers) or "onnx" (ONNX Runtime, see onnx_embeddings.py).
+    # Both give the same model's vectors, so switching doesn't need a reindex.
+    return (
+        getattr(settings, "RAG_EMBEDDING_BACKEND", "torch"),
+        getattr(settings, "RAG_ONNX_QUANTIZE", False),
+        getattr(settings, "RAG_ONNX_MODEL_DIR", None),
     )
+
+
+def _embedding_config():
+    # The model is the one the active index was built with, not necessarily
+    # RAG_EMBEDDING_MODEL: a new model only takes over after `manage.py reindex`.
+    from .index_state import active_index
+    return (active_index().config["embedding_model"], *_encoder_config(), *_backend_config())
+
+
+def _cache_config():
+    return getattr(settings, "RAG_EMBEDDING_CACHE_PATH", None)
+
+
+def _build_cache():
+    path = _cache_config()
+    return EmbeddingCache(path) if path else None
+
+
+def build_embeddings(model_name):
+    """A new (uncached by the registry) embedding model; reindex uses this for the target model."""
+    device, batch_size, threads = _encoder_config()
+    backend, quantize, model_dir = _backend_config()
+    if backend == "onnx":
+        from .onnx_embeddings import OnnxEmbeddings
+        embeddings = OnnxEmbeddings(model_name, model_dir=model_dir, quantize=quantize, threads=threads,
+                                    batch_size=batch_size, device=device)
+        cache_key = embeddings.name
+    else:
+        if threads:
+            # Intra-op threads for the CPU encoder; None keeps torch's default (all cores)
+            import torch
+            torch.set_num_threads(threads)
+
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": device},
+            encode_kwargs={"batch_size": batch_size},
+        )
+        cache_key = model_name
+
+    cache = registry.get("embedding_cache")
+    if cache is not None:
+        embeddings = CachedEmbeddings(embeddings, cache, cache_key)
+    return embeddings
+
+
+def _build_embeddings():
+    return build_embeddings(_embedding_config()[0])
+
+
+def embeddings_key():
+    """Everything that changes the embeddings object; dependants rebuild when it changes."""
+    return (_embedding_config(), _cache_config())
+
+
+registry.register("embedding_cache", _build_cache, config=_cache_config)
+registry.register("embeddings", _build_embeddings, config=embeddings_key)
+
+
+def embedding_cache_stats():
+    """Hit/miss counters of the persistent embedding cache (None when disabled)."""
+    cache = registry.get("embedding_cache")
+    return cache.stats() if cache is not None else None
+
+
+def get_embeddings():
+    """Returns the shared embedding model (loaded once per worker)."""
+    return registry.get("embeddings")
+
+
+def embed_queries(texts, embeddings=None):
+    """Query vectors for several questions, in one encoder batch where the model allows it."""
+    embeddings = embeddings or get_embeddings()
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if isinstance(embeddings, HuggingFaceEmbeddings) and not embeddings.query_encode_kwargs:
+        # Queries are encoded exactly like documents, so embed_documents batches them
+        return embeddings.embed_documents(list(texts))
+    return [embeddings.embed_query(text) for text in texts]
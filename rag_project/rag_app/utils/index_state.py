@@ -0,0 +1,156 @@
+# index_state.py
+"""
+Which index generation is live, and which config it was built with.
+
+Chunking, embedding and layout settings (RAG_SPLITTER, RAG_CHUNK_TOKENS,
+RAG_CHUNK_OVERLAP_TOKENS, RAG_EMBEDDING_MODEL, RAG_VECTOR_PARTITION_SIZE,
+...) describe the *target* index. The index that serves
+queries and takes new uploads is the ACTIVE VectorIndex row, and it keeps
+using the config it was built with until `manage.py reindex` has built a
+replacement and switched over. Changing a setting therefore never mixes
+vectors from two models in one collection.
+
+Every process re-reads the active row at most every ACTIVE_TTL seconds, so
+a switch made by the reindex command reaches all web and worker processes
+without a restart.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import IndexedPDF, IngestionJob, UploadedPDF, VectorIndex
+
+ACTIVE_TTL = 5.0
+# What chunked every index before RAG_SPLITTER existed
+LEGACY_SPLITTER = "recursive_character"
+
+_cache = {"expires": 0.0, "index": None}
+_lock = threading.Lock()
+
+
+def _splitter_config(splitter):
+    if splitter == "document":
+        return {
+            "chunk_tokens": getattr(settings, "RAG_CHUNK_TOKENS", 256),
+            "chunk_overlap_tokens": getattr(settings, "RAG_CHUNK_OVERLAP_TOKENS", 32),
+            "splitter": splitter,
+        }
+    return {
+        "chunk_size": getattr(settings, "RAG_CHUNK_SIZE", 500),
+        "chunk_overlap": getattr(settings, "RAG_CHUNK_OVERLAP", 50),
+        "splitter": splitter,
+    }
+
+
+def target_config(splitter=None):
+    """Index config the current settings ask for."""
+    config = {
+        "embedding_model": getattr(settings, "RAG_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+        **_splitter_config(splitter or getattr(settings, "RAG_SPLITTER", "document")),
+    }
+    # Only present when enabled, so unpartitioned indexes keep their version
+    partition_size = getattr(settings, "RAG_VECTOR_PARTITION_SIZE", 0)
+    if partition_size:
+        config["partition_size"] = int(partition_size)
+    return config
+
+
+def config_version(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def index_name(version):
+    return f"{getattr(settings, 'RAG_COLLECTION_NAME', 'rag_collection')}_{version}"
+
+
+def is_legacy(index):
+    """The collection that existed before indexes were versioned keeps its original name and folders."""
+    return index.name == getattr(settings, "RAG_COLLECTION_NAME", "rag_collection")
+
+
+def ingested_pdfs():
+    """
+    PDFs whose chunks belong in the index: those with a finished ingestion
+    job, and those uploaded before the job queue existed (which have no job).
+    """
+    return UploadedPDF.objects.filter(Q(jobs__status=IngestionJob.DONE) | Q(jobs__isnull=True)).distinct()
+
+
+def _bootstrap():
+    """
+    First run: the existing collection becomes the active index. It was built
+    with the current settings (and, if it has any PDFs, the splitter of the
+    time), so it gets their version, and every PDF that finished ingesting
+    (or predates ingestion jobs) is recorded as indexed in it.
+    """
+    try:
+        with transaction.atomic():
+            done = ingested_pdfs()
+            legacy = done.exists()
+            config = target_config(LEGACY_SPLITTER if legacy else None)
+            if legacy:
+                # ...in one unpartitioned collection
+                config.pop("partition_size", None)
+            index = VectorIndex.objects.create(
+                name=getattr(settings, "RAG_COLLECTION_NAME", "rag_collection"),
+                version=config_version(config),
+                config=config,
+                status=VectorIndex.ACTIVE,
+                activated_at=timezone.now(),
+            )
+            IndexedPDF.objects.bulk_create([IndexedPDF(index=index, pdf=pdf) for pdf in done])
+    except IntegrityError:
+        # Another process bootstrapped first
+        index = VectorIndex.objects.get(status=VectorIndex.ACTIVE)
+    return index
+
+
+def active_index(refresh=False):
+    """The live VectorIndex (cached for ACTIVE_TTL seconds)."""
+    now = time.monotonic()
+    cached = _cache["index"]
+    if cached is not None and not refresh and now < _cache["expires"]:
+        return cached
+
+    with _lock:
+        try:
+            index = VectorIndex.objects.filter(status=VectorIndex.ACTIVE).first() or _bootstrap()
+        except DatabaseError:
+            # Tables not migrated yet: describe the index the settings would create
+            config = target_config()
+            index = VectorIndex(name=getattr(settings, "RAG_COLLECTION_NAME", "rag_collection"),
+                                version=config_version(config), config=config, status=VectorIndex.ACTIVE)
+        _cache.update(index=index, expires=now + ACTIVE_TTL)
+    return index
+
+
+def building_indexes():
+    return list(VectorIndex.objects.filter(status=VectorIndex.BUILDING))
+
+
+def live_indexes():
+    """Indexes that must see deletes: the active one and any being built."""
+    return [active_index(), *(index for index in building_indexes())]
+
+
+def mark_indexed(index, pdf_obj, chunks):
+    if index.pk is None:
+        return
+    IndexedPDF.objects.update_or_create(index=index, pdf=pdf_obj, defaults={"chunks": chunks})
+
+
+def switch_active(new_index):
+    """Makes `new_index` the active one; all processes follow within ACTIVE_TTL seconds."""
+    with transaction.atomic():
+        VectorIndex.objects.filter(status=VectorIndex.ACTIVE).exclude(pk=new_index.pk).update(
+            status=VectorIndex.RETIRED)
+        VectorIndex.objects.filter(pk=new_index.pk).update(status=VectorIndex.ACTIVE, activated_at=timezone.now())
+    new_index.refresh_from_db()
+    active_index(refresh=True)
+    return new_index
@@ -0,0 +1,350 @@
+# ingestion.py
+"""
+Background PDF ingestion.
+
+Every upload gets an IngestionJob row. The row is the queue: jobs are either
+handed to a local process pool straight away (RAG_INGEST_MODE = "pool"), left
+for a `manage.py ingest_worker` process to pick up ("worker"), or run inline
+("sync", handy for tests and debugging).
+
+Each run records milliseconds per stage (extract, split, embed, upsert,
+page_text, render, summarize, ...) on the job. Pool and sync runs are also exported to
+/metrics by the process that dispatched them.
+"""
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+import fitz  # PyMuPDF
+
+from ..models import IndexedPDF, IngestionJob, PDFPage, UploadedPDF
+from .pdf_loader import iter_extracted_pages
+from .page_text import PageTextWriter, copy_page_text
+from .text_splitter import chunk_pages
+from .vector_store import add_documents_streaming, clone_pdf_vectors, delete_from_vector_store, rebase_chunk_id
+from .lexical_index import SegmentBuilder, delete_from_lexical_index, get_lexical_index
+from .index_state import active_index, mark_indexed
+from .page_renderer import inline_render_pages, render_for_ingestion, render_open_page
+from .answer_cache import answer_cache
+from .metrics import observe_stages
+from .summarizer import summaries_enabled, summarize_pdf
+from .timing import StageTimer, span
+from .workers import process_pool
+
+# Jobs still "running" without a heartbeat for this long are assumed dead
+STALE_AFTER_SECONDS = 300
+
+_executor = None
+
+
+class JobProgress:
+    """Throttled per-stage progress writer for an IngestionJob."""
+
+    def __init__(self, job, min_interval=0.5):
+        self.job = job
+        self.min_interval = min_interval
+        self._last_write = 0.0
+
+    def __call__(self, stage, done, total, **extra):
+        """total may be None while a streaming stage doesn't know its size yet."""
+        self.job.stage = stage
+        self.job.progress[stage] = {"done": done, "total": total, **extra}
+        now = time.monotonic()
+        finished = total is not None and done >= total
+        if finished or now - self._last_write >= self.min_interval:
+            self._last_write = now
+            IngestionJob.objects.filter(id=self.job.id).update(
+                stage=stage,
+                progress=self.job.progress,
+                heartbeat_at=timezone.now(),
+            )
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(pdf_obj):
+    """Creates a job for an uploaded PDF and dispatches it according to RAG_INGEST_MODE."""
+    job = IngestionJob.objects.create(pdf=pdf_obj)
+    dispatch(job.id)
+    return job
+
+
+def is_stale(job, older_than=STALE_AFTER_SECONDS):
+    """A RUNNING job whose worker stopped reporting (crashed, or the process restarted)."""
+    if job.status != IngestionJob.RUNNING:
+        return False
+    last_seen = job.heartbeat_at or job.started_at
+    return last_seen is None or last_seen < timezone.now() - timedelta(seconds=older_than)
+
+
+def retry(job):
+    """Puts a failed (or stale running) job back on the queue."""
+    if job.status != IngestionJob.FAILED and not is_stale(job):
+        return False
+    # The status condition keeps two retries (or a worker finishing) from racing
+    retried = IngestionJob.objects.filter(id=job.id, status=job.status).update(
+        status=IngestionJob.QUEUED, stage='', progress={}, error='',
+        worker='', started_at=None, finished_at=None,
+    )
+    if not retried:
+        return False
+    dispatch(job.id)
+    return True
+
+
+def recover_jobs():
+    """
+    Startup hook for RAG_INGEST_MODE = "pool": that queue lives in the memory
+    of the process that dispatched the jobs, so after a restart nobody would
+    pick up its QUEUED jobs or notice its RUNNING ones died. Stale running
+    jobs are requeued and every queued job is dispatched again; claim() is
+    atomic, so a job another live process also dispatched still runs once.
+    Returns the number of jobs dispatched.
+    """
+    if getattr(settings, "RAG_INGEST_MODE", "pool") != "pool":
+        return 0
+    requeue_stale_jobs()
+    job_ids = list(IngestionJob.objects.filter(status=IngestionJob.QUEUED)
+                   .order_by('created_at').values_list('id', flat=True))
+    for job_id in job_ids:
+        dispatch(job_id)
+    return len(job_ids)
+
+
+def dispatch(job_id):
+    mode = getattr(settings, "RAG_INGEST_MODE", "pool")
+    if mode == "sync":
+        job = process_job(job_id)
+        if job is not None:
+            observe_stages("ingest", job.timer.stages, job.timer.samples)
+    elif mode == "pool":
+        _get_executor().submit(_pool_entry, job_id).add_done_callback(_export_timings)
+    # "worker": nothing to do, `manage.py ingest_worker` polls the table
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Each child loads the embedding model once and keeps it for later jobs
+        _executor = process_pool(getattr(settings, "RAG_INGEST_WORKERS", 2))
+    return _executor
+
+
+def _pool_entry(job_id):
+    try:
+        job = process_job(job_id)
+        # Sent back to the parent: that is the process /metrics is served from
+        return (job.timer.stages, job.timer.samples) if job is not None else None
+    finally:
+        close_old_connections()
+
+
+def _export_timings(future):
+    if not future.cancelled() and future.exception() is None and future.result():
+        observe_stages("ingest", *future.result())
+
+
+def claim(job_id=None):
+    """
+    Atomically moves one QUEUED job (a specific one, or the oldest) to RUNNING.
+    Returns the claimed job or None if someone else got there first.
+    """
+    candidates = IngestionJob.objects.filter(status=IngestionJob.QUEUED)
+    if job_id is not None:
+        candidates = candidates.filter(id=job_id)
+
+    for job_id in candidates.order_by('created_at').values_list('id', flat=True)[:5]:
+        now = timezone.now()
+        claimed = IngestionJob.objects.filter(id=job_id, status=IngestionJob.QUEUED).update(
+            status=IngestionJob.RUNNING,
+            worker=worker_name(),
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('pdf').get(id=job_id)
+    return None
+
+
+def requeue_stale_jobs(older_than=STALE_AFTER_SECONDS):
+    """Returns jobs orphaned by a crashed worker to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return IngestionJob.objects.filter(
+        status=IngestionJob.RUNNING, heartbeat_at__lt=cutoff
+    ).update(status=IngestionJob.QUEUED, worker='')
+
+
+def process_job(job_id=None):
+    """Claims and runs one job. Returns the job, or None if there was nothing to claim."""
+    job = claim(job_id)
+    if job is None:
+        return None
+
+    job.attempts += 1
+    IngestionJob.objects.filter(id=job.id).update(attempts=job.attempts)
+    timer = StageTimer()
+    progress = JobProgress(job)
+    try:
+        with timer.activate():
+            duplicate = run_pipeline(job.pdf, progress)
+    except Exception as e:
+        print(f"⚠️ Ingestion job {job.id} failed: {e}")
+        IngestionJob.objects.filter(id=job.id).update(
+            status=IngestionJob.FAILED,
+            error=f"{e}\n\n{traceback.format_exc()}",
+            timings=timer.as_dict(),
+            finished_at=timezone.now(),
+        )
+    else:
+        IngestionJob.objects.filter(id=job.id).update(
+            status=IngestionJob.DONE,
+            error='',
+            timings=timer.as_dict(),
+            finished_at=timezone.now(),
+        )
+        # Other workers notice through corpus_version(); this drops our own copies now
+        answer_cache.invalidate([job.pdf_id])
+
+        # The PDF is searchable (and a valid dedupe source) from here on. The
+        # summary is a step of its own: a failure leaves it empty, the job done.
+        with timer.activate():
+            summarize(job.pdf, progress, reused_from=duplicate)
+        IngestionJob.objects.filter(id=job.id).update(timings=timer.as_dict())
+    job.refresh_from_db()
+    job.timer = timer
+    return job
+
+
+def find_duplicate(pdf_obj, index=None):
+    """Another upload with the same content hash that is fully indexed in the active index."""
+    if not pdf_obj.sha256:
+        return None
+    index = index or active_index()
+    return (
+        UploadedPDF.objects
+        .filter(sha256=pdf_obj.sha256, jobs__status=IngestionJob.DONE, index_entries__index_id=index.pk)
+        .exclude(id=pdf_obj.id)
+        .order_by('uploaded_at')
+        .first()
+    )
+
+
+def run_pipeline(pdf_obj, progress):
+    """
+    extract -> split -> embed -> render for a single PDF. Returns the earlier
+    upload of the same file whose data was reused, or None.
+
+    Extraction (in parallel for large documents), splitting and embedding
+    are chained generators: repeated headers/footers are recognised from a
+    bounded sample of pages up front (see pdf_loader.iter_extracted_pages),
+    then pages stream through, so memory doesn't grow with the page count
+    and only one embedding batch is held at a time.
+    """
+    # A retried job may have left partial chunks/pages behind. Dropping the
+    # index entries too makes a running `reindex` pick this PDF up again.
+    delete_from_vector_store(pdf_obj.id)
+    delete_from_lexical_index([pdf_obj.id])
+    IndexedPDF.objects.filter(pdf=pdf_obj).delete()
+    PDFPage.objects.filter(pdf=pdf_obj).delete()
+    index = active_index()
+
+    if not pdf_obj.sha256:
+        pdf_obj.sha256 = pdf_obj.compute_sha256()
+        UploadedPDF.objects.filter(id=pdf_obj.id).update(sha256=pdf_obj.sha256)
+
+    duplicate = find_duplicate(pdf_obj, index)
+    if duplicate is not None:
+        # Same bytes as an already-processed upload: reuse its chunks, vectors and text
+        with span("clone"):
+            copied = clone_pdf_vectors(duplicate.id, pdf_obj.id)
+            get_lexical_index().clone(duplicate.id, pdf_obj.id, lambda old_id: rebase_chunk_id(old_id, pdf_obj.id))
+        copy_page_text(duplicate.id, pdf_obj)
+        total_pages = PDFPage.objects.filter(pdf=pdf_obj).count()
+        for stage in ("extract", "split"):
+            progress(stage, total_pages, total_pages, reused_from=duplicate.id)
+        progress("embed", copied, copied, reused_from=duplicate.id)
+        print(f"♻️ PDF {pdf_obj.id} is identical to PDF {duplicate.id}; reused {copied} chunks")
+        mark_indexed(index, pdf_obj, copied)
+        render_for_ingestion(pdf_obj, progress)
+        return duplicate
+
+    # 1. Extract text (+ render the pages needed now)
+    with fitz.open(pdf_obj.file.path) as doc:
+        total_pages = doc.page_count
+        rendered = sorted(inline_render_pages(total_pages))
+        for page_number in rendered:
+            render_open_page(pdf_obj, doc[page_number - 1], page_number)
+
+        texts = PageTextWriter(pdf_obj)
+        ocr_pages = stripped = 0
+
+        def extract():
+            nonlocal ocr_pages, stripped
+            for page in iter_extracted_pages(pdf_obj.file.path, doc=doc,
+                                             progress=lambda done, total: progress("extract", done, total)):
+                texts.add(page["page"], page["text"])
+                ocr_pages += page["ocr"]
+                stripped += page["stripped"]
+                if page["text"].strip():
+                    yield page
+
+        def split(chunks):
+            for chunk in chunks:
+                progress("split", chunk.metadata["page"], total_pages)
+                yield chunk
+
+        # BM25 postings are collected from the same chunk stream
+        lexical = SegmentBuilder(pdf_obj.id)
+
+        def index_batch(docs, ids):
+            for chunk, chunk_id in zip(docs, ids):
+                lexical.add(chunk_id, chunk.metadata.get("page"), chunk.page_content)
+
+        # 2. Split into chunks  3. Embed + store, batch by batch
+        stats = add_documents_streaming(
+            split(chunk_pages(extract(), index.config)), pdf_obj.id,
+            progress=lambda done: progress("embed", done, None),
+            on_batch=index_batch,
+        )
+        texts.flush()
+
+    with span("lexical"):
+        get_lexical_index().write(lexical)
+    mark_indexed(index, pdf_obj, stats["chunks"])
+    progress("extract", total_pages, total_pages, ocr_pages=ocr_pages, stripped_blocks=stripped)
+    progress("split", total_pages, total_pages)
+    progress("embed", stats["chunks"], stats["chunks"], chunks_per_sec=stats["chunks_per_sec"])
+    print(f"📥 PDF {pdf_obj.id}: embedded {stats['chunks']} chunks at {stats['chunks_per_sec']} chunks/sec")
+
+    # 4. Page images for visual citations: whatever the pass above didn't render
+    #    (nothing in lazy mode, every page in eager mode with a render pool)
+    render_for_ingestion(pdf_obj, progress, rendered=rendered)
+    return None
+
+
+def summarize(pdf_obj, progress, reused_from=None):
+    """
+    Map-reduce summary for overview questions, run once the job is DONE. A
+    failure (e.g. Ollama not running) leaves the summary empty, not the job
+    failed. reused_from: a duplicate upload whose summary is copied instead.
+    """
+    if reused_from is not None and reused_from.summary:
+        UploadedPDF.objects.filter(id=pdf_obj.id).update(summary=reused_from.summary)
+        pdf_obj.summary = reused_from.summary
+        progress("summarize", 1, 1, reused_from=reused_from.id)
+        return
+    if not summaries_enabled():
+        return
+    try:
+        summarize_pdf(pdf_obj, progress=lambda done, total: progress("summarize", done, total))
+    except Exception as e:
+        print(f"⚠️ Could not summarize PDF {pdf_obj.id}: {e}")
+        progress("summarize", 0, 0, error=str(e) or e.__class__.__name__)
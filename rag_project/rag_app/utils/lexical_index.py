@@ -0,0 +1,271 @@
+# lexical_index.py
+"""
+BM25 inverted index kept next to the vector store.
+
+Dense embeddings are weak at exact terms (part numbers, clause ids, names),
+so every PDF also gets a small lexical segment on disk:
+
+    <RAG_LEXICAL_INDEX_DIR>/<pdf_id>.seg   (zlib-compressed JSON)
+
+A segment only holds chunk ids, pages, lengths and postings; the chunk text
+itself stays in the vector store. Segments are written once per ingestion and
+removed on delete, so updates are incremental per pdf_id. Readers notice new
+or removed segment files on the next search, which keeps worker processes
+and web processes in sync without any coordination.
+"""
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .index_state import active_index, is_legacy, live_indexes
+from .registry import registry
+
+SEGMENT_SUFFIX = ".seg"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_JOINERS = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or "
+    "that the this to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens. Compound identifiers such as "XK-142" or "4.2.1"
+    are kept whole *and* split into their parts, so both forms match.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if _JOINERS.search(token):
+            tokens.extend(part for part in _JOINERS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class SegmentBuilder:
+    """Accumulates postings for one PDF while its chunks stream past."""
+
+    def __init__(self, pdf_id):
+        self.pdf_id = pdf_id
+        self.ids = []
+        self.pages = []
+        self.lengths = []
+        self.postings = {}
+
+    def add(self, chunk_id, page, text):
+        doc_idx = len(self.ids)
+        tokens = tokenize(text)
+        self.ids.append(chunk_id)
+        self.pages.append(page)
+        self.lengths.append(len(tokens))
+
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            # Flat [doc, tf, doc, tf, ...] lists keep the file small
+            self.postings.setdefault(token, []).extend((doc_idx, tf))
+
+    def to_bytes(self):
+        data = {
+            "pdf_id": self.pdf_id,
+            "ids": self.ids,
+            "pages": self.pages,
+            "lengths": self.lengths,
+            "postings": self.postings,
+        }
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+class Segment:
+
+    def __init__(self, data):
+        self.pdf_id = data["pdf_id"]
+        self.ids = data["ids"]
+        self.pages = data["pages"]
+        self.lengths = np.asarray(data["lengths"], dtype=np.float32)
+        self.postings = {}
+        for token, flat in data["postings"].items():
+            pairs = np.asarray(flat, dtype=np.int32).reshape(-1, 2)
+            self.postings[token] = (pairs[:, 0], pairs[:, 1].astype(np.float32))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(json.loads(zlib.decompress(f.read())))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class LexicalIndex:
+
+    def __init__(self, directory, k1=1.5, b=0.75):
+        self.directory = str(directory)
+        self.k1 = k1
+        self.b = b
+        self._segments = {}  # pdf_id -> (mtime, Segment)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, pdf_id):
+        return os.path.join(self.directory, f"{pdf_id}{SEGMENT_SUFFIX}")
+
+    # --- Writes -----------------------------------------------------------
+
+    def write(self, builder):
+        # Write-then-rename so readers never see a half-written segment
+        path = self._path(builder.pdf_id)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(builder.to_bytes())
+        os.replace(tmp_path, path)
+
+    def delete(self, pdf_ids):
+        for pdf_id in pdf_ids:
+            try:
+                os.remove(self._path(pdf_id))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            for pdf_id in pdf_ids:
+                self._segments.pop(int(pdf_id), None)
+
+    def drop(self):
+        """Removes every segment in this index's folder."""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SEGMENT_SUFFIX):
+                os.remove(entry.path)
+        with self._lock:
+            self._segments.clear()
+
+    def clone(self, source_pdf_id, pdf_id, id_map):
+        """Copies a segment to another PDF; id_map(old_chunk_id) -> new chunk id."""
+        path = self._path(source_pdf_id)
+        if not os.path.exists(path):
+            return False
+        segment = Segment.load(path)
+        builder = SegmentBuilder(pdf_id)
+        builder.ids = [id_map(chunk_id) for chunk_id in segment.ids]
+        builder.pages = list(segment.pages)
+        builder.lengths = segment.lengths.astype(int).tolist()
+        builder.postings = {
+            token: np.column_stack(arrays).astype(int).ravel().tolist()
+            for token, arrays in segment.postings.items()
+        }
+        self.write(builder)
+        return True
+
+    # --- Reads ------------------------------------------------------------
+
+    def refresh(self):
+        """Picks up segments added, replaced or removed by other processes."""
+        on_disk = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SEGMENT_SUFFIX):
+                try:
+                    on_disk[int(entry.name[:-len(SEGMENT_SUFFIX)])] = (entry.path, entry.stat().st_mtime)
+                except (ValueError, FileNotFoundError):
+                    continue
+
+        with self._lock:
+            for pdf_id in list(self._segments):
+                if pdf_id not in on_disk:
+                    del self._segments[pdf_id]
+            for pdf_id, (path, mtime) in on_disk.items():
+                cached = self._segments.get(pdf_id)
+                if cached is None or cached[0] != mtime:
+                    try:
+                        self._segments[pdf_id] = (mtime, Segment.load(path))
+                    except (OSError, ValueError, zlib.error) as e:
+                        print(f"⚠️ Could not load lexical segment {path}: {e}")
+
+    def search(self, query, pdf_ids=None, k=10):
+        """
+        BM25 over the segments in scope.
+        Returns [(chunk_id, score, pdf_id, page), ...] best first.
+        """
+        self.refresh()
+        with self._lock:
+            segments = [seg for pid, (_, seg) in self._segments.items() if pdf_ids is None or pid in pdf_ids]
+
+        terms = set(tokenize(query))
+        total_docs = sum(len(seg) for seg in segments)
+        if not terms or not total_docs:
+            return []
+
+        avgdl = float(sum(seg.lengths.sum() for seg in segments)) / total_docs or 1.0
+        idf = {}
+        for term in terms:
+            df = sum(len(seg.postings[term][0]) for seg in segments if term in seg.postings)
+            if df:
+                idf[term] = np.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+
+        hits = []
+        for seg in segments:
+            scores = None
+            norm = self.k1 * (1 - self.b + self.b * seg.lengths / avgdl)
+            for term, term_idf in idf.items():
+                if term not in seg.postings:
+                    continue
+                docs, tfs = seg.postings[term]
+                if scores is None:
+                    scores = np.zeros(len(seg), dtype=np.float32)
+                scores[docs] += term_idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+            if scores is None:
+                continue
+
+            top = np.nonzero(scores)[0]
+            if len(top) > k:
+                top = top[np.argpartition(-scores[top], k)[:k]]
+            hits.extend((seg.ids[i], float(scores[i]), seg.pdf_id, seg.pages[i]) for i in top)
+
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:k]
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "chunks": sum(len(seg) for _, seg in self._segments.values()),
+                "terms": sum(len(seg.postings) for _, seg in self._segments.values()),
+            }
+
+
+def _index_dir():
+    return getattr(settings, "RAG_LEXICAL_INDEX_DIR", settings.BASE_DIR / "lexical_index")
+
+
+def open_lexical_index(index):
+    """Segments of one VectorIndex generation (the pre-versioning index keeps the top folder)."""
+    if is_legacy(index):
+        return LexicalIndex(_index_dir())
+    return LexicalIndex(os.path.join(str(_index_dir()), index.name))
+
+
+registry.register(
+    "lexical_index",
+    lambda: open_lexical_index(active_index()),
+    config=lambda: (_index_dir(), active_index().name),
+)
+
+
+def get_lexical_index():
+    return registry.get("lexical_index")
+
+
+def delete_from_lexical_index(pdf_ids):
+    """Drops the PDFs' segments from the active index and any index being built."""
+    active = active_index()
+    for index in live_indexes():
+        lexical = get_lexical_index() if index.pk == active.pk else open_lexical_index(index)
+        lexical.delete(pdf_ids)
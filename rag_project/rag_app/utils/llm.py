@@ -1,8 +1,113 @@
 # llm.py
+"""
+The Ollama chat client.
+
+One ChatOllama is shared by every request in a process, so calls reuse the
+pooled keep-alive HTTP connections of its client (RAG_LLM_POOL_SIZE of
+them) instead of opening a new connection each time. Async callers get one
+per event loop, because an async connection pool belongs to the loop that
+opened it (under ASGI that is a single loop for the whole process).
+
+Every call asks Ollama to keep the model loaded for RAG_LLM_KEEP_ALIVE, and
+warm_llm() - run by the startup warmup - loads it and evaluates the fixed
+instruction block that starts every Q&A prompt, so the server's prompt
+(KV) cache already holds that prefix when the first question arrives.
+"""
+import asyncio
+import time
+import weakref
+
+import httpx
+from django.conf import settings
 from langchain_ollama import ChatOllama
 
-def get_llm():
+from .metrics import LLM_TOKENS
+from .registry import registry
+
+# Ollama's per-call durations (nanoseconds) -> our stage names
+_OLLAMA_DURATIONS = {
+    "load_duration": "llm_load",
+    "prompt_eval_duration": "llm_prompt_eval",
+    "eval_duration": "llm_generate",
+}
+
+# event loop -> (shared client it was made for, that loop's client)
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def _llm_config():
+    return (
+        getattr(settings, "RAG_LLM_MODEL", "llama3.2"),
+        getattr(settings, "RAG_OLLAMA_BASE_URL", None),  # None: $OLLAMA_HOST or localhost:11434
+        getattr(settings, "RAG_LLM_KEEP_ALIVE", "30m"),
+        getattr(settings, "RAG_LLM_POOL_SIZE", 8),
+        getattr(settings, "RAG_LLM_TIMEOUT", 120),
+    )
+
+
+def build_llm():
+    """A new ChatOllama with its own connection pool."""
+    model, base_url, keep_alive, pool_size, timeout = _llm_config()
     # "llama3.2" is a 3B model optimized for edge devices (much faster)
     # temperature=0 ensures facts are strictly from the context
     # format="json" ensures the model outputs valid JSON locally if supported
-    return ChatOllama(model="llama3.2", temperature=0, format="json")
\ No newline at end of file
+    return ChatOllama(
+        model=model,
+        base_url=base_url,
+        temperature=0,
+        format="json",
+        keep_alive=keep_alive,
+        client_kwargs={
+            "timeout": timeout,
+            "limits": httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        },
+    )
+
+
+registry.register("llm", build_llm, config=_llm_config)
+
+
+def get_llm():
+    """The shared chat model (one per event loop when called from async code)."""
+    llm = registry.get("llm")
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return llm
+    if not isinstance(llm, ChatOllama):
+        # An override (stub) is used as is
+        return llm
+    entry = _loop_clients.get(loop)
+    if entry is None or entry[0] is not llm:
+        entry = _loop_clients[loop] = (llm, build_llm())
+    return entry[1]
+
+
+def warm_llm():
+    """
+    Loads the model into Ollama (for RAG_LLM_KEEP_ALIVE) and runs the Q&A
+    prompt's fixed prefix through it, generating a single token.
+    Returns the seconds it took.
+    """
+    from .qa import PROMPT_PREFIX
+
+    start = time.perf_counter()
+    get_llm().invoke(PROMPT_PREFIX, options={"temperature": 0, "num_predict": 1})
+    return round(time.perf_counter() - start, 4)
+
+
+def record_generation_stats(message, timer=None):
+    """
+    Splits the server-side time Ollama reports for a call into model load,
+    prompt evaluation and generation stages, and counts its tokens.
+    Messages without that metadata (other providers, fakes) are ignored.
+    """
+    meta = getattr(message, "response_metadata", None) or {}
+    if timer is not None:
+        for key, stage in _OLLAMA_DURATIONS.items():
+            if meta.get(key):
+                timer.add(stage, meta[key] / 1e6)
+    if meta.get("prompt_eval_count"):
+        LLM_TOKENS.inc(meta["prompt_eval_count"], kind="prompt")
+    if meta.get("eval_count"):
+        LLM_TOKENS.inc(meta["eval_count"], kind="generated")
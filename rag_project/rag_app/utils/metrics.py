@@ -0,0 +1,162 @@
+# metrics.py
+"""
+Prometheus metrics, rendered in the text exposition format by /metrics.
+
+No client library is needed: histograms and counters are kept in process
+memory with cumulative buckets, as Prometheus expects. Each process exports
+its own numbers, so scrape every web process. Ingestion run in the local
+pool (RAG_INGEST_MODE = "pool" or "sync") is reported by the web process
+that queued it; `manage.py ingest_worker` processes are not scraped.
+"""
+import abc
+import math
+import threading
+
+# Seconds: from a cache hit to a slow CPU generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self):
+        """(name suffix, label pairs, value) for every line to render; called under the lock."""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for suffix, pairs, value in self._samples():
+                lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield "", list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", pairs + [("le", _format_value(bound))], cumulative
+            yield "_sum", pairs, round(total, 6)
+            yield "_count", pairs, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collect):
+        """collect() -> [(name, kind, documentation, [(labels dict, value), ...])], read at scrape time."""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rag_request_duration_seconds", "Time to serve a request, including streaming the body.",
+    ("view", "method", "status"),
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "Time spent per pipeline stage (summed within one request or ingestion).",
+    ("pipeline", "stage"),
+))
+PAGE_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "rag_page_render_duration_seconds", "Time to render one page image and its thumbnail.",
+    ("pipeline",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+))
+PAGE_EXTRACT_SECONDS = REGISTRY.register(Histogram(
+    "rag_page_extract_duration_seconds", "Time to extract one page's text (including OCR).",
+    ("pipeline",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0),
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total", "Tokens reported by the model, by kind (prompt or generated).", ("kind",),
+))
+
+
+def observe_stages(pipeline, stages, samples=None):
+    """Exports a finished StageTimer's stages (ms) and per-page render/extract samples under `pipeline`."""
+    for stage, ms in stages.items():
+        STAGE_SECONDS.observe(ms / 1000, pipeline=pipeline, stage=stage)
+    for ms in (samples or {}).get("render_page", ()):
+        PAGE_RENDER_SECONDS.observe(ms / 1000, pipeline=pipeline)
+    for ms in (samples or {}).get("extract_page", ()):
+        PAGE_EXTRACT_SECONDS.observe(ms / 1000, pipeline=pipeline)
+
+
+def render_metrics():
+    return REGISTRY.render()
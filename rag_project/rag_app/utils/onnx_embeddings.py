@@ -0,0 +1,122 @@
+# onnx_embeddings.py
+"""
+Sentence-transformers models run through ONNX Runtime instead of PyTorch
+(RAG_EMBEDDING_BACKEND = "onnx").
+
+It is the same model with the same pooling (mean over tokens, then L2
+normalisation, as all-MiniLM-L6-v2 does), so its vectors can share an index
+with the PyTorch ones: `manage.py bench_embedding_backends` checks the
+cosine to the PyTorch output. It has no torch import, and with
+RAG_ONNX_QUANTIZE the weights are converted to int8 once (dynamic
+quantization, needs `pip install onnx`) for a faster, smaller CPU encoder.
+
+The ONNX graph and tokenizer come from RAG_ONNX_MODEL_DIR if set
+(model.onnx + tokenizer.json, e.g. an `optimum-cli export onnx` output),
+otherwise from the model's Hugging Face repo, which for sentence-transformers
+models ships onnx/model.onnx.
+"""
+import os
+import re
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+
+def model_files(model_name, model_dir=None):
+    """Paths of (model.onnx, tokenizer.json)."""
+    if model_dir:
+        onnx_path = os.path.join(model_dir, "model.onnx")
+        if not os.path.exists(onnx_path):
+            onnx_path = os.path.join(model_dir, "onnx", "model.onnx")
+        return onnx_path, os.path.join(model_dir, "tokenizer.json")
+
+    from huggingface_hub import hf_hub_download
+    return hf_hub_download(model_name, "onnx/model.onnx"), hf_hub_download(model_name, "tokenizer.json")
+
+
+def quantized_model(onnx_path, model_name):
+    """int8 dynamically quantized copy of a model, made on first use and kept in RAG_ONNX_CACHE_DIR."""
+    cache_dir = getattr(settings, "RAG_ONNX_CACHE_DIR", None) or os.path.dirname(onnx_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    target = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", model_name) + ".int8.onnx")
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(onnx_path):
+        return target
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print(f"⚙️ Quantizing {model_name} to int8 ({target})")
+    # Written under a temporary name: ingestion workers may start at the same time
+    partial = f"{target}.{os.getpid()}.tmp"
+    quantize_dynamic(onnx_path, partial, weight_type=QuantType.QInt8)
+    os.replace(partial, target)
+    return target
+
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled, normalised sentence embeddings from an ONNX transformer."""
+
+    def __init__(self, model_name, model_dir=None, quantize=False, threads=None, batch_size=32,
+                 max_length=256, device="cpu"):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        onnx_path, tokenizer_path = model_files(model_name, model_dir)
+        if quantize:
+            onnx_path = quantized_model(onnx_path, model_name)
+        self.model_name = model_name
+        # Embedding-cache namespace: float32 ONNX reproduces the PyTorch vectors, int8 only approximates them
+        self.name = f"{model_name}@int8" if quantize else model_name
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        # One batch at a time: parallelism is within the matmuls
+        options.inter_op_num_threads = 1
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        # The model's max_seq_length (256 for all-MiniLM-L6-v2); batches pad to their longest text
+        self.tokenizer.enable_truncation(max_length)
+        pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token=self.tokenizer.id_to_token(pad_id) or "[PAD]")
+
+    def _encode(self, texts):
+        # HuggingFaceEmbeddings does the same before encoding
+        encodings = self.tokenizer.encode_batch([text.replace("\n", " ") for text in texts])
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        # Similar lengths share a batch, so little of it is padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
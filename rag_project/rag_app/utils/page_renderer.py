@@ -0,0 +1,239 @@
+# page_renderer.py
+"""
+Page image rendering for visual citations.
+
+Two modes (RAG_PAGE_RENDER_MODE):
+  * "lazy"  - only the cover is rendered at ingest time; any other page is
+              rendered the first time /page_image/<pdf_id>/<page>/ asks for it.
+  * "eager" - every page is rendered at ingest time, with page ranges spread
+              across a process pool (each worker opens its own fitz document).
+
+Pages ingestion can render while it already has the document open (see
+inline_render_pages) are rendered in that same pass.
+
+Images are written straight to MEDIA_ROOT/pdf_pages/ with deterministic names,
+so re-rendering a page overwrites its old file instead of piling up copies.
+"""
+import os
+import time
+from concurrent.futures import as_completed
+from dataclasses import dataclass, asdict
+
+from django.conf import settings
+from django.db import IntegrityError
+
+import fitz  # PyMuPDF
+
+from ..models import PDFPage, UploadedPDF
+from .timing import sample, span
+from .workers import process_pool
+
+PAGES_DIR = "pdf_pages"
+THUMBS_DIR = "pdf_pages/thumbs"
+
+# Pillow handles formats PyMuPDF can't encode itself
+_PIL_FORMATS = {"webp": "WEBP"}
+_EXTENSIONS = {"jpeg": "jpg"}
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    zoom: float = 2.0
+    fmt: str = "jpg"
+    quality: int = 85
+    thumbnail_width: int = 200
+
+    @classmethod
+    def from_settings(cls):
+        fmt = getattr(settings, "RAG_PAGE_FORMAT", "jpg").lower()
+        return cls(
+            zoom=getattr(settings, "RAG_PAGE_ZOOM", 2.0),
+            fmt=_EXTENSIONS.get(fmt, fmt),
+            quality=getattr(settings, "RAG_PAGE_QUALITY", 85),
+            thumbnail_width=getattr(settings, "RAG_THUMBNAIL_WIDTH", 200),
+        )
+
+
+def encode_pixmap(pix, fmt, quality):
+    if fmt in _PIL_FORMATS:
+        return pix.pil_tobytes(format=_PIL_FORMATS[fmt], quality=quality)
+    if fmt == "jpg":
+        return pix.tobytes("jpg", jpg_quality=quality)
+    return pix.tobytes(fmt)
+
+
+def page_file_names(pdf_id, page_number, opts):
+    name = f"{pdf_id}_page_{page_number}.{opts.fmt}"
+    return f"{PAGES_DIR}/{name}", f"{THUMBS_DIR}/{name}"
+
+
+def render_page(page, pdf_id, page_number, media_root, opts):
+    """Renders one loaded fitz page to its image and thumbnail files. Returns their names."""
+    image_name, thumb_name = page_file_names(pdf_id, page_number, opts)
+
+    pix = page.get_pixmap(matrix=fitz.Matrix(opts.zoom, opts.zoom))
+    with open(os.path.join(media_root, image_name), "wb") as f:
+        f.write(encode_pixmap(pix, opts.fmt, opts.quality))
+
+    # Thumbnails are rendered at their target width rather than
+    # downscaled from the full image, which is both faster and sharper.
+    thumb_zoom = opts.thumbnail_width / max(page.rect.width, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(thumb_zoom, thumb_zoom))
+    with open(os.path.join(media_root, thumb_name), "wb") as f:
+        f.write(encode_pixmap(pix, opts.fmt, opts.quality))
+    return image_name, thumb_name
+
+
+def _make_dirs(media_root):
+    for folder in (PAGES_DIR, THUMBS_DIR):
+        os.makedirs(os.path.join(media_root, folder), exist_ok=True)
+
+
+def render_page_range(pdf_path, pdf_id, start, end, media_root, opts):
+    """
+    Renders pages [start, end) (1-based) to full size and thumbnail files.
+    Runs in worker processes, so it only touches the filesystem, never the DB.
+    Returns [(page_number, image_name, thumbnail_name, render_ms), ...].
+    """
+    if isinstance(opts, dict):
+        opts = RenderOptions(**opts)
+    _make_dirs(media_root)
+
+    rendered = []
+    with span("render"):
+        doc = fitz.open(pdf_path)
+        try:
+            for page_number in range(start, min(end, doc.page_count + 1)):
+                started = time.perf_counter()
+                image_name, thumb_name = render_page(doc[page_number - 1], pdf_id, page_number, media_root, opts)
+                rendered.append((page_number, image_name, thumb_name, (time.perf_counter() - started) * 1000))
+        finally:
+            doc.close()
+    return rendered
+
+
+def render_open_page(pdf_obj, page, page_number, opts=None):
+    """Renders and records a page of a document the caller already has open."""
+    opts = opts or RenderOptions.from_settings()
+    media_root = str(settings.MEDIA_ROOT)
+    _make_dirs(media_root)
+    with span("render"):
+        started = time.perf_counter()
+        image_name, thumb_name = render_page(page, pdf_obj.id, page_number, media_root, opts)
+    _save_pages(pdf_obj, [(page_number, image_name, thumb_name, (time.perf_counter() - started) * 1000)])
+
+
+def _save_pages(pdf_obj, rendered):
+    for page_number, image_name, thumb_name, render_ms in rendered:
+        sample("render_page", render_ms)
+        PDFPage.objects.update_or_create(
+            pdf=pdf_obj, page_number=page_number,
+            defaults={"image": image_name, "thumbnail": thumb_name},
+        )
+        if page_number == 1:
+            UploadedPDF.objects.filter(id=pdf_obj.id).update(cover_image=thumb_name)
+
+
+def _media_file_exists(field):
+    return bool(field) and os.path.exists(os.path.join(settings.MEDIA_ROOT, field.name))
+
+
+def get_page(pdf_obj, page_number, opts=None):
+    """
+    Returns the PDFPage for a page, rendering and recording it on first use.
+    Returns None if the page number is out of range.
+    """
+    page_obj = PDFPage.objects.filter(pdf=pdf_obj, page_number=page_number).first()
+    if page_obj and _media_file_exists(page_obj.image) and _media_file_exists(page_obj.thumbnail):
+        return page_obj
+
+    opts = opts or RenderOptions.from_settings()
+    rendered = render_page_range(
+        pdf_obj.file.path, pdf_obj.id, page_number, page_number + 1,
+        str(settings.MEDIA_ROOT), opts,
+    )
+    if not rendered:
+        return None
+
+    try:
+        _save_pages(pdf_obj, rendered)
+    except IntegrityError:
+        pass  # A concurrent request recorded the same page; its files are identical
+    return PDFPage.objects.get(pdf=pdf_obj, page_number=page_number)
+
+
+def render_all_pages(pdf_obj, progress=None, opts=None, workers=None):
+    """Eager mode: renders every page, spreading page ranges over a process pool."""
+    opts = opts or RenderOptions.from_settings()
+    workers = workers or getattr(settings, "RAG_RENDER_WORKERS", os.cpu_count() or 1)
+
+    with fitz.open(pdf_obj.file.path) as doc:
+        total = doc.page_count
+    if progress:
+        progress("render", 0, total)
+    if total == 0:
+        return 0
+
+    # Several ranges per worker keeps the pool busy when some pages are heavier
+    range_size = max(1, min(25, -(-total // (workers * 4))))
+    ranges = [(start, min(start + range_size, total + 1)) for start in range(1, total + 1, range_size)]
+
+    done = 0
+    if workers <= 1 or len(ranges) == 1:
+        for start, end in ranges:
+            rendered = render_page_range(pdf_obj.file.path, pdf_obj.id, start, end, str(settings.MEDIA_ROOT), opts)
+            _save_pages(pdf_obj, rendered)
+            done += len(rendered)
+            if progress:
+                progress("render", done, total)
+        return done
+
+    # The workers have no timer of their own; per-page times come back with the results
+    with span("render"), process_pool(workers) as pool:
+        futures = [
+            pool.submit(render_page_range, pdf_obj.file.path, pdf_obj.id, start, end,
+                        str(settings.MEDIA_ROOT), asdict(opts))
+            for start, end in ranges
+        ]
+        for future in as_completed(futures):
+            rendered = future.result()
+            _save_pages(pdf_obj, rendered)
+            done += len(rendered)
+            if progress:
+                progress("render", done, total)
+    return done
+
+
+def inline_render_pages(total_pages):
+    """
+    Pages the ingestion pass renders itself while it reads the document: the
+    cover in lazy mode, every page in eager mode without a render pool.
+    """
+    if getattr(settings, "RAG_PAGE_RENDER_MODE", "lazy") == "eager":
+        if getattr(settings, "RAG_RENDER_WORKERS", os.cpu_count() or 1) <= 1:
+            return set(range(1, total_pages + 1))
+        return set()  # Rendered in parallel by render_all_pages afterwards
+    return {1} if total_pages else set()
+
+
+def render_for_ingestion(pdf_obj, progress=None, rendered=()):
+    """
+    Ingestion "render" stage: the cover only in lazy mode, every page in eager
+    mode. rendered: pages the ingestion pass already rendered itself.
+    """
+    rendered = set(rendered)
+    if getattr(settings, "RAG_PAGE_RENDER_MODE", "lazy") == "eager":
+        if rendered:
+            # inline_render_pages() only renders in eager mode when it does every page
+            if progress:
+                progress("render", len(rendered), len(rendered))
+            return len(rendered)
+        return render_all_pages(pdf_obj, progress)
+
+    if progress:
+        progress("render", 0, 1)
+    if 1 not in rendered:
+        get_page(pdf_obj, 1)
+    if progress:
+        progress("render", 1, 1)
+    return 1
@@ -0,0 +1,65 @@
+# page_text.py
+"""
+Per-page text extracted at ingest time, stored on PDFPage.text.
+
+Ingestion writes it once while it reads the document; transcripts and any
+other reader get it from the database instead of re-parsing the PDF.
+"""
+from ..models import PDFPage
+from .pdf_loader import iter_pages
+from .timing import span
+
+
+class PageTextWriter:
+    """Buffers page text during ingestion and writes it in bulk."""
+
+    def __init__(self, pdf_obj, batch_size=100):
+        self.pdf_obj = pdf_obj
+        self.batch_size = batch_size
+        self._pending = []
+
+    def add(self, page_number, text):
+        self._pending.append(PDFPage(pdf=self.pdf_obj, page_number=page_number, text=text))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        # Rows for pages rendered already (e.g. the cover) only get their text set
+        with span("page_text"):
+            PDFPage.objects.bulk_create(
+                self._pending,
+                update_conflicts=True,
+                unique_fields=["pdf", "page_number"],
+                update_fields=["text"],
+            )
+        self._pending = []
+
+
+def copy_page_text(source_pdf_id, pdf_obj):
+    """Copies stored text from an identical, already-ingested PDF."""
+    writer = PageTextWriter(pdf_obj)
+    rows = PDFPage.objects.filter(pdf_id=source_pdf_id).values_list("page_number", "text")
+    for page_number, text in rows.iterator(chunk_size=writer.batch_size):
+        writer.add(page_number, text)
+    writer.flush()
+
+
+def has_page_text(pdf_obj):
+    return PDFPage.objects.filter(pdf=pdf_obj).exclude(text="").exists()
+
+
+def iter_page_text(pdf_obj):
+    """
+    Yields {"text": "...", "page": 1} for every page with text, from the
+    database. PDFs ingested before text was stored fall back to the file.
+    """
+    if not has_page_text(pdf_obj):
+        yield from iter_pages(pdf_obj.file.path)
+        return
+
+    rows = PDFPage.objects.filter(pdf=pdf_obj).exclude(text="").order_by("page_number")
+    for page_number, text in rows.values_list("page_number", "text").iterator(chunk_size=100):
+        if text.strip():
+            yield {"text": text, "page": page_number}
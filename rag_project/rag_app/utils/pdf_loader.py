@@ -1,17 +1,304 @@
+# pdf_loader.py
+"""
+Layout-aware PDF text extraction.
+
+Each page is read as text blocks rather than one raw text dump:
+  * blocks are put in reading order (left column before right column on
+    two-column pages);
+  * blocks in the top/bottom RAG_EXTRACT_MARGIN of the page are candidate
+    running headers/footers, and those repeated across the document (page
+    numbers, titles, confidentiality notices) are dropped before chunking;
+  * pages without a text layer that contain images (scans) go to the OCR
+    backend in RAG_OCR_BACKEND, if one is configured.
+
+Large documents are split into page ranges and extracted by a process pool,
+each worker opening its own fitz document; smaller ones are read serially
+from a single open document. Every page's extraction time is
+reported as an "extract_page" sample (see timing.py and /metrics).
+
+Pages are streamed in order (iter_extracted_pages), so ingestion holds a
+bounded number of pages however long the document is: repeated headers and
+footers are recognised from a sample of up to HEADER_SAMPLE_PAGES pages
+spread over the document, and the pool only runs a few ranges ahead.
+"""
+import os
+import re
+import time
+from collections import Counter, deque
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
 import fitz  # PyMuPDF
 
+from .timing import sample, span
+from .workers import process_pool
 
-def extract_text_from_pdf(pdf_path: str) -> list[dict]:
+# Blocks wider than this share of the page span both columns
+_FULL_WIDTH = 0.6
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+# Pages read to find the running headers/footers (every page of shorter documents)
+HEADER_SAMPLE_PAGES = 60
+
+
+@dataclass(frozen=True)
+class ExtractOptions:
+    margin: float = 0.08
+    strip_repeated: bool = True
+    ocr_backend: str | None = None
+    ocr_language: str = "eng"
+    ocr_dpi: int = 300
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            margin=getattr(settings, "RAG_EXTRACT_MARGIN", 0.08),
+            strip_repeated=getattr(settings, "RAG_EXTRACT_STRIP_REPEATED", True),
+            ocr_backend=getattr(settings, "RAG_OCR_BACKEND", None),
+            ocr_language=getattr(settings, "RAG_OCR_LANGUAGE", "eng"),
+            ocr_dpi=getattr(settings, "RAG_OCR_DPI", 300),
+        )
+
+
+def _is_two_column(left, right, height):
+    """Both sides carry text over a good part of the same vertical stretch."""
+    if len(left) < 2 or len(right) < 2:
+        return False
+    top = max(min(b[1] for b in left), min(b[1] for b in right))
+    bottom = min(max(b[3] for b in left), max(b[3] for b in right))
+    return bottom - top > height * 0.25
+
+
+def reading_order(blocks, width, height):
     """
-    Extracts text from a PDF, preserving page numbers.
-    Returns: [{"text": "...", "page": 1}, ...]
+    Sorts (x0, y0, x1, y1, text) blocks top to bottom; on two-column pages
+    each run of column blocks between full-width ones is read left column first.
+    """
+    blocks = sorted(blocks, key=lambda b: (round(b[1], 1), b[0]))
+    mid = width / 2
+    left = [b for b in blocks if b[2] <= mid]
+    right = [b for b in blocks if b[0] >= mid]
+    if not _is_two_column(left, right, height):
+        return blocks
+
+    ordered, column_left, column_right = [], [], []
+    for block in blocks:
+        x0, _, x1, _ = block[:4]
+        if x1 - x0 > width * _FULL_WIDTH or x0 < mid < x1:
+            ordered += column_left + column_right
+            column_left, column_right = [], []
+            ordered.append(block)
+        elif x1 <= mid:
+            column_left.append(block)
+        else:
+            column_right.append(block)
+    return ordered + column_left + column_right
+
+
+def _zone(block, height, margin):
+    if block[3] <= height * margin:
+        return "header"
+    if block[1] >= height * (1 - margin):
+        return "footer"
+    return "body"
+
+
+def _ocr_blocks(page, opts):
+    """Text blocks for a page without a text layer, from the configured OCR backend."""
+    if opts.ocr_backend == "tesseract":
+        # PyMuPDF drives a local Tesseract install (needs tesseract + its tessdata)
+        textpage = page.get_textpage_ocr(language=opts.ocr_language, dpi=opts.ocr_dpi, full=True)
+        return page.get_text("blocks", textpage=textpage)
+    # Any callable(page, language, dpi) -> str, given as a dotted path
+    text = import_string(opts.ocr_backend)(page, opts.ocr_language, opts.ocr_dpi)
+    return [(*page.rect, text or "", 0, 0)]
+
+
+def extract_page(page, opts):
+    """Returns ([(zone, text), ...] in reading order, whether OCR was used)."""
+    width, height = page.rect.width, page.rect.height
+    # Block type 0 is text; images come back as type 1
+    blocks = [b[:5] for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
+    used_ocr = False
+    if not blocks and opts.ocr_backend and page.get_images():
+        try:
+            blocks = [b[:5] for b in _ocr_blocks(page, opts) if b[6] == 0 and b[4].strip()]
+            used_ocr = True
+        except Exception as e:
+            print(f"⚠️ OCR failed on page {page.number + 1}: {e}")
+    ordered = reading_order(blocks, width, height)
+    return [(_zone(b, height, opts.margin), b[4].strip()) for b in ordered], used_ocr
+
+
+def _extract_range(doc, start, end, opts):
+    pages = []
+    for page_number in range(start, min(end, doc.page_count + 1)):
+        started = time.perf_counter()
+        blocks, used_ocr = extract_page(doc[page_number - 1], opts)
+        pages.append({"page": page_number, "blocks": blocks, "ocr": used_ocr,
+                      "ms": (time.perf_counter() - started) * 1000})
+    return pages
+
+
+def extract_page_range(pdf_path, start, end, opts):
+    """
+    Extracts pages [start, end) (1-based). Runs in worker processes, so it
+    only reads the file, never the DB.
+    Returns [{"page", "blocks", "ocr", "ms"}, ...].
+    """
+    if isinstance(opts, dict):
+        opts = ExtractOptions(**opts)
+
+    with span("extract"), fitz.open(pdf_path) as doc:
+        return _extract_range(doc, start, end, opts)
+
+
+def _signature(text):
+    """Header/footer text with page numbers and spacing normalised away."""
+    return _WHITESPACE.sub(" ", _DIGITS.sub("#", text)).strip().lower()
+
+
+def repeated_margin_text(pages):
+    """Signatures of header/footer blocks that recur on enough pages to be boilerplate."""
+    counts = Counter()
+    for page in pages:
+        counts.update({_signature(text) for zone, text in page["blocks"] if zone != "body"})
+    # Odd/even pages often alternate headers, so ~40% is already "every page"
+    needed = max(3, int(len(pages) * 0.4))
+    return {signature for signature, count in counts.items() if count >= needed}
+
+
+def assemble_page(page, repeated):
+    """Joins a page's blocks into its text, leaving out the `repeated` headers/footers."""
+    kept = [text for zone, text in page["blocks"] if zone == "body" or _signature(text) not in repeated]
+    return {
+        # Blank lines between blocks give the splitter paragraph boundaries
+        "text": "\n\n".join(kept),
+        "page": page["page"],
+        "ocr": page["ocr"],
+        "stripped": len(page["blocks"]) - len(kept),
+    }
+
+
+def assemble(pages, opts):
+    """Joins each page's blocks into its text, leaving out repeated headers/footers."""
+    repeated = repeated_margin_text(pages) if opts.strip_repeated else set()
+    return [assemble_page(page, repeated) for page in pages]
+
+
+def sample_page_numbers(total, size=None):
+    """Up to `size` (HEADER_SAMPLE_PAGES) page numbers spread evenly from the first page to the last."""
+    size = size or HEADER_SAMPLE_PAGES
+    if total <= size:
+        return list(range(1, total + 1))
+    return sorted({1 + round(i * (total - 1) / (size - 1)) for i in range(size)})
+
+
+def iter_extracted_pages(pdf_path, opts=None, workers=None, progress=None, doc=None):
     """
-    pages_data = []
+    Every page of the document (text-less ones with text ""), in page order,
+    as a generator: {"text", "page", "ocr", "stripped"}. Documents of at
+    least RAG_EXTRACT_PARALLEL_MIN_PAGES pages are spread over a process
+    pool; smaller ones are read in one pass over a single fitz document, doc
+    if the caller already has the file open (to render pages from it, say).
+    progress(done, total) is called as page ranges finish.
+    """
+    opts = opts or ExtractOptions.from_settings()
+    workers = workers or getattr(settings, "RAG_EXTRACT_WORKERS", os.cpu_count() or 1)
+
+    if doc is None:
+        with fitz.open(pdf_path) as doc:
+            yield from iter_extracted_pages(pdf_path, opts, workers, progress, doc)
+        return
+
+    total = doc.page_count
+    if total == 0:
+        return
+
+    # The sampled pages are kept, so a short document is still read only once
+    sampled = {}
+    repeated = set()
+    if opts.strip_repeated:
+        with span("extract"):
+            for page_number in sample_page_numbers(total):
+                sampled[page_number] = _extract_range(doc, page_number, page_number + 1, opts)[0]
+        repeated = repeated_margin_text(sampled.values())
+
+    range_size = max(1, min(25, -(-total // (workers * 4))))
+    ranges = [(start, min(start + range_size, total + 1)) for start in range(1, total + 1, range_size)]
+
+    done = 0
+    for pages in _extracted_ranges(pdf_path, doc, ranges, opts, workers, total, sampled):
+        for page in pages:
+            sample("extract_page", page["ms"])
+            yield assemble_page(page, repeated)
+        done += len(pages)
+        if progress:
+            progress(done, total)
 
-    doc = fitz.open(pdf_path)
-    for i, page in enumerate(doc):
-        text = page.get_text()
-        if text.strip():  # Only add pages with text
-            pages_data.append({"text": text, "page": i + 1}) # 1-based indexing
 
-    return pages_data
+def _extracted_ranges(pdf_path, doc, ranges, opts, workers, total, sampled):
+    """Each range's raw pages, in order. The pool runs at most 2 * workers ranges ahead of the reader."""
+    if workers <= 1 or len(ranges) == 1 or total < getattr(settings, "RAG_EXTRACT_PARALLEL_MIN_PAGES", 200):
+        for start, end in ranges:
+            with span("extract"):
+                pages = [sampled.pop(n) if n in sampled else _extract_range(doc, n, n + 1, opts)[0]
+                         for n in range(start, end)]
+            yield pages
+        return
+
+    # The workers re-read the sampled pages; dropping them keeps the reader's memory bounded
+    sampled.clear()
+    # The workers have no timer of their own; per-page times come back with the results
+    with process_pool(workers) as pool:
+        todo = iter(ranges)
+        pending = deque()
+
+        def submit():
+            page_range = next(todo, None)
+            if page_range is not None:
+                pending.append(pool.submit(extract_page_range, pdf_path, *page_range, asdict(opts)))
+
+        for _ in range(workers * 2):
+            submit()
+        while pending:
+            with span("extract"):
+                pages = pending.popleft().result()
+            submit()
+            yield pages
+
+
+def extract_pages(pdf_path, opts=None, workers=None, progress=None, doc=None):
+    """iter_extracted_pages() as a list, for callers that need every page at once."""
+    return list(iter_extracted_pages(pdf_path, opts, workers, progress, doc))
+
+
+def iter_pages(pdf_path: str, opts=None):
+    """
+    Yields {"text": "...", "page": 1} for every page with text (1-based page
+    numbers), reading one page at a time. Repeated headers/footers are kept:
+    finding them takes the whole document, so callers that need them
+    stripped use extract_pages.
+    """
+    opts = opts or ExtractOptions.from_settings()
+    # Also read on request paths (transcripts), where a process pool has no place
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            started = time.perf_counter()
+            blocks, _ = extract_page(page, opts)
+            sample("extract_page", (time.perf_counter() - started) * 1000)
+            text = "\n\n".join(text for _, text in blocks)
+            if text.strip():
+                yield {"text": text, "page": page.number + 1}
+
+
+def extract_text_from_pdf(pdf_path: str) -> list[dict]:
+    """
+    Extracts text from a PDF, preserving page numbers and leaving out
+    repeated headers/footers.
+    Returns: [{"text": "...", "page": 1}, ...]
+    """
+    return [{"text": page["text"], "page": page["page"]}
+            for page in extract_pages(pdf_path) if page["text"].strip()]
@@ -0,0 +1,85 @@
+# profiler.py
+"""
+A small sampling profiler for single requests (stdlib only).
+
+A background thread snapshots the Python stack of every busy thread every
+RAG_PROFILE_INTERVAL_MS and counts identical stacks. Async views hand their
+blocking work to the rag-qa thread pool, so sampling all threads (rather
+than just the request's) is what catches it; threads parked in a queue,
+lock or selector are skipped as idle. Output is the "collapsed stack" format
+read by flamegraph.pl, speedscope and similar tools.
+
+Meant for a development server handling one profiled request at a time:
+concurrent requests show up in each other's profiles.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+# A leaf frame in one of these means the thread is waiting, not working
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+# ...or a thread pool worker waiting for its next task (queue.get is C code)
+_IDLE_FUNCTIONS = {"_worker"}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame):
+    code = frame.f_code
+    return code.co_filename.endswith(_IDLE_FILES) or code.co_name in _IDLE_FUNCTIONS
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rag-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """One "outer;...;inner count" line per distinct stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, n=15):
+        """The innermost frames seen most often, as (frame, samples)."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
@@ -0,0 +1,423 @@
+# qa.py
+"""
+Building blocks of the /ask_question/ pipeline, shared by the blocking,
+async and streaming (SSE) entry points:
+
+cache lookup -> retrieve (-> rerank) -> cite -> build prompt -> LLM -> parse -> source link
+
+Overview questions about one document ("what is this PDF about?") skip all
+of that when ingestion has stored the document's summary.
+
+Every entry point reports per-stage wall-clock milliseconds under "timings".
+Pass the request's StageTimer (request.timer, set by TimingMiddleware) so the
+same stages also reach /metrics and the Server-Timing header.
+"""
+import asyncio
+import json
+import re
+import time
+
+from django.urls import reverse
+
+from ..models import PDFPage, UploadedPDF
+from .answer_cache import answer_cache, corpus_version
+from .concurrency import llm_admission, run_blocking
+from .context_builder import format_chunk, pack_context
+from .embeddings import get_embeddings
+from .llm import get_llm, record_generation_stats
+from .summarizer import is_overview_question
+from . import reranker, retrieval
+from .timing import StageTimer
+
+NO_INFO_ANSWER = {
+    "title": "No Info Found",
+    "subtitle": "Search Result",
+    "content": "I couldn't find relevant information in the uploaded documents.",
+    "points": []
+}
+
+# The prompt tells the model to use this phrase when the context lacks the answer
+NOT_FOUND_PHRASE = "cannot find the answer"
+
+# The fixed instructions come first and never change, so Ollama can reuse
+# their evaluated KV cache from one request to the next (and warm_llm() primes
+# it at startup). Everything that varies goes after them.
+PROMPT_PREFIX = """You are a strict AI assistant designed to answer questions based ONLY on the provided context from a PDF document.
+
+**CRITICAL INSTRUCTIONS:**
+1.  **NO OUTSIDE KNOWLEDGE:** Do not use your own knowledge. If the answer is not explicitly in the Context below, you MUST say "I cannot find the answer in the document."
+2.  **JSON ONLY:** Output your answer in valid JSON format.
+3.  **JSON STRUCTURE:**
+    {
+        "title": "A short headline",
+        "subtitle": "Context summary",
+        "content": "The answer found in the text. if not found, say 'I cannot find the answer in the document.'",
+        "points": ["Key point 1", "Key point 2"] (optional, can be empty)
+    }
+
+"""
+
+PROMPT_TEMPLATE = """Context:
+{context}
+
+Question: {question}
+"""
+
+
+def lookup_cache(question, pdf_id, embedding=None):
+    """
+    Checks the answer cache (exact, then semantic).
+    Returns (payload, tier, store): payload/tier are None on a miss, and
+    store(payload) caches a freshly generated answer under the same version.
+    embedding: the question's query vector, if the caller already has it.
+    """
+    version = corpus_version(pdf_id)
+    question_embedding = [] if embedding is None else [embedding]
+
+    def embed_question():
+        if not question_embedding:
+            question_embedding.append(get_embeddings().embed_query(question))
+        return question_embedding[0]
+
+    cached, tier = answer_cache.get(question, pdf_id, version, embed=embed_question)
+
+    def store(payload):
+        answer_cache.put(question, pdf_id, version, payload,
+                         embedding=question_embedding[0] if question_embedding else None)
+
+    return cached, tier, store
+
+
+def retrieve(question, pdf_id, k=6, weights=None, timer=None):
+    """
+    Top-k chunks (hybrid BM25 + dense by default). weights: optional (dense,
+    lexical) RRF weights. With RAG_RERANK_ENABLED, over-fetches candidates and
+    lets the cross-encoder pick the k best.
+    Returns (docs, rerank_info); rerank_info is None when reranking is off.
+    """
+    timer = timer or StageTimer()
+    if not reranker.rerank_enabled():
+        with timer.stage("retrieve"):
+            return retrieval.search(question, pdf_id, k, weights=weights), None
+
+    with timer.stage("retrieve"):
+        candidates = retrieval.search(question, pdf_id, reranker.candidate_count(k), weights=weights)
+    with timer.stage("rerank"):
+        return reranker.rerank(question, candidates, k)
+
+
+def retrieve_batch(questions, pdf_id, k=6, weights=None, vectors=None, timer=None):
+    """
+    retrieve() for several questions with the same scope, sharing one encoder
+    batch and one vector search. vectors: the questions' query embeddings, if
+    already computed. Returns a (docs, rerank_info) pair per question.
+    """
+    timer = timer or StageTimer()
+    if not reranker.rerank_enabled():
+        with timer.stage("retrieve"):
+            return [(docs, None) for docs in retrieval.search_batch(questions, pdf_id, k, weights, vectors)]
+
+    with timer.stage("retrieve"):
+        candidates = retrieval.search_batch(questions, pdf_id, reranker.candidate_count(k), weights, vectors)
+    with timer.stage("rerank"):
+        return [reranker.rerank(question, docs, k) for question, docs in zip(questions, candidates)]
+
+
+def cited_page(doc):
+    """
+    The page a chunk is cited on (1-based). A chunk running over a page
+    break is cited on the page holding most of its text: its character
+    offsets say how much of it lies on the last page.
+    """
+    metadata = doc.metadata
+    first, last = metadata.get("page_start"), metadata.get("page_end")
+    if first is None or last is None or first == last:
+        return metadata.get("page", 1)
+    if last - first > 1:
+        # Whole pages in between outweigh the two partial ones
+        return first + 1
+    on_last = metadata.get("end", 0)
+    return last if on_last > len(doc.page_content) - on_last else first
+
+
+def cite(docs):
+    """
+    Picks the citation from the best hit (the cross-encoder's top pick when reranking).
+    Returns (pdf_id, page_number, source_image_url).
+    """
+    best_doc = docs[0]
+    matched_pdf_id = best_doc.metadata.get('pdf_id')
+    source_page_num = cited_page(best_doc)
+
+    # The image is rendered on demand when the browser first loads it
+    source_image_url = None
+    if matched_pdf_id:
+        source_image_url = reverse('page_image', args=[matched_pdf_id, source_page_num])
+    return matched_pdf_id, source_page_num, source_image_url
+
+
+def build_prompt(question, docs, timer=None):
+    """
+    Packs the chunks under the token budget (merging neighbours, dropping
+    near-duplicates) and fills in the template. Returns (prompt, context_stats).
+    """
+    timer = timer or StageTimer()
+    with timer.stage("context"):
+        packed, stats = pack_context(docs)
+        # Add page numbers to context for the LLM
+        context = "".join(format_chunk(doc) for doc in packed)
+    return PROMPT_PREFIX + PROMPT_TEMPLATE.format(context=context, question=question), stats
+
+
+def parse_answer(raw_answer, timer=None):
+    """Robust JSON extraction from the model output, falling back to the raw text."""
+    with (timer or StageTimer()).stage("parse"):
+        return _parse_answer(raw_answer)
+
+
+def _parse_answer(raw_answer):
+    try:
+        # Look for something that starts with { and ends with } (including newlines)
+        match = re.search(r'\{.*\}', raw_answer, re.DOTALL)
+        if match:
+            return json.loads(match.group(0))
+        raise ValueError("No JSON object found")
+
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"JSON Parse Error: {e}. Raw output: {raw_answer}")
+        return {
+            "title": "Answer",
+            "subtitle": "Generated Response",
+            "content": raw_answer,  # Fallback to showing whatever the model spit out
+            "points": []
+        }
+
+
+def page_image_url(pdf_id, page_number):
+    """Direct media URL when the page is already rendered, else the on-demand render endpoint."""
+    page_obj = PDFPage.objects.filter(pdf_id=pdf_id, page_number=page_number).first()
+    if page_obj and page_obj.image:
+        return page_obj.image.url
+    return reverse('page_image', args=[pdf_id, page_number])
+
+
+def pdf_url_for(pdf_id):
+    try:
+        pdf_obj = UploadedPDF.objects.get(id=pdf_id)
+    except UploadedPDF.DoesNotExist:
+        return ""
+    return pdf_obj.file.url if pdf_obj.file else ""
+
+
+def answer_found(answer_json):
+    content = answer_json.get("content", "")
+    return NOT_FOUND_PHRASE not in str(content).lower()
+
+
+def build_payload(answer_json, matched_pdf_id, source_page_num, source_image_url, pdf_url=None):
+    """Final response shape. Only provide a source if the answer was actually found."""
+    source_pdf_url = ""
+    if not answer_found(answer_json):
+        source_page_num = None
+    elif matched_pdf_id:
+        source_pdf_url = pdf_url if pdf_url is not None else pdf_url_for(matched_pdf_id)
+
+    return {
+        "answer": answer_json,
+        "source_image": source_image_url,
+        "pdf_url": source_pdf_url,
+        "page_number": source_page_num
+    }
+
+
+def summary_answer(question, pdf_id, timer=None):
+    """
+    The stored summary as the answer payload, for an overview question about
+    one PDF (the selected one, or the only one uploaded). None otherwise.
+    """
+    if not is_overview_question(question):
+        return None
+    with (timer or StageTimer()).stage("summary"):
+        pdfs = UploadedPDF.objects.all() if pdf_id in (None, "all") else UploadedPDF.objects.filter(id=pdf_id)
+        pdfs = list(pdfs[:2])
+        if len(pdfs) != 1 or not pdfs[0].summary:
+            return None
+        pdf = pdfs[0]
+        return {
+            "answer": {
+                "title": "Document overview",
+                "subtitle": pdf.filename,
+                "content": pdf.summary,
+                "points": [],
+            },
+            "source_image": page_image_url(pdf.id, 1),
+            "pdf_url": pdf.file.url if pdf.file else "",
+            "page_number": 1,
+            "summary": True,
+        }
+
+
+def answer_question(question, pdf_id, weights=None, timer=None):
+    """Blocking Q&A. Returns the response payload, with "cached" set to the cache tier used."""
+    timer = timer or StageTimer()
+    with timer.activate():
+        return _answer_question(question, pdf_id, weights, timer)
+
+
+def _answer_question(question, pdf_id, weights, timer):
+    summary = summary_answer(question, pdf_id, timer)
+    if summary is not None:
+        return {**summary, "cached": None, "timings": timer.as_dict()}
+
+    with timer.stage("cache"):
+        cached, tier, store = lookup_cache(question, pdf_id)
+    if cached is not None:
+        return {**cached, "cached": tier, "timings": timer.as_dict()}
+
+    docs, rerank_info = retrieve(question, pdf_id, weights=weights, timer=timer)
+    if not docs:
+        return {"answer": NO_INFO_ANSWER, "timings": timer.as_dict()}
+
+    matched_pdf_id, source_page_num, source_image_url = cite(docs)
+
+    prompt, context_stats = build_prompt(question, docs, timer)
+    with timer.stage("llm"):
+        response = get_llm().invoke(prompt)
+    record_generation_stats(response, timer)
+    raw_answer = getattr(response, "content", str(response))
+    answer_json = parse_answer(raw_answer, timer)
+
+    with timer.stage("citation"):
+        payload = build_payload(answer_json, matched_pdf_id, source_page_num, source_image_url)
+    store(payload)
+    return {**payload, "cached": None, "rerank": rerank_info, "context": context_stats,
+            "timings": timer.as_dict()}
+
+
+async def answer_question_async(question, pdf_id, weights=None, timer=None):
+    """
+    Async Q&A for ASGI. Blocking Chroma/embedding/ORM work runs on the bounded
+    executor, the citation lookups run concurrently with generation, and the
+    LLM call goes through the admission queue (raises Overloaded when full).
+    """
+    timer = timer or StageTimer()
+    summary = await run_blocking(summary_answer, question, pdf_id, timer)
+    if summary is not None:
+        return {**summary, "cached": None, "timings": timer.as_dict()}
+
+    with timer.stage("cache"):
+        cached, tier, store = await run_blocking(timer.bind(lookup_cache), question, pdf_id)
+    if cached is not None:
+        return {**cached, "cached": tier, "timings": timer.as_dict()}
+
+    docs, rerank_info = await run_blocking(timer.bind(retrieve), question, pdf_id, weights=weights, timer=timer)
+    if not docs:
+        return {"answer": NO_INFO_ANSWER, "timings": timer.as_dict()}
+
+    matched_pdf_id, source_page_num, source_image_url = cite(docs)
+    prompt, context_stats = build_prompt(question, docs, timer)
+
+    queued = time.perf_counter()
+    async with llm_admission:
+        timer.add("queue", (time.perf_counter() - queued) * 1000)
+        lookups = asyncio.ensure_future(_citation_lookups(matched_pdf_id, source_page_num, source_image_url))
+        try:
+            with timer.stage("llm"):
+                response = await get_llm().ainvoke(prompt)
+        finally:
+            source_image_url, pdf_url = await lookups
+
+    record_generation_stats(response, timer)
+    raw_answer = getattr(response, "content", str(response))
+    answer_json = parse_answer(raw_answer, timer)
+
+    payload = build_payload(answer_json, matched_pdf_id, source_page_num, source_image_url, pdf_url=pdf_url)
+    store(payload)
+    return {**payload, "cached": None, "rerank": rerank_info, "context": context_stats,
+            "timings": timer.as_dict()}
+
+
+async def _citation_lookups(pdf_id, page_number, default_image_url):
+    """(image url, pdf url) for the cited page, fetched concurrently."""
+    if not pdf_id:
+        return default_image_url, ""
+    return await asyncio.gather(
+        run_blocking(page_image_url, pdf_id, page_number),
+        run_blocking(pdf_url_for, pdf_id),
+    )
+
+
+async def stream_answer(question, pdf_id, weights=None, timer=None):
+    """
+    Async generator of (event, data) pairs for the streaming endpoint:
+      "retrieval" - sources and citation, sent before generation starts
+      "token"     - raw model output as it arrives
+      "answer"    - the final parsed payload (same shape as answer_question)
+    """
+    timer = timer or StageTimer()
+    summary = await run_blocking(summary_answer, question, pdf_id, timer)
+    if summary is not None:
+        yield "retrieval", _retrieval_event(summary["pdf_url"], summary["page_number"], summary["source_image"], [])
+        yield "answer", {**summary, "cached": None, "timings": timer.as_dict()}
+        return
+
+    with timer.stage("cache"):
+        cached, tier, store = await run_blocking(timer.bind(lookup_cache), question, pdf_id)
+    if cached is not None:
+        yield "retrieval", _retrieval_event(cached.get("pdf_url"), cached.get("page_number"),
+                                            cached.get("source_image"), [])
+        yield "answer", {**cached, "cached": tier, "timings": timer.as_dict()}
+        return
+
+    docs, rerank_info = await run_blocking(timer.bind(retrieve), question, pdf_id, weights=weights, timer=timer)
+    if not docs:
+        yield "answer", {"answer": NO_INFO_ANSWER, "timings": timer.as_dict()}
+        return
+
+    matched_pdf_id, source_page_num, source_image_url = cite(docs)
+    with timer.stage("citation"):
+        source_image_url, pdf_url = await _citation_lookups(matched_pdf_id, source_page_num, source_image_url)
+    prompt, context_stats = build_prompt(question, docs, timer)
+    yield "retrieval", {**_retrieval_event(pdf_url, source_page_num, source_image_url, docs),
+                        "rerank": rerank_info, "context": context_stats, "timings": timer.as_dict()}
+
+    raw_answer = ""
+    last_chunk = None
+    queued = time.perf_counter()
+    async with llm_admission:
+        started = time.perf_counter()
+        timer.add("queue", (started - queued) * 1000)
+        async for chunk in get_llm().astream(prompt):
+            last_chunk = chunk
+            text = getattr(chunk, "content", str(chunk))
+            if text:
+                if not raw_answer:
+                    timer.add("first_token", (time.perf_counter() - started) * 1000)
+                raw_answer += text
+                yield "token", {"text": text}
+        timer.add("llm", (time.perf_counter() - started) * 1000)
+
+    # Ollama reports its durations and token counts on the final chunk
+    record_generation_stats(last_chunk, timer)
+    answer_json = parse_answer(raw_answer, timer)
+    payload = build_payload(answer_json, matched_pdf_id, source_page_num, source_image_url, pdf_url=pdf_url)
+    store(payload)
+    yield "answer", {**payload, "cached": None, "rerank": rerank_info, "context": context_stats,
+                     "timings": timer.as_dict()}
+
+
+def _retrieval_event(pdf_url, page_number, source_image, docs):
+    return {
+        "pdf_url": pdf_url,
+        "page_number": page_number,
+        "source_image": source_image,
+        "sources": [
+            {
+                "pdf_id": doc.metadata.get("pdf_id"),
+                "page": doc.metadata.get("page"),
+                "page_end": doc.metadata.get("page_end", doc.metadata.get("page")),
+                "snippet": doc.page_content[:200],
+            }
+            for doc in docs
+        ],
+    }
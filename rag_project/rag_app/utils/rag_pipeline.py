@@ -1,15 +1,15 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 
-from rag_app.utils.llm import get_llm
-from rag_app.utils.vector_store import load_vector_store
+from rag_app.utils.batch_qa import answer_batch
+from rag_app.utils.context_builder import pack_context
+from rag_app.utils.llm import get_llm, record_generation_stats
+from rag_app.utils.metrics import observe_stages
+from rag_app.utils.retrieval import search
+from rag_app.utils.timing import StageTimer
 
 
 def get_answer(question: str) -> str:
     llm = get_llm()
-    vectorstore = load_vector_store()
-
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
 
     prompt = ChatPromptTemplate.from_template("""
 You are a helpful assistant.
@@ -23,18 +23,32 @@ Question:
 {question}
 """)
 
-    def retrieve_context(question: str):
-        docs = retriever.get_relevant_documents(question)
-        return "\n".join(doc.page_content for doc in docs)
+    # Stages go to /metrics under pipeline="rag_pipeline"
+    timer = StageTimer()
+    with timer.activate():
+        with timer.stage("retrieve"):
+            docs = search(question, "all", k=3)
+        with timer.stage("context"):
+            docs, _ = pack_context(docs)
+            context = "\n".join(doc.page_content for doc in docs)
+
+        rag_chain = prompt | llm
+        with timer.stage("llm"):
+            response = rag_chain.invoke({"context": context, "question": question})
+
+    record_generation_stats(response, timer)
+    observe_stages("rag_pipeline", timer.stages)
+    return response.content
 
-    rag_chain = (
-        {
-            "context": retrieve_context,
-            "question": RunnablePassthrough()
-        }
-        | prompt
-        | llm
-    )
 
-    response = rag_chain.invoke(question)
-    return response.content
+def get_answers(questions, pdf_id="all", concurrency=None):
+    """
+    Batch counterpart of get_answer() for evaluations and bulk extraction:
+    one encoder batch and one vector search per pdf scope, LLM calls in
+    parallel. Yields a result dict per question (the /ask_question/ payload
+    plus "index" and "question") as each answer finishes; sort by "index"
+    to get input order. Entries may also be {"question", "pdf_id", "id"}.
+    """
+    timer = StageTimer()
+    yield from answer_batch(questions, pdf_id, concurrency=concurrency, timer=timer)
+    observe_stages("rag_pipeline_batch", timer.stages)
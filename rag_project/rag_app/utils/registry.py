@@ -0,0 +1,158 @@
+# registry.py
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.signals import setting_changed
+
+
+class ResourceRegistry:
+    """
+    Process-wide, thread-safe cache for expensive resources (embedding model,
+    vector store, ...). Each resource is built once per worker by its factory
+    and rebuilt only when its config key changes or reload() is called.
+
+    Config keys can be costly to compute (the vector store's reads the active
+    index), so a loaded resource's key is only re-checked every `config_ttl`
+    seconds; reload() and RAG_* setting overrides take effect immediately.
+    """
+
+    def __init__(self, config_ttl=5.0):
+        self.config_ttl = config_ttl
+        self._factories = {}
+        self._resources = {}  # name -> (config key, resource, monotonic time the key was checked)
+        self._locks = {}
+        self._stats = {}
+        self._registry_lock = threading.Lock()
+        self._lock = threading.Lock()  # guards _stats
+
+    def register(self, name, factory, config=None):
+        """
+        factory: zero-arg callable that builds the resource.
+        config: optional zero-arg callable returning a hashable key; when the
+                key changes the resource is rebuilt on the next get().
+        """
+        with self._registry_lock:
+            self._factories[name] = (factory, config or (lambda: None))
+            # A new factory (e.g. an override) replaces whatever the old one built
+            self._resources.pop(name, None)
+            self._locks.setdefault(name, threading.Lock())
+            self._stats.setdefault(name, {
+                "loads": 0,
+                "hits": 0,
+                "misses": 0,
+                "last_load_seconds": None,
+                "total_load_seconds": 0.0,
+                "loaded_at": None,
+                "config": None,
+            })
+
+    def get(self, name):
+        # Fast path: no config check (nor per-resource lock) within the TTL
+        entry = self._resources.get(name)
+        if entry is not None and time.monotonic() - entry[2] < self.config_ttl:
+            self._count(name, "hits")
+            return entry[1]
+
+        factory, config = self._factories[name]
+        key = config()
+        entry = self._resources.get(name)
+        if entry is not None and entry[0] == key:
+            self._resources[name] = (key, entry[1], time.monotonic())
+            self._count(name, "hits")
+            return entry[1]
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            entry = self._resources.get(name)
+            if entry is not None and entry[0] == key:
+                self._count(name, "hits")
+                return entry[1]
+
+            self._count(name, "misses")
+            start = time.perf_counter()
+            resource = factory()
+            elapsed = time.perf_counter() - start
+
+            self._resources[name] = (key, resource, time.monotonic())
+            with self._lock:
+                stats = self._stats[name]
+                stats["loads"] += 1
+                stats["last_load_seconds"] = round(elapsed, 4)
+                stats["total_load_seconds"] = round(stats["total_load_seconds"] + elapsed, 4)
+                stats["loaded_at"] = time.time()
+                stats["config"] = repr(key)
+            return resource
+
+    def _count(self, name, counter):
+        with self._lock:
+            self._stats[name][counter] += 1
+
+    def reload(self, name=None):
+        """Drops one (or every) cached resource so the next get() rebuilds it."""
+        names = [name] if name else list(self._factories)
+        for n in names:
+            with self._locks[n]:
+                self._resources.pop(n, None)
+
+    @contextmanager
+    def override(self, name, resource):
+        """Serves `resource` as `name` inside the block (benchmarks, offline runs)."""
+        previous = self._factories[name]
+        self.register(name, lambda: resource, config=lambda: ("override", id(resource)))
+        try:
+            yield resource
+        finally:
+            with self._registry_lock:
+                self._factories[name] = previous
+            self.reload(name)
+
+    def is_loaded(self, name):
+        return name in self._resources
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(stats, loaded=self.is_loaded(name))
+                for name, stats in self._stats.items()
+            }
+
+
+registry = ResourceRegistry()
+
+
+def warmup():
+    """
+    Loads the embedding model, vector store (and reranker) so the first
+    request is fast, and has Ollama load the LLM (RAG_LLM_WARMUP).
+    """
+    from django.conf import settings
+
+    # Imported here so the factories get registered before we ask for them
+    from . import llm, reranker, vector_store  # noqa: F401
+
+    names = ["embeddings", "vectorstore"]
+    if reranker.rerank_enabled():
+        names.append("reranker")
+    for name in names:
+        try:
+            registry.get(name)
+            print(f"🔥 Warmed up '{name}' in {registry.stats()[name]['last_load_seconds']}s")
+        except Exception as e:
+            print(f"⚠️ Could not warm up '{name}': {e}")
+
+    if getattr(settings, "RAG_LLM_WARMUP", True):
+        try:
+            print(f"🔥 Warmed up 'llm' in {llm.warm_llm()}s")
+        except Exception as e:
+            print(f"⚠️ Could not warm up 'llm': {e}")
+
+
+def _on_setting_changed(setting, **kwargs):
+    # Config keys are only re-read every config_ttl seconds, so drop everything
+    # when a RAG_* setting is overridden (e.g. in tests) for it to apply at once.
+    if setting.startswith("RAG_"):
+        registry.reload()
+
+
+setting_changed.connect(_on_setting_changed)
@@ -0,0 +1,223 @@
+# reindex.py
+"""
+Rebuilds the search index after chunking or embedding settings change.
+
+    plan()  -> which index to fill and which PDFs are stale
+    run()   -> fills it and switches over
+
+If the settings still match the active index, only PDFs missing from it are
+indexed, in place. Otherwise a BUILDING index (its own collection and
+lexical folder) is filled next to the active one while the app keeps
+serving from the old index, and is activated in a single transaction once
+every PDF is in it.
+
+PDFs are chunked from their stored page text and embedded in a process pool;
+the parent process does all writes, so no backend sees concurrent writers.
+Each finished PDF is recorded as an IndexedPDF row, which is what lets an
+interrupted run resume where it stopped.
+"""
+import time
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from ..models import IndexedPDF, UploadedPDF, VectorIndex
+from .embeddings import build_embeddings
+from .index_state import (active_index, config_version, index_name, ingested_pdfs, mark_indexed, switch_active,
+                          target_config)
+from .lexical_index import SegmentBuilder, open_lexical_index
+from .page_text import iter_page_text
+from .text_splitter import chunk_pages
+from .vector_store import chunk_id, open_vectorstore
+from .workers import process_pool
+
+# Rounds of "index what's missing" before switching, to catch PDFs uploaded meanwhile
+MAX_ROUNDS = 3
+
+_embedders = {}  # per worker process: model name -> embeddings
+
+
+@dataclass
+class Plan:
+    index: VectorIndex
+    stale: list
+    switch: bool
+
+
+def _ingested():
+    return ingested_pdfs().order_by("id")
+
+
+def stale_pdf_ids(index):
+    """Ingested PDFs that have no complete copy in `index`."""
+    if index.pk is None:
+        return list(_ingested().values_list("id", flat=True))
+    in_index = IndexedPDF.objects.filter(index=index, pdf=OuterRef("pk"))
+    return list(_ingested().exclude(Exists(in_index)).values_list("id", flat=True))
+
+
+def plan(dry_run=False):
+    """What run() would do. Unless dry_run, creates (or resets) the target index."""
+    config = target_config()
+    version = config_version(config)
+    active = active_index(refresh=True)
+    if active.version == version:
+        return Plan(active, stale_pdf_ids(active), switch=False)
+
+    index = VectorIndex.objects.filter(name=index_name(version)).first()
+    if dry_run:
+        if index is None or index.status == VectorIndex.RETIRED:
+            index = VectorIndex(name=index_name(version), version=version, config=config)
+        return Plan(index, stale_pdf_ids(index), switch=True)
+
+    if index is not None and index.status == VectorIndex.RETIRED:
+        # Going back to an old config: its data is out of date, start it over
+        drop_index_data(index)
+        index.entries.all().delete()
+        VectorIndex.objects.filter(pk=index.pk).update(status=VectorIndex.BUILDING)
+        index.refresh_from_db()
+    elif index is None:
+        index = VectorIndex.objects.create(name=index_name(version), version=version, config=config)
+    # Otherwise it is a BUILDING index from an interrupted run: resume it
+    return Plan(index, stale_pdf_ids(index), switch=True)
+
+
+def embed_pdf(pdf_id, config, version, batch_size):
+    """
+    Worker task: chunks a PDF's stored text with `config` and embeds it with
+    config's model. Returns the rows to write, or None if the PDF is gone.
+    """
+    pdf = UploadedPDF.objects.filter(id=pdf_id).first()
+    if pdf is None:
+        return None
+
+    model = config["embedding_model"]
+    if model not in _embedders:
+        _embedders[model] = build_embeddings(model)
+    embeddings = _embedders[model]
+
+    docs = list(chunk_pages(iter_page_text(pdf), config))
+    texts = [doc.page_content for doc in docs]
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i + batch_size]))
+
+    return {
+        "pdf_id": pdf_id,
+        "ids": [chunk_id(pdf_id, n) for n in range(len(docs))],
+        "embeddings": np.asarray(vectors, dtype=np.float32),
+        "texts": texts,
+        "metadatas": [dict(doc.metadata, pdf_id=pdf_id, index_version=version) for doc in docs],
+    }
+
+
+def write_pdf(index, vectorstore, lexical, result, batch_size):
+    """Parent side: stores one PDF's chunks in the index and records it as done."""
+    pdf_id = result["pdf_id"]
+    # Leftovers of a run that crashed halfway through this PDF
+    vectorstore.delete(where={"pdf_id": pdf_id})
+
+    builder = SegmentBuilder(pdf_id)
+    for i in range(0, len(result["ids"]), batch_size):
+        end = i + batch_size
+        vectorstore.add_embeddings(
+            ids=result["ids"][i:end],
+            embeddings=result["embeddings"][i:end].tolist(),
+            texts=result["texts"][i:end],
+            metadatas=result["metadatas"][i:end],
+        )
+    for doc_id, text, meta in zip(result["ids"], result["texts"], result["metadatas"]):
+        builder.add(doc_id, meta.get("page"), text)
+    vectorstore.persist()
+    lexical.write(builder)
+
+    pdf = UploadedPDF.objects.filter(id=pdf_id).first()
+    if pdf is None:
+        # Deleted while we were embedding it
+        vectorstore.delete(where={"pdf_id": pdf_id})
+        lexical.delete([pdf_id])
+        return 0
+    mark_indexed(index, pdf, len(result["ids"]))
+    return len(result["ids"])
+
+
+def fill(index, pdf_ids, workers=None, progress=None):
+    """Indexes the given PDFs into `index`. progress(done, total, pdf_id, chunks, seconds)."""
+    if not pdf_ids:
+        return 0
+    workers = workers or getattr(settings, "RAG_REINDEX_WORKERS", 2)
+    batch_size = getattr(settings, "RAG_EMBED_BATCH_SIZE", 64)
+    vectorstore = open_vectorstore(index)
+    lexical = open_lexical_index(index)
+
+    done = 0
+    started = {pdf_id: time.perf_counter() for pdf_id in pdf_ids}
+
+    def finish(result):
+        nonlocal done
+        done += 1
+        if result is None:
+            return
+        chunks = write_pdf(index, vectorstore, lexical, result, batch_size)
+        if progress:
+            pdf_id = result["pdf_id"]
+            progress(done, len(pdf_ids), pdf_id, chunks, time.perf_counter() - started[pdf_id])
+
+    if workers <= 1:
+        for pdf_id in pdf_ids:
+            started[pdf_id] = time.perf_counter()
+            finish(embed_pdf(pdf_id, index.config, index.version, batch_size))
+        return done
+
+    with process_pool(workers) as pool:
+        futures = [pool.submit(embed_pdf, pdf_id, index.config, index.version, batch_size) for pdf_id in pdf_ids]
+        for future in as_completed(futures):
+            finish(future.result())
+    return done
+
+
+def drop_index_data(index):
+    open_vectorstore(index).drop()
+    open_lexical_index(index).drop()
+
+
+def run(workers=None, progress=None, drop_old=False, log=print):
+    """
+    Brings the index in line with the current settings. Safe to interrupt and
+    re-run: finished PDFs are skipped. Returns the index that is active afterwards.
+    """
+    current = plan()
+    index = current.index
+    log(f"Target index {index.name} (version {index.version}), "
+        f"{'building next to ' + active_index().name if current.switch else 'in place'}")
+
+    stale = current.stale
+    for _ in range(MAX_ROUNDS):
+        if not stale:
+            break
+        log(f"Indexing {len(stale)} PDF(s)")
+        fill(index, stale, workers, progress)
+        stale = stale_pdf_ids(index)
+
+    if stale:
+        log(f"⚠️ {len(stale)} PDF(s) still missing after {MAX_ROUNDS} rounds; run reindex again")
+        return active_index(refresh=True)
+
+    if current.switch:
+        old = active_index(refresh=True)
+        switch_active(index)
+        log(f"Switched from {old.name} to {index.name}")
+
+        # Uploads that finished against the old index during the switch
+        late = stale_pdf_ids(index)
+        if late:
+            log(f"Indexing {len(late)} PDF(s) uploaded during the switch")
+            fill(index, late, workers, progress)
+
+        if drop_old:
+            drop_index_data(old)
+            log(f"Dropped the data of {old.name}")
+    return active_index(refresh=True)
@@ -0,0 +1,82 @@
+# reranker.py
+"""
+Optional cross-encoder reranking of retrieved chunks.
+
+Retrieval over-fetches RAG_RERANK_CANDIDATES chunks; a small CPU cross-encoder
+scores each (question, chunk) pair and the best k are kept, so the chunk the
+answer is cited from is the one the cross-encoder ranks first.
+
+Scoring runs in batches under a latency budget: if the batches done so far
+project past RAG_RERANK_BUDGET_MS, the remaining work is skipped and the
+retrieval order is used instead.
+"""
+import time
+
+from django.conf import settings
+
+from .registry import registry
+
+
+def rerank_enabled():
+    return getattr(settings, "RAG_RERANK_ENABLED", False)
+
+
+def candidate_count(k):
+    return max(getattr(settings, "RAG_RERANK_CANDIDATES", 24), k)
+
+
+def _reranker_config():
+    return (
+        getattr(settings, "RAG_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+        getattr(settings, "RAG_EMBEDDING_DEVICE", "cpu"),
+        getattr(settings, "RAG_RERANK_MAX_LENGTH", 512),
+    )
+
+
+def _build_reranker():
+    from sentence_transformers import CrossEncoder
+
+    model_name, device, max_length = _reranker_config()
+    return CrossEncoder(model_name, device=device, max_length=max_length)
+
+
+registry.register("reranker", _build_reranker, config=_reranker_config)
+
+
+def get_reranker():
+    return registry.get("reranker")
+
+
+def rerank(question, docs, k, budget_ms=None, batch_size=None):
+    """
+    Returns (docs, info): the top k docs by cross-encoder score and
+    {"applied": bool, "reason": str | None, "scored": int}. On any fallback
+    the first k docs are returned in their original (retrieval) order.
+    """
+    budget_ms = budget_ms if budget_ms is not None else getattr(settings, "RAG_RERANK_BUDGET_MS", 400)
+    batch_size = batch_size or getattr(settings, "RAG_RERANK_BATCH_SIZE", 16)
+    if len(docs) <= 1:
+        return docs[:k], {"applied": False, "reason": "too_few", "scored": 0}
+
+    try:
+        model = get_reranker()
+    except Exception as e:
+        print(f"⚠️ Reranker unavailable, using retrieval order: {e}")
+        return docs[:k], {"applied": False, "reason": "unavailable", "scored": 0}
+
+    pairs = [(question, doc.page_content) for doc in docs]
+    scores = []
+    start = time.perf_counter()
+    for i in range(0, len(pairs), batch_size):
+        scores.extend(float(s) for s in model.predict(pairs[i:i + batch_size], batch_size=batch_size))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # Stop as soon as finishing would (on current pace) blow the budget
+        if budget_ms and elapsed_ms / len(scores) * len(pairs) > budget_ms and len(scores) < len(pairs):
+            return docs[:k], {"applied": False, "reason": "budget", "scored": len(scores)}
+
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    ranked = []
+    for i in order[:k]:
+        docs[i].metadata["rerank_score"] = round(scores[i], 4)
+        ranked.append(docs[i])
+    return ranked, {"applied": True, "reason": None, "scored": len(scores)}
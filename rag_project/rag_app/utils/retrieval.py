@@ -0,0 +1,133 @@
+# retrieval.py
+"""
+Dense, lexical (BM25) and hybrid retrieval.
+
+Hybrid search runs both retrievers and fuses their rankings with Reciprocal
+Rank Fusion: score(d) = sum_i weight_i / (RRF_K + rank_i(d)). RRF only looks
+at ranks, so the incomparable cosine and BM25 scales never need calibrating.
+"""
+from django.conf import settings
+from langchain_core.documents import Document
+
+from .embeddings import embed_queries
+from .lexical_index import get_lexical_index
+from .timing import span
+from .vector_store import get_vectorstore
+
+RRF_K = 60
+
+
+def _pdf_filter(pdf_id):
+    return None if pdf_id in (None, "all") else int(pdf_id)
+
+
+def dense_search(question, pdf_id, k, vectorstore=None):
+    vectorstore = vectorstore or get_vectorstore()
+    search_kwargs = {"k": k}
+    if _pdf_filter(pdf_id) is not None:
+        search_kwargs["filter"] = {"pdf_id": _pdf_filter(pdf_id)}
+    with span("embed_query"):
+        vector = vectorstore.embedding.embed_query(question)
+    with span("vector_search"):
+        return vectorstore.similarity_search_by_vector(vector, **search_kwargs)
+
+
+def dense_search_batch(questions, pdf_id, k, vectors=None, vectorstore=None):
+    """
+    dense_search() for several questions with the same scope: the questions
+    are embedded in one encoder batch (unless `vectors` are given) and
+    searched in one backend call. Returns a list of results per question.
+    """
+    vectorstore = vectorstore or get_vectorstore()
+    search_filter = None if _pdf_filter(pdf_id) is None else {"pdf_id": _pdf_filter(pdf_id)}
+    if vectors is None:
+        with span("embed_query"):
+            vectors = embed_queries(questions, vectorstore.embedding)
+    with span("vector_search"):
+        return vectorstore.similarity_search_by_vectors(vectors, k=k, filter=search_filter)
+
+
+def lexical_search(question, pdf_id, k, vectorstore=None, lexical_index=None):
+    """BM25 hits, with the chunk text fetched from the vector store by id."""
+    lexical_index = lexical_index or get_lexical_index()
+    scope = None if _pdf_filter(pdf_id) is None else {_pdf_filter(pdf_id)}
+    with span("lexical_search"):
+        hits = lexical_index.search(question, pdf_ids=scope, k=k)
+    if not hits:
+        return []
+
+    vectorstore = vectorstore or get_vectorstore()
+    with span("chunk_fetch"):
+        data = vectorstore.get(ids=[hit[0] for hit in hits], include=["documents", "metadatas"])
+    by_id = {
+        doc_id: Document(id=doc_id, page_content=text, metadata=meta or {})
+        for doc_id, text, meta in zip(data["ids"], data["documents"], data["metadatas"])
+    }
+    # Skip ids the vector store no longer has (e.g. a delete racing the search)
+    return [by_id[hit[0]] for hit in hits if hit[0] in by_id]
+
+
+def rrf_fuse(rankings, weights, k):
+    """rankings: lists of Documents, best first. Returns the top k fused Documents."""
+    scores = {}
+    docs = {}
+    for ranking, weight in zip(rankings, weights):
+        if not weight:
+            continue
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or (doc.metadata.get("pdf_id"), doc.metadata.get("page"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + weight / (RRF_K + rank)
+            docs.setdefault(key, doc)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+def default_weights():
+    return (
+        getattr(settings, "RAG_HYBRID_DENSE_WEIGHT", 1.0),
+        getattr(settings, "RAG_HYBRID_LEXICAL_WEIGHT", 1.0),
+    )
+
+
+def hybrid_search(question, pdf_id, k, weights=None, fetch_k=None, vectorstore=None, lexical_index=None):
+    """
+    weights: (dense, lexical) RRF weights for this query; defaults to the
+    RAG_HYBRID_*_WEIGHT settings. fetch_k: candidates taken from each side.
+    """
+    dense_weight, lexical_weight = weights or default_weights()
+    fetch_k = fetch_k or max(k * 4, 20)
+
+    dense = dense_search(question, pdf_id, fetch_k, vectorstore) if dense_weight else []
+    lexical = lexical_search(question, pdf_id, fetch_k, vectorstore, lexical_index) if lexical_weight else []
+    return rrf_fuse([dense, lexical], [dense_weight, lexical_weight], k)
+
+
+def search(question, pdf_id, k, weights=None):
+    """Entry point used by the Q&A code; RAG_RETRIEVAL_MODE picks "dense" or "hybrid"."""
+    if getattr(settings, "RAG_RETRIEVAL_MODE", "hybrid") == "hybrid":
+        return hybrid_search(question, pdf_id, k, weights=weights)
+    return dense_search(question, pdf_id, k)
+
+
+def search_batch(questions, pdf_id, k, weights=None, vectors=None):
+    """
+    search() for several questions with the same scope. Dense retrieval is
+    batched (see dense_search_batch); BM25 is per question, it is cheap.
+    vectors: the questions' query embeddings, if already computed.
+    """
+    if getattr(settings, "RAG_RETRIEVAL_MODE", "hybrid") != "hybrid":
+        return dense_search_batch(questions, pdf_id, k, vectors)
+
+    dense_weight, lexical_weight = weights or default_weights()
+    fetch_k = max(k * 4, 20)
+    vectorstore = get_vectorstore()
+    if dense_weight:
+        dense = dense_search_batch(questions, pdf_id, fetch_k, vectors, vectorstore)
+    else:
+        dense = [[] for _ in questions]
+    results = []
+    for question, dense_hits in zip(questions, dense):
+        lexical = lexical_search(question, pdf_id, fetch_k, vectorstore) if lexical_weight else []
+        results.append(rrf_fuse([dense_hits, lexical], [dense_weight, lexical_weight], k))
+    return results
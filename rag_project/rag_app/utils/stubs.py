@@ -0,0 +1,270 @@
+# stubs.py
+"""
+Offline stand-ins for the embedding model and Ollama, for benchmarks
+(`manage.py ragbench`) and debugging without a model download or a running
+Ollama server. All are deterministic: the same input always gives the same
+output, so runs can be compared.
+
+StubLLM replaces the client object; StubOllamaServer is a local HTTP server
+the real client can talk to, for measuring what happens on the wire
+(connections, model loads, prompt caching, time to first token).
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Bag-of-words vectors via feature hashing. Texts sharing words get similar
+    vectors, so retrieval over them behaves sensibly (unlike random vectors).
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class StubLLM:
+    """
+    Answers like the Q&A prompt asks (a JSON object), quoting the start of the
+    context it was given. prompt_ms_per_1k_chars / token_ms simulate prompt
+    evaluation and generation time; response_metadata mimics Ollama's.
+    """
+
+    def __init__(self, prompt_ms_per_1k_chars=0.0, token_ms=0.0):
+        self.prompt_ms_per_1k_chars = prompt_ms_per_1k_chars
+        self.token_ms = token_ms
+
+    def _plan(self, prompt):
+        """(answer pieces, prompt seconds, per-piece seconds, Ollama-style metadata) for a prompt."""
+        prompt = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        context = prompt.split("Context:", 1)[-1].strip()
+        answer = json.dumps({
+            "title": "Stub answer",
+            "subtitle": "Generated offline",
+            "content": (context.splitlines()[0] if context else "")[:200],
+            "points": [],
+        })
+        pieces = re.findall(r"\S+\s*", answer)
+        prompt_seconds = len(prompt) / 1000 * self.prompt_ms_per_1k_chars / 1000
+        piece_seconds = self.token_ms / 1000
+        metadata = {
+            "prompt_eval_count": len(prompt) // 4,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": len(pieces),
+            "eval_duration": int(len(pieces) * piece_seconds * 1e9),
+        }
+        return pieces, prompt_seconds, piece_seconds, metadata
+
+    def invoke(self, prompt, **kwargs):
+        pieces, prompt_seconds, piece_seconds, metadata = self._plan(prompt)
+        time.sleep(prompt_seconds + len(pieces) * piece_seconds)
+        return AIMessage(content="".join(pieces), response_metadata=metadata)
+
+    async def ainvoke(self, prompt, **kwargs):
+        pieces, prompt_seconds, piece_seconds, metadata = self._plan(prompt)
+        await asyncio.sleep(prompt_seconds + len(pieces) * piece_seconds)
+        return AIMessage(content="".join(pieces), response_metadata=metadata)
+
+    def stream(self, prompt, **kwargs):
+        pieces, prompt_seconds, piece_seconds, metadata = self._plan(prompt)
+        time.sleep(prompt_seconds)
+        for piece in pieces:
+            time.sleep(piece_seconds)
+            yield AIMessageChunk(content=piece)
+        yield AIMessageChunk(content="", response_metadata=metadata)
+
+    async def astream(self, prompt, **kwargs):
+        pieces, prompt_seconds, piece_seconds, metadata = self._plan(prompt)
+        await asyncio.sleep(prompt_seconds)
+        for piece in pieces:
+            await asyncio.sleep(piece_seconds)
+            yield AIMessageChunk(content=piece)
+        yield AIMessageChunk(content="", response_metadata=metadata)
+
+
+def _seconds(keep_alive):
+    """Ollama's keep_alive ("5m", "1h", 300, -1, ...) in seconds; None means forever."""
+    if keep_alive is None:
+        return 300.0  # Ollama's default
+    if isinstance(keep_alive, str):
+        match = re.fullmatch(r"(-?[\d.]+)\s*(ms|s|m|h)?", keep_alive.strip())
+        if not match:
+            return 300.0
+        value = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+    else:
+        value = float(keep_alive)
+    return None if value < 0 else value
+
+
+class StubOllamaServer:
+    """
+    Speaks enough of Ollama's /api/chat for ChatOllama, answering with
+    StubLLM's JSON. It simulates what makes a real server slow:
+
+    * load_ms when the model isn't loaded (first call, or after the
+      request's keep_alive ran out; keep_alive=0 unloads it after the call);
+    * prompt_ms_per_1k_chars for the part of the prompt that doesn't
+      repeat the start of the previous one (Ollama keeps the last prompt's
+      KV cache and only evaluates what follows the shared prefix);
+    * token_ms per generated piece.
+
+    Counts the TCP connections it accepts. Use as a context manager:
+        with StubOllamaServer() as server:
+            ChatOllama(model="stub", base_url=server.url)
+    """
+
+    def __init__(self, load_ms=0.0, prompt_ms_per_1k_chars=0.0, token_ms=0.0):
+        self.load_ms = load_ms
+        self.prompt_ms_per_1k_chars = prompt_ms_per_1k_chars
+        self.token_ms = token_ms
+        self.connections = 0
+        self.loads = 0
+        self._cached_prompt = ""
+        self._loaded_until = 0.0  # monotonic deadline, inf for forever
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        server = self
+
+        class Handler(_OllamaHandler):
+            stub = server
+
+        class HTTPServer(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def process_request(self, request, client_address):
+                with server._lock:
+                    server.connections += 1
+                super().process_request(request, client_address)
+
+        self._httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._httpd.serve_forever, name="stub-ollama", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        """Unloads the model, empties the prompt cache and zeroes the counters."""
+        with self._lock:
+            self.connections = self.loads = 0
+            self._cached_prompt = ""
+            self._loaded_until = 0.0
+
+    def _prepare(self, prompt, keep_alive):
+        """Seconds to wait before the first token (load + uncached prompt) and the metadata for them."""
+        with self._lock:
+            now = time.monotonic()
+            load = 0.0
+            if now >= self._loaded_until:
+                load = self.load_ms / 1000
+                self.loads += 1
+                self._cached_prompt = ""
+            shared = len(os.path.commonprefix([self._cached_prompt, prompt]))
+            prompt_seconds = (len(prompt) - shared) / 1000 * self.prompt_ms_per_1k_chars / 1000
+            self._cached_prompt = prompt
+            ttl = _seconds(keep_alive)
+            self._loaded_until = float("inf") if ttl is None else now + load + prompt_seconds + ttl
+        return load, prompt_seconds, {
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": (len(prompt) - shared) // 4,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+        }
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can reuse connections
+    disable_nagle_algorithm = True  # stream chunks go out as they are written
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, body):
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path != "/api/chat":
+            self._send_json(404, {"error": f"{self.path} is not implemented by the stub"})
+            return
+
+        prompt = "".join(message.get("content") or "" for message in request.get("messages", []))
+        model = request.get("model")
+        load, prompt_seconds, metadata = self.stub._prepare(prompt, request.get("keep_alive"))
+        pieces, _, _, _ = StubLLM()._plan(prompt)
+        num_predict = (request.get("options") or {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            pieces = pieces[:num_predict]
+        piece_seconds = self.stub.token_ms / 1000
+        time.sleep(load + prompt_seconds)
+
+        def message(content):
+            return {"model": model, "message": {"role": "assistant", "content": content}}
+
+        done = {
+            **message(""), "done": True, "done_reason": "stop", **metadata,
+            "eval_count": len(pieces), "eval_duration": int(len(pieces) * piece_seconds * 1e9),
+        }
+        if not request.get("stream", True):
+            time.sleep(len(pieces) * piece_seconds)
+            self._send_json(200, {**done, **message("".join(pieces))})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for piece in pieces:
+                time.sleep(piece_seconds)
+                self._send_chunk({**message(piece), "done": False})
+            self._send_chunk(done)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (e.g. after the first token)
+            self.close_connection = True
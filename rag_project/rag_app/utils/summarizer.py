@@ -0,0 +1,274 @@
+# summarizer.py
+"""
+Map-reduce document summaries, stored on UploadedPDF.summary at ingest.
+
+map:    consecutive pages are grouped into sections of at most
+        RAG_SUMMARY_SECTION_CHARS characters and every section is summarized,
+        RAG_SUMMARY_CONCURRENCY LLM calls at a time;
+reduce: the section summaries are combined RAG_SUMMARY_FAN_IN at a time,
+        level by level (also in parallel), until one summary is left.
+
+Every intermediate summary is cached in SQLite (RAG_SUMMARY_CACHE_PATH)
+under the model and a hash of its prompt, so a retried job or a re-upload
+only calls the model for sections whose text changed.
+
+Questions like "what is this document about?" are then answered from the
+stored summary (qa.summary_answer) instead of retrieval + generation.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from ..models import UploadedPDF
+from .llm import get_llm, record_generation_stats
+from .page_text import iter_page_text
+from .registry import registry
+from .timing import current_timer, span
+
+# Fixed instructions first, like the Q&A prompt, so Ollama reuses their KV cache
+SUMMARY_PROMPT_PREFIX = """You summarize documents faithfully, using ONLY the text you are given.
+Output valid JSON: {"summary": "..."}
+
+"""
+
+SECTION_PROMPT = """Summarize this excerpt (pages {pages}) in 3-5 sentences. Keep names, numbers and conclusions.
+
+Excerpt:
+{text}
+"""
+
+COMBINE_PROMPT = """Combine these consecutive section summaries into one summary of 4-6 sentences, in document order.
+
+Section summaries:
+{text}
+"""
+
+DOCUMENT_PROMPT = """Write an overview of the whole document in one paragraph of 4-8 sentences: what it is, what it covers and its main conclusions.
+
+{label}:
+{text}
+"""
+
+_DOCUMENT = r"(?:this|the|these|that)\s+(?:document|pdf|file|paper|report|book|article)s?"
+_OVERVIEW = re.compile(
+    # "Summarize this document", "give me an overview of the report", "main points of this paper"
+    rf"\b(?:summar(?:y|ise|ize)|overview|tl;?dr|gist|synopsis|main\s+(?:points|ideas|topics|takeaways))"
+    rf"(?:\s+(?:of|for))?\s+{_DOCUMENT}\b"
+    # "What is this document about?", "what does the pdf cover?"
+    rf"|\bwhat(?:'s|\s+is|\s+are)\s+{_DOCUMENT}\s+(?:about|for)\b"
+    rf"|\bwhat\s+(?:does|do)\s+{_DOCUMENT}\s+(?:say|cover|discuss)\s*[?.!]*$"
+    # The whole question is just "Summarize it", "TL;DR?", "Overview please"
+    r"|^\s*(?:summar(?:y|ise|ize)(?:\s+(?:it|this))?|overview|tl;?dr)(?:\s+please)?\s*[?.!]*\s*$",
+    re.IGNORECASE,
+)
+# A question about one part of the document wants retrieval, whatever its wording
+_PART = re.compile(r"\b(?:sections?|clauses?|pages?|chapters?|paragraphs?|appendix|appendices|tables?|figures?)\b",
+                   re.IGNORECASE)
+
+
+def is_overview_question(question, max_words=12):
+    """Whether a question asks what the document as a whole is about, rather than for a specific fact."""
+    question = question or ""
+    # "Summarize what the report says about penalties" wants retrieval, not the overview
+    return (len(question.split()) <= max_words and not _PART.search(question)
+            and bool(_OVERVIEW.search(question)))
+
+
+class SummaryCache:
+    """SQLite-backed (model, prompt hash) -> summary text. One connection per thread."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " model TEXT NOT NULL, hash TEXT NOT NULL, summary TEXT NOT NULL,"
+                " PRIMARY KEY (model, hash))"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, model, key):
+        row = self._connect().execute(
+            "SELECT summary FROM summaries WHERE model = ? AND hash = ?", (model, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model, key, summary):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO summaries (model, hash, summary) VALUES (?, ?, ?)",
+                         (model, key, summary))
+
+
+def _cache_config():
+    return getattr(settings, "RAG_SUMMARY_CACHE_PATH", None)
+
+
+def _build_cache():
+    path = _cache_config()
+    return SummaryCache(path) if path else None
+
+
+registry.register("summary_cache", _build_cache, config=_cache_config)
+
+
+def _summary_settings():
+    return (
+        getattr(settings, "RAG_SUMMARY_SECTION_CHARS", 6000),
+        getattr(settings, "RAG_SUMMARY_FAN_IN", 6),
+        getattr(settings, "RAG_SUMMARY_CONCURRENCY", 2),
+    )
+
+
+def sections(pages, max_chars):
+    """
+    Groups {"page", "text"} dicts into (first page, last page, text) sections
+    of at most max_chars characters; a longer page is split on its own.
+    """
+    current, first, last, size = [], None, None, 0
+    for page in pages:
+        text = page["text"].strip()
+        if not text:
+            continue
+        pieces = [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+        for piece in pieces:
+            if current and size + len(piece) > max_chars:
+                yield first, last, "\n\n".join(current)
+                current, size = [], 0
+            if not current:
+                first = page["page"]
+            current.append(piece)
+            last = page["page"]
+            size += len(piece)
+    if current:
+        yield first, last, "\n\n".join(current)
+
+
+def _parse_summary(raw):
+    """The "summary" field of the model's JSON, or its raw output when it isn't JSON."""
+    match = re.search(r"\{.*\}", raw, re.DOTALL)
+    if match:
+        try:
+            summary = json.loads(match.group(0)).get("summary")
+            if isinstance(summary, str) and summary.strip():
+                return summary.strip()
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    return raw.strip()
+
+
+class Summarizer:
+    """Runs the map and reduce LLM calls for one document, through the summary cache."""
+
+    def __init__(self, llm=None, cache=None, section_chars=None, fan_in=None, concurrency=None):
+        default_chars, default_fan_in, default_concurrency = _summary_settings()
+        self.llm = llm or get_llm()
+        self.cache = cache if cache is not None else registry.get("summary_cache")
+        self.section_chars = section_chars or default_chars
+        self.fan_in = max(2, fan_in or default_fan_in)
+        self.concurrency = concurrency or default_concurrency
+        self.model = getattr(settings, "RAG_LLM_MODEL", "llama3.2")
+        self.timer = current_timer()
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+
+    def _summarize(self, prompt):
+        prompt = SUMMARY_PROMPT_PREFIX + prompt
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if self.cache is not None:
+            cached = self.cache.get(self.model, key)
+            if cached is not None:
+                with self._lock:
+                    self.cache_hits += 1
+                return cached
+
+        response = self.llm.invoke(prompt)
+        record_generation_stats(response, self.timer)
+        summary = _parse_summary(getattr(response, "content", str(response)))
+        with self._lock:
+            self.llm_calls += 1
+        if self.cache is not None and summary:
+            self.cache.put(self.model, key, summary)
+        return summary
+
+    def _map(self, executor, prompts, progress, done, total):
+        """Summaries of all prompts, in order; progress(done, total) as each finishes."""
+        futures = [executor.submit(self._summarize, prompt) for prompt in prompts]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            done += 1
+            if progress:
+                progress(done, total)
+        return results, done
+
+    def summarize_pages(self, pages, progress=None):
+        """One summary of the given pages (an iterable of {"page", "text"}); "" when they have no text."""
+        parts = list(sections(pages, self.section_chars))
+        if not parts:
+            return ""
+        if len(parts) == 1:
+            first, last, text = parts[0]
+            label = f"Document (pages {first}-{last})" if first != last else f"Document (page {first})"
+            return self._summarize(DOCUMENT_PROMPT.format(label=label, text=text))
+
+        # Calls still to make: the map, then every reduce level
+        total, width = len(parts), len(parts)
+        while width > 1:
+            width = -(-width // self.fan_in)
+            total += width
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="rag-summary") as executor:
+            summaries, done = self._map(
+                executor,
+                [SECTION_PROMPT.format(pages=f"{first}-{last}" if first != last else first, text=text)
+                 for first, last, text in parts],
+                progress, 0, total,
+            )
+            while len(summaries) > 1:
+                groups = [summaries[i:i + self.fan_in] for i in range(0, len(summaries), self.fan_in)]
+                final = len(groups) == 1
+                prompts = [
+                    (DOCUMENT_PROMPT.format(label="Section summaries", text=_numbered(group)) if final
+                     else COMBINE_PROMPT.format(text=_numbered(group)))
+                    for group in groups
+                ]
+                summaries, done = self._map(executor, prompts, progress, done, total)
+        return summaries[0]
+
+
+def _numbered(summaries):
+    return "\n\n".join(f"{i}. {summary}" for i, summary in enumerate(summaries, start=1))
+
+
+def summaries_enabled():
+    return getattr(settings, "RAG_SUMMARY_ENABLED", True)
+
+
+def summarize_pdf(pdf_obj, progress=None):
+    """
+    Summarizes a PDF from its stored page text and saves it on
+    UploadedPDF.summary. progress(done, total) counts LLM calls (cached
+    sections included). Returns the summary.
+    """
+    summarizer = Summarizer()
+    with span("summarize"):
+        summary = summarizer.summarize_pages(iter_page_text(pdf_obj), progress)
+    UploadedPDF.objects.filter(id=pdf_obj.id).update(summary=summary or None)
+    pdf_obj.summary = summary or None
+    print(f"📝 PDF {pdf_obj.id}: summarized with {summarizer.llm_calls} LLM call(s), "
+          f"{summarizer.cache_hits} cached section(s)")
+    return summary
@@ -1,27 +1,256 @@
+# text_splitter.py
+"""
+Chunking.
+
+Two splitters, picked by the index config ("splitter"), so an index keeps
+chunking new uploads the way it was built:
+
+* "document" (iter_document_chunks) - chunks the page stream as one
+  document: sizes are counted in embedding-model tokens, chunks prefer to
+  end at paragraph breaks and start at headings, and may run across a page
+  break. Each chunk records page_start/page_end and character offsets into
+  the first and last page's stored text.
+* "recursive_character" (iter_chunks) - the original per-page character
+  splitter.
+"""
+import math
+import os
+import re
+from functools import lru_cache
+
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from langchain_core.documents import Document
 
-def split_text(pages_data: list[dict], chunk_size=500, chunk_overlap=50) -> list[Document]:
+from .timing import span
+
+# [CLS] and [SEP], which the model adds to every chunk it embeds
+SPECIAL_TOKENS = 2
+
+_PARAGRAPH = re.compile(r"\S(?:.*?\S)??(?=\s*\n\s*\n|\s*\Z)", re.DOTALL)
+_SENTENCE = re.compile(r"\S.*?(?:[.!?](?=\s)|\Z)", re.DOTALL)
+_WORD = re.compile(r"\S+")
+_NUMBERED_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+\S")
+
+
+def iter_chunks(pages_data, chunk_size=500, chunk_overlap=50):
+    """Generator version of split_text: accepts any iterable of pages and yields Documents."""
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
-    
-    documents = []
+
     for page_info in pages_data:
         text = page_info["text"]
         page_num = page_info["page"]
-        
+
         # Split the text of this specific page
-        chunks = splitter.split_text(text)
-        
+        with span("split"):
+            chunks = splitter.split_text(text)
+
         # Create Documents for each chunk, attaching page number
         for chunk in chunks:
-            documents.append(Document(
+            yield Document(
                 page_content=chunk,
                 metadata={"page": page_num}
-            ))
-            
-    return documents
+            )
+
+
+def split_text(pages_data: list[dict], chunk_size=500, chunk_overlap=50) -> list[Document]:
+    return list(iter_chunks(pages_data, chunk_size, chunk_overlap))
+
+
+# --- Token counting -------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model_name):
+    """The embedding model's fast tokenizer, or None (token counts are then estimated)."""
+    try:
+        from tokenizers import Tokenizer
+        if os.path.isdir(model_name):
+            tokenizer = Tokenizer.from_file(os.path.join(model_name, "tokenizer.json"))
+        else:
+            from huggingface_hub import hf_hub_download
+            try:
+                # Already there if the embedding model has been loaded on this machine
+                path = hf_hub_download(model_name, "tokenizer.json", local_files_only=True)
+            except Exception:
+                path = hf_hub_download(model_name, "tokenizer.json")
+            tokenizer = Tokenizer.from_file(path)
+    except Exception as e:
+        print(f"⚠️ No tokenizer for {model_name} ({e}); estimating token counts")
+        return None
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+class TokenCounter:
+    """Counts tokens with a model's tokenizer, or estimates them when it isn't available."""
+
+    def __init__(self, model_name=None):
+        self.tokenizer = load_tokenizer(model_name) if model_name else None
+
+    def count(self, texts):
+        if not texts:
+            return []
+        if self.tokenizer is not None:
+            return [len(e.ids) for e in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+        # WordPiece splits rarer words into several pieces; stay on the high side
+        return [max(math.ceil(len(_WORD.findall(text)) * 4 / 3), math.ceil(len(text) / 4)) for text in texts]
+
+
+# --- Document chunker -----------------------------------------------------
+
+class Piece:
+    """A sentence (or part of one) of a page, with its place in the page text."""
+    __slots__ = ("page", "start", "end", "tokens", "paragraph_start", "heading")
+
+    def __init__(self, page, start, end, tokens, paragraph_start, heading):
+        self.page = page
+        self.start = start
+        self.end = end
+        self.tokens = tokens
+        self.paragraph_start = paragraph_start
+        self.heading = heading
+
+
+def is_heading(text):
+    """Short, unpunctuated lines that are numbered, upper case or title case."""
+    text = text.strip()
+    if not text or len(text) > 80 or "\n" in text or text[-1] in ".,;!?":
+        return False
+    return bool(_NUMBERED_HEADING.match(text)) or text.isupper() or text.istitle()
+
+
+def _spans(pattern, text, offset=0):
+    return [(offset + m.start(), offset + m.end()) for m in pattern.finditer(text)]
+
+
+def _pieces(page_number, text, counter, budget):
+    """Pieces of a page in order. Sentences longer than the budget are cut between words."""
+    units = []  # (start, end, paragraph_start, heading)
+    for n, (p_start, p_end) in enumerate(_spans(_PARAGRAPH, text)):
+        heading = is_heading(text[p_start:p_end])
+        # A page opening mid-sentence carries on the previous page's paragraph
+        continued = n == 0 and text[p_start].islower()
+        for i, (s_start, s_end) in enumerate(_spans(_SENTENCE, text[p_start:p_end], p_start)):
+            units.append((s_start, s_end, i == 0 and not continued, heading))
+
+    counts = counter.count([text[start:end] for start, end, _, _ in units])
+    for (start, end, paragraph_start, heading), tokens in zip(units, counts):
+        if tokens <= budget:
+            yield Piece(page_number, start, end, tokens, paragraph_start, heading)
+            continue
+        words = _spans(_WORD, text[start:end], start)
+        part_start, used = words[0][0], 0
+        for (w_start, w_end), w_tokens in zip(words, counter.count([text[s:e] for s, e in words])):
+            if used and used + w_tokens > budget:
+                yield Piece(page_number, part_start, previous_end, used, paragraph_start, False)
+                part_start, used, paragraph_start = w_start, 0, False
+            used += w_tokens
+            previous_end = w_end
+        yield Piece(page_number, part_start, previous_end, used, paragraph_start, False)
+
+
+def _break_point(window, budget):
+    """
+    Where to end the chunk: at the last paragraph (or section) start that
+    leaves it at least half full, else after everything; never after a heading.
+    """
+    used = 0
+    cut = len(window)
+    for i, piece in enumerate(window):
+        if i and piece.paragraph_start and used >= budget / 2:
+            cut = i
+        used += piece.tokens
+    while cut > 1 and window[cut - 1].heading:
+        cut -= 1
+    return cut
+
+
+def _overlap(pieces, overlap_tokens):
+    """Trailing pieces (whole sentences) of a chunk that fit in the overlap."""
+    tail, used = [], 0
+    for piece in reversed(pieces):
+        if piece.heading or used + piece.tokens > overlap_tokens:
+            break
+        tail.insert(0, piece)
+        used += piece.tokens
+    return tail
+
+
+def _chunk(pieces, texts):
+    first, last = pieces[0], pieces[-1]
+    content = ""
+    for page in range(first.page, last.page + 1):
+        on_page = [piece for piece in pieces if piece.page == page]
+        if on_page:
+            if content:
+                # A paragraph running over the page break is rejoined with a space
+                content += "\n\n" if on_page[0].paragraph_start else " "
+            content += texts[page][on_page[0].start:on_page[-1].end]
+    return Document(
+        page_content=content,
+        metadata={
+            "page": first.page,
+            "page_start": first.page,
+            "page_end": last.page,
+            "start": first.start,  # offset in page_start's text
+            "end": last.end,  # offset in page_end's text
+            "tokens": sum(piece.tokens for piece in pieces),
+        },
+    )
+
+
+def iter_document_chunks(pages_data, chunk_tokens=256, overlap_tokens=32, counter=None):
+    """
+    Chunks an iterable of {"text", "page"} as one document stream and yields
+    Documents of at most chunk_tokens model tokens (special tokens included).
+    Only the pages the current chunk touches are held in memory.
+    """
+    counter = counter or TokenCounter()
+    budget = chunk_tokens - SPECIAL_TOKENS
+    texts = {}
+    window, used = [], 0
+
+    for page_info in pages_data:
+        page_number = page_info["page"]
+        texts[page_number] = page_info["text"]
+        with span("split"):
+            pieces = list(_pieces(page_number, page_info["text"], counter, budget))
+
+        for piece in pieces:
+            if window and piece.heading and not window[-1].heading and used >= budget / 4:
+                # A new section starts a new chunk, without overlap from the last one
+                yield _chunk(window, texts)
+                window, used = [], 0
+            while window and used + piece.tokens > budget:
+                cut = _break_point(window, budget)
+                yield _chunk(window[:cut], texts)
+                carry = window[cut:]
+                overlap = _overlap(window[:cut], overlap_tokens)
+                if sum(p.tokens for p in overlap + carry) + piece.tokens > budget:
+                    overlap = []
+                window = overlap + carry
+                used = sum(p.tokens for p in window)
+            window.append(piece)
+            used += piece.tokens
+
+        # Forget pages no chunk can reach any more
+        oldest = window[0].page if window else page_number
+        for page in [page for page in texts if page < oldest]:
+            del texts[page]
+
+    if window:
+        yield _chunk(window, texts)
+
+
+# --- Index config -----------------------------------------------------------
 
+def chunk_pages(pages_data, config):
+    """Chunks pages with the splitter (and sizes) an index config names."""
+    if config.get("splitter") == "document":
+        return iter_document_chunks(pages_data, config["chunk_tokens"], config["chunk_overlap_tokens"],
+                                    TokenCounter(config["embedding_model"]))
+    return iter_chunks(pages_data, config["chunk_size"], config["chunk_overlap"])
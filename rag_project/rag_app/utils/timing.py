@@ -0,0 +1,91 @@
+# timing.py
+"""
+Per-request stage timing.
+
+A StageTimer collects wall-clock milliseconds per stage. While a timer is
+active (StageTimer.activate(), or a function wrapped with timer.bind() for a
+thread pool), code deep in the pipeline can report into it with span() or
+sample() without the timer being passed down; with no active timer both are
+no-ops, so the same helpers work from management commands and workers.
+
+The TimingMiddleware gives every request a timer and exports its stages as
+Prometheus histograms (see metrics.py) and a Server-Timing header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_current = contextvars.ContextVar("rag_stage_timer", default=None)
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per pipeline stage for one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.samples = {}  # name -> [ms, ...] for per-item timings (e.g. each rendered page)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, ms):
+        # Repeated stages (e.g. several LLM calls) accumulate
+        with self._lock:
+            self.stages[name] = round(self.stages.get(name, 0.0) + ms, 2)
+
+    def sample(self, name, ms):
+        with self._lock:
+            self.samples.setdefault(name, []).append(round(ms, 2))
+
+    @contextmanager
+    def activate(self):
+        """Makes this the timer span()/sample() report to, in this context."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def bind(self, fn):
+        """fn, running with this timer active (contextvars don't follow work into thread pools)."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.activate():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.start) * 1000, 2)
+
+    def as_dict(self):
+        return {**self.stages, "total": self.elapsed_ms()}
+
+
+def current_timer():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Times a stage into the active timer, if there is one."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def sample(name, ms):
+    timer = _current.get()
+    if timer is not None:
+        timer.sample(name, ms)
@@ -0,0 +1,985 @@
+# vector_backends.py
+"""
+Vector store backends behind vector_store.get_vectorstore().
+
+Every backend offers the same small API (the subset of the Chroma/LangChain
+API the app uses), always with metadata filtering by pdf_id:
+
+    add_texts(texts, metadatas, ids)            embed + upsert
+    add_embeddings(ids, embeddings, texts, metadatas)
+    similarity_search(query, k, filter=None)    -> [Document]
+    similarity_search_by_vector(vector, k, filter=None)
+    similarity_search_by_vectors(vectors, k, filter=None) -> [[Document], ...]
+    similarity_search_by_vectors_with_scores(vectors, k, filter=None)
+                                                -> [[(Document, score)], ...]
+    get(ids=None, where=None, include=..., limit=None, offset=0) -> dict
+    delete(ids=None, where=None)
+    count()
+    persist()
+
+Filters are {"pdf_id": 3} or {"pdf_id": {"$in": [3, 4]}}.
+
+Backends (RAG_VECTOR_BACKEND):
+  * "chroma" - ChromaDB, persisted in RAG_CHROMA_DIR.
+  * "numpy"  - float32 matrix in a memory-mapped file plus a SQLite table
+               for ids/text/metadata. Exact search; ideal for small corpora.
+  * "faiss"  - the numpy storage plus a FAISS ANN index ("flat", "ivf" or
+               "hnsw") for unfiltered searches. Needs `pip install faiss-cpu`.
+  * "quantized" - the numpy storage plus int8 or binary codes: searches scan
+               the codes, then rescore a shortlist exactly. 4-32x less RAM
+               for the search pass than "numpy", with no extra dependency.
+
+PartitionedBackend splits any of them into one store per PDF (or per group
+of PDFs): scoped searches open only their own partitions, "all PDFs"
+searches fan out over every partition and merge the results.
+"""
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+def pdf_ids_from_filter(where):
+    """Returns the set of pdf ids a filter selects, or None for "everything"."""
+    if not where:
+        return None
+    condition = where.get("pdf_id")
+    if isinstance(condition, dict):
+        if "$in" in condition:
+            return {int(pdf_id) for pdf_id in condition["$in"]}
+        if "$eq" in condition:
+            return {int(condition["$eq"])}
+        raise ValueError(f"Unsupported filter: {where}")
+    if condition is None:
+        raise ValueError(f"Unsupported filter: {where}")
+    return {int(condition)}
+
+
+class ChromaBackend:
+
+    name = "chroma"
+
+    def __init__(self, collection_name, persist_directory, embedding, index_version=None):
+        from langchain_chroma import Chroma
+
+        self.store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding,
+            persist_directory=str(persist_directory),
+            collection_metadata={"index_version": index_version} if index_version else None,
+        )
+        self.embedding = embedding
+
+    @property
+    def _collection(self):
+        return self.store._collection
+
+    def add_texts(self, texts, metadatas, ids):
+        return self.store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        self._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.store.similarity_search(query, k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return self.store.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        """One Chroma query for several vectors; a list of Documents per vector."""
+        if not len(embeddings):
+            return []
+        result = self._collection.query(query_embeddings=[list(v) for v in embeddings], n_results=k,
+                                        where=filter, include=["documents", "metadatas"])
+        return [
+            [Document(id=doc_id, page_content=text, metadata=meta or {})
+             for doc_id, text, meta in zip(ids, texts, metas)]
+            for ids, texts, metas in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    def similarity_search_by_vectors_with_scores(self, embeddings, k=4, filter=None):
+        """Like similarity_search_by_vectors(), scored -distance (higher is better)."""
+        if not len(embeddings):
+            return []
+        result = self._collection.query(query_embeddings=[list(v) for v in embeddings], n_results=k,
+                                        where=filter, include=["documents", "metadatas", "distances"])
+        return [
+            [(Document(id=doc_id, page_content=text, metadata=meta or {}), -distance)
+             for doc_id, text, meta, distance in zip(ids, texts, metas, distances)]
+            for ids, texts, metas, distances in zip(
+                result["ids"], result["documents"], result["metadatas"], result["distances"])
+        ]
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        return self._collection.get(ids=ids, where=where, include=list(include), limit=limit, offset=offset)
+
+    def delete(self, ids=None, where=None):
+        self._collection.delete(ids=ids, where=where)
+
+    def count(self):
+        return self._collection.count()
+
+    def persist(self):
+        pass  # Chroma's PersistentClient writes through
+
+    def drop(self):
+        """Deletes the whole collection."""
+        self.store.delete_collection()
+
+    @staticmethod
+    def collection_names(persist_directory):
+        # Older chromadb versions return Collection objects, newer ones names
+        return [getattr(c, "name", c) for c in _chroma_client(str(persist_directory)).list_collections()]
+
+
+@lru_cache(maxsize=None)
+def _chroma_client(persist_directory):
+    """One client per folder for listing collections (each Chroma store keeps its own)."""
+    import chromadb
+
+    return chromadb.PersistentClient(path=persist_directory)
+
+
+class NumpyBackend:
+    """
+    Append-only float32 vector file (memory-mapped for search) + SQLite rows.
+
+    Vectors are L2-normalised on insert so a dot product is cosine similarity.
+    Upserts and deletes mark rows dead instead of rewriting the file; compact()
+    drops dead rows once they make up more than half the file.
+    """
+
+    name = "numpy"
+
+    def __init__(self, directory, embedding, index_version=None):
+        self.directory = str(directory)
+        self.embedding = embedding
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.db_path = os.path.join(self.directory, "chunks.sqlite3")
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._snapshot = None  # (generation, alive, pdf_ids, matrix)
+
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " row INTEGER PRIMARY KEY, id TEXT NOT NULL, pdf_id INTEGER,"
+                " text TEXT, metadata TEXT, alive INTEGER NOT NULL DEFAULT 1)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS chunks_id ON chunks (id)")
+            db.execute("CREATE INDEX IF NOT EXISTS chunks_pdf ON chunks (pdf_id, alive)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if index_version:
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_version', ?)", (index_version,))
+
+    # --- Storage ------------------------------------------------------------
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            self._local.db = db
+        return db
+
+    def _dim(self):
+        row = self._db().execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    def _generation(self):
+        row = self._db().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_generation(self, db, compacted=False):
+        # Every write bumps the generation so readers in any thread or process
+        # know to reload; compactions are counted separately because they
+        # renumber rows (which invalidates a FAISS index built on top).
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        if compacted:
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES ('compactions', '1') "
+                "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+            )
+
+    def _compactions(self):
+        row = self._db().execute("SELECT value FROM meta WHERE key = 'compactions'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _load(self):
+        """Row arrays + memory-mapped matrix, reloaded when any writer has changed them."""
+        generation = self._generation()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == generation:
+            return snapshot[1:]
+
+        db = self._db()
+        data = db.execute("SELECT row, alive, COALESCE(pdf_id, -1) FROM chunks ORDER BY row").fetchall()
+        dim = self._dim()
+        rows = np.asarray([r[0] for r in data], dtype=np.int64)
+        n = int(rows.max()) + 1 if len(rows) else 0
+        alive = np.zeros(n, dtype=bool)
+        pdf_ids = np.full(n, -1, dtype=np.int64)
+        if len(rows):
+            alive[rows] = [bool(r[1]) for r in data]
+            pdf_ids[rows] = [r[2] for r in data]
+
+        matrix = None
+        if dim and n:
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, dim))
+        self._snapshot = (generation, alive, pdf_ids, matrix)
+        return alive, pdf_ids, matrix
+
+    # --- Writes -----------------------------------------------------------
+
+    def add_texts(self, texts, metadatas, ids):
+        embeddings = self.embedding.embed_documents(list(texts))
+        self.add_embeddings(ids, embeddings, texts, metadatas)
+        return ids
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._write_lock, self._db() as db:
+            dim = self._dim()
+            if dim is None:
+                db.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(vectors.shape[1]),))
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match the index ({dim})")
+
+            # Upsert: older versions of these ids become dead rows
+            db.executemany("UPDATE chunks SET alive = 0 WHERE id = ?", [(i,) for i in ids])
+
+            start = db.execute("SELECT COALESCE(MAX(row), -1) + 1 FROM chunks").fetchone()[0]
+            # Drop any tail left by a write that never committed, then append
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * vectors.shape[1] * 4)
+                f.write(vectors.tobytes())
+            db.executemany(
+                "INSERT INTO chunks (row, id, pdf_id, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (start + i, doc_id, (meta or {}).get("pdf_id"), text, json.dumps(meta or {}))
+                    for i, (doc_id, text, meta) in enumerate(zip(ids, texts, metadatas))
+                ],
+            )
+            self._bump_generation(db)
+
+    def delete(self, ids=None, where=None):
+        with self._write_lock, self._db() as db:
+            if ids:
+                db.executemany("UPDATE chunks SET alive = 0 WHERE id = ?", [(i,) for i in ids])
+            scope = pdf_ids_from_filter(where)
+            if scope:
+                db.executemany("UPDATE chunks SET alive = 0 WHERE pdf_id = ?", [(p,) for p in scope])
+            self._bump_generation(db)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        total, alive = self._db().execute("SELECT COUNT(*), COALESCE(SUM(alive), 0) FROM chunks").fetchone()
+        if total >= 1000 and alive < total / 2:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the vector file without dead rows and renumbers the live ones."""
+        with self._write_lock, self._db() as db:
+            dim = self._dim()
+            live = db.execute("SELECT row FROM chunks WHERE alive = 1 ORDER BY row").fetchall()
+            if dim is None:
+                return
+            old = np.memmap(self.vectors_path, dtype=np.float32, mode="r") if live else None
+            tmp_path = f"{self.vectors_path}.compact"
+            with open(tmp_path, "wb") as f:
+                for (row,) in live:
+                    f.write(old[row * dim:(row + 1) * dim].tobytes())
+            del old
+
+            db.execute("DELETE FROM chunks WHERE alive = 0")
+            db.execute("UPDATE chunks SET row = -row - 1")
+            for new_row, (row,) in enumerate(live):
+                db.execute("UPDATE chunks SET row = ? WHERE row = ?", (new_row, -row - 1))
+            os.replace(tmp_path, self.vectors_path)
+            self._bump_generation(db, compacted=True)
+
+    def persist(self):
+        pass  # Every write is already on disk
+
+    def drop(self):
+        """Deletes this store's files (only its own: other stores may live in subfolders)."""
+        self._snapshot = None
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+        for name in os.listdir(self.directory):
+            if name.startswith(("vectors.f32", "chunks.sqlite3", "ann_")):
+                os.remove(os.path.join(self.directory, name))
+        if not os.listdir(self.directory):
+            os.rmdir(self.directory)
+
+    # --- Reads ------------------------------------------------------------
+
+    def count(self):
+        return self._db().execute("SELECT COUNT(*) FROM chunks WHERE alive = 1").fetchone()[0]
+
+    def _candidate_rows(self, alive, pdf_ids, where):
+        scope = pdf_ids_from_filter(where)
+        mask = alive if scope is None else alive & np.isin(pdf_ids, list(scope))
+        return np.nonzero(mask)[0]
+
+    def _top_rows(self, query, k, where):
+        return self._top_rows_batch(query.reshape(1, -1), k, where)[0]
+
+    def _top_rows_batch(self, queries, k, where):
+        """(rows, scores) of the k best rows for each query (one matrix product for all of them)."""
+        alive, pdf_ids, matrix = self._load()
+        if matrix is None:
+            return [([], [])] * len(queries)
+        rows = self._candidate_rows(alive, pdf_ids, where)
+        if not len(rows):
+            return [([], [])] * len(queries)
+        if len(rows) < len(alive):
+            scores = np.asarray(matrix[rows] @ queries.T)
+        else:
+            scores = np.asarray(matrix @ queries.T)[rows]
+
+        results = []
+        for column in scores.T:
+            if len(rows) > k:
+                top = np.argpartition(-column, k)[:k]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-column[top])]
+            results.append((rows[top].tolist(), column[top].tolist()))
+        return results
+
+    def search_bytes(self):
+        """Bytes a search scans (what has to stay in RAM for searches to be fast)."""
+        _, _, matrix = self._load()
+        return 0 if matrix is None else matrix.nbytes
+
+    def _documents_by_row(self, rows):
+        found = {}
+        rows = list(rows)
+        for i in range(0, len(rows), 500):
+            part = rows[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            for row, doc_id, text, meta in self._db().execute(
+                    f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders})", part):
+                found[row] = Document(id=doc_id, page_content=text, metadata=json.loads(meta))
+        return found
+
+    def _documents(self, rows):
+        found = self._documents_by_row(rows)
+        return [found[row] for row in rows if row in found]
+
+    def _normalized(self, vector):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        rows, _ = self._top_rows(self._normalized(embedding), k, filter)
+        return self._documents(rows)
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        """Several query vectors sharing a filter; a list of Documents per vector."""
+        return [[doc for doc, _ in hits]
+                for hits in self.similarity_search_by_vectors_with_scores(embeddings, k=k, filter=filter)]
+
+    def similarity_search_by_vectors_with_scores(self, embeddings, k=4, filter=None):
+        """Like similarity_search_by_vectors(), with each Document's cosine similarity."""
+        if not len(embeddings):
+            return []
+        queries = np.stack([self._normalized(vector) for vector in embeddings])
+        results = self._top_rows_batch(queries, k, filter)
+        found = self._documents_by_row({row for rows, _ in results for row in rows})
+        return [[(found[row], score) for row, score in zip(rows, scores) if row in found]
+                for rows, scores in results]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k=k, filter=filter)
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        sql = "SELECT row, id, text, metadata FROM chunks WHERE alive = 1"
+        params = []
+        if ids is not None:
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        scope = pdf_ids_from_filter(where)
+        if scope is not None:
+            sql += f" AND pdf_id IN ({','.join('?' * len(scope))})"
+            params.extend(scope)
+        sql += " ORDER BY row"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset or 0])
+
+        found = self._db().execute(sql, params).fetchall()
+        result = {
+            "ids": [r[1] for r in found],
+            "documents": [r[2] for r in found] if "documents" in include else None,
+            "metadatas": [json.loads(r[3]) for r in found] if "metadatas" in include else None,
+            "embeddings": None,
+        }
+        if "embeddings" in include:
+            _, _, matrix = self._load()
+            result["embeddings"] = [np.array(matrix[r[0]]) for r in found]
+        return result
+
+
+class FaissBackend(NumpyBackend):
+    """
+    NumpyBackend storage plus a FAISS index over the same rows for fast
+    unfiltered ("all PDFs") search. Searches scoped to specific PDFs score
+    just those PDFs' rows exactly, which is both cheaper and exact.
+
+    The index is rebuilt/extended lazily from the vector file, so rows added
+    by another process are picked up on the next search.
+    """
+
+    name = "faiss"
+
+    def __init__(self, directory, embedding, index_type="flat", nlist=100, hnsw_m=32, index_version=None):
+        super().__init__(directory, embedding, index_version=index_version)
+        import faiss  # Optional dependency: pip install faiss-cpu
+
+        self.faiss = faiss
+        self.index_type = index_type
+        self.nlist = nlist
+        self.hnsw_m = hnsw_m
+        self.index_path = os.path.join(self.directory, f"ann_{index_type}.faiss")
+        self._index = None
+        self._index_compactions = None
+        self._index_lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            # A saved index is only valid for the row numbering it was built on
+            row = self._db().execute("SELECT value FROM meta WHERE key = ?", (self._saved_key,)).fetchone()
+            if row and int(row[0]) == self._compactions():
+                self._index = faiss.read_index(self.index_path)
+                self._index_compactions = int(row[0])
+
+    @property
+    def _saved_key(self):
+        return f"ann_{self.index_type}_compactions"
+
+    def _new_index(self, dim, training):
+        faiss = self.faiss
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 80
+            return index
+        if self.index_type == "ivf" and len(training) >= self.nlist * 39:
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(np.ascontiguousarray(training))
+            index.nprobe = max(1, self.nlist // 10)
+            return index
+        # "flat", or "ivf" without enough vectors to train yet
+        return faiss.IndexFlatIP(dim)
+
+    def _synced_index(self, matrix):
+        """Adds rows the index hasn't seen yet (appended here or by another process)."""
+        with self._index_lock:
+            n = matrix.shape[0]
+            compactions = self._compactions()
+            if (self._index is None or self._index.ntotal > n or self._index.d != matrix.shape[1]
+                    or compactions != self._index_compactions):
+                # Compaction renumbers rows, so the index has to start over
+                self._index = self._new_index(matrix.shape[1], matrix)
+                self._index_compactions = compactions
+            if self._index.ntotal < n:
+                self._index.add(np.ascontiguousarray(matrix[self._index.ntotal:n]))
+            return self._index
+
+    def _top_rows_batch(self, queries, k, where):
+        if where:
+            return super()._top_rows_batch(queries, k, where)
+
+        alive, _, matrix = self._load()
+        if matrix is None:
+            return [([], [])] * len(queries)
+        index = self._synced_index(matrix)
+
+        # Dead rows stay in the index, so over-fetch until every query has k live rows
+        fetch = k
+        while True:
+            fetch = min(max(fetch * 2, k + 16), index.ntotal)
+            if self.index_type == "hnsw":
+                index.hnsw.efSearch = max(64, fetch)
+            scores, rows = index.search(np.ascontiguousarray(queries, dtype=np.float32), fetch)
+            picked = [
+                [(r, s) for r, s in zip(query_rows, query_scores) if r >= 0 and alive[r]]
+                for query_rows, query_scores in zip(rows, scores)
+            ]
+            if all(len(p) >= k for p in picked) or fetch >= index.ntotal:
+                break
+        return [([int(r) for r, _ in p[:k]], [float(s) for _, s in p[:k]]) for p in picked]
+
+    def persist(self):
+        _, _, matrix = self._load()
+        if matrix is None:
+            return
+        index = self._synced_index(matrix)
+        with self._index_lock:
+            self.faiss.write_index(index, self.index_path)
+            with self._db() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (self._saved_key, str(self._index_compactions)),
+                )
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def quantize(vectors, codes):
+    """(codes, per-row scales or None) for float32 rows: "int8" or "binary" (sign bits)."""
+    if codes == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class QuantizedBackend(NumpyBackend):
+    """
+    NumpyBackend storage plus compact codes for a first search pass:
+    "int8" (a byte per dimension, scaled per row; 4x smaller than float32)
+    or "binary" (sign bits; 32x smaller), scored with an int8 dot product or
+    the Hamming distance. The best rescore_factor * k candidates are then
+    rescored exactly against their float32 rows, read from the memory-mapped
+    vector file for those rows only - so only the codes need to stay in RAM.
+
+    Codes are derived from the vector file, like the FAISS index: rows the
+    saved code file doesn't cover yet (added by any process) are quantized
+    in memory on the next search, and persist() appends them to the file.
+    """
+
+    name = "quantized"
+    BLOCK_ROWS = 1024
+
+    def __init__(self, directory, embedding, codes="int8", rescore_factor=None, index_version=None):
+        super().__init__(directory, embedding, index_version=index_version)
+        if codes not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization: {codes!r}")
+        self.codes = codes
+        # Binary codes rank coarsely, so they need a deeper candidate list
+        self.rescore_factor = rescore_factor or (4 if codes == "int8" else 10)
+        self.codes_path = os.path.join(self.directory, f"ann_{codes}.codes")
+        self.scales_path = os.path.join(self.directory, f"ann_{codes}.scales")
+        self._segments = None  # (compactions, [(codes, scales), ...]) covering rows 0..n in order
+        self._codes_lock = threading.Lock()
+
+    # --- Codes ------------------------------------------------------------
+
+    def _width(self, dim):
+        return -(-dim // 8) if self.codes == "binary" else dim
+
+    def _saved_segments(self, dim, compactions):
+        """The code file as a memory-mapped segment, if it matches the current row numbering."""
+        meta = dict(self._db().execute(
+            "SELECT key, value FROM meta WHERE key IN (?, ?)",
+            (f"ann_{self.codes}_rows", f"ann_{self.codes}_compactions"),
+        ).fetchall())
+        rows = int(meta.get(f"ann_{self.codes}_rows", 0))
+        if not rows or int(meta.get(f"ann_{self.codes}_compactions", -1)) != compactions:
+            return []
+        dtype = np.uint8 if self.codes == "binary" else np.int8
+        codes = np.memmap(self.codes_path, dtype=dtype, mode="r", shape=(rows, self._width(dim)))
+        scales = None
+        if self.codes == "int8":
+            scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(rows,))
+        return [(codes, scales)]
+
+    def _synced_segments(self, matrix):
+        """Code segments covering every row of `matrix`, quantizing rows the file doesn't have yet."""
+        with self._codes_lock:
+            n, dim = matrix.shape
+            compactions = self._compactions()
+            if self._segments is None or self._segments[0] != compactions:
+                self._segments = (compactions, self._saved_segments(dim, compactions))
+            segments = self._segments[1]
+            covered = sum(len(codes) for codes, _ in segments)
+            if covered > n:
+                # Rows were renumbered under us: start over from the vector file
+                segments, covered = [], 0
+            if covered < n:
+                codes, scales = quantize(np.asarray(matrix[covered:n]), self.codes)
+                if segments and not isinstance(segments[-1][0], np.memmap):
+                    # Grow the in-memory tail rather than piling up segments
+                    tail_codes, tail_scales = segments.pop()
+                    codes = np.concatenate([tail_codes, codes])
+                    scales = None if scales is None else np.concatenate([tail_scales, scales])
+                segments = segments + [(codes, scales)]
+                self._segments = (compactions, segments)
+            return segments
+
+    def _codes_for(self, segments, rows):
+        """Codes (and scales) of the given ascending rows."""
+        parts, start = [], 0
+        for codes, scales in segments:
+            end = start + len(codes)
+            lo, hi = np.searchsorted(rows, [start, end])
+            if hi > lo:
+                local = rows[lo:hi] - start
+                parts.append((codes[local], None if scales is None else scales[local]))
+            start = end
+        codes = np.concatenate([c for c, _ in parts])
+        scales = None if self.codes == "binary" else np.concatenate([s for _, s in parts])
+        return codes, scales
+
+    def _blocks(self, segments, rows, n, block):
+        """(rows, codes, scales) blocks covering the candidate rows."""
+        if len(rows) * 2 < n:
+            # A few PDFs' rows: gather just those
+            for start in range(0, len(rows), block):
+                block_rows = rows[start:start + block]
+                yield (block_rows, *self._codes_for(segments, block_rows))
+            return
+        # Most of the index: scan the codes in order and drop the other rows afterwards
+        wanted = np.zeros(n, dtype=bool)
+        wanted[rows] = True
+        offset = 0
+        for codes, scales in segments:
+            for start in range(0, len(codes), block):
+                end = min(start + block, len(codes))
+                keep = np.nonzero(wanted[offset + start:offset + end])[0]
+                if len(keep) == end - start:
+                    keep = slice(None)
+                yield (np.arange(offset + start, offset + end)[keep], codes[start:end][keep],
+                       None if scales is None else scales[start:end][keep])
+            offset += len(codes)
+
+    def _approximate_scores(self, codes, scales, queries, query_bits):
+        if self.codes == "binary":
+            # Fewer differing sign bits = more similar
+            differing = codes[:, None, :] ^ query_bits[None, :, :]
+            counts = np.bitwise_count(differing) if hasattr(np, "bitwise_count") else _POPCOUNT[differing]
+            return -counts.sum(axis=2, dtype=np.int32).astype(np.float32)
+        return (codes.astype(np.float32) @ queries.T) * scales[:, None]
+
+    # --- Search -----------------------------------------------------------
+
+    def _top_rows_batch(self, queries, k, where):
+        alive, pdf_ids, matrix = self._load()
+        if matrix is None:
+            return [([], [])] * len(queries)
+        rows = self._candidate_rows(alive, pdf_ids, where)
+        shortlist = k * self.rescore_factor
+        if len(rows) <= shortlist:
+            # A PDF-scoped search with few chunks: exact scoring is cheaper than two passes
+            return super()._top_rows_batch(queries, k, where)
+
+        segments = self._synced_segments(matrix)
+        queries = np.asarray(queries, dtype=np.float32)
+        query_bits = np.packbits(queries > 0, axis=1) if self.codes == "binary" else None
+        # Small blocks: each one is converted/XORed in a cache-sized scratch buffer
+        block = self.BLOCK_ROWS
+
+        shortlisted = [[] for _ in queries]
+        for block_rows, codes, scales in self._blocks(segments, rows, len(alive), block):
+            if not len(block_rows):
+                continue
+            scores = self._approximate_scores(codes, scales, queries, query_bits)
+            keep = min(shortlist, len(block_rows))
+            top = np.argpartition(-scores, keep - 1, axis=0)[:keep]
+            for j in range(len(queries)):
+                shortlisted[j].append((block_rows[top[:, j]], scores[top[:, j], j]))
+
+        candidates = []
+        for parts in shortlisted:
+            part_rows = np.concatenate([r for r, _ in parts])
+            part_scores = np.concatenate([s for _, s in parts])
+            if len(part_rows) > shortlist:
+                part_rows = part_rows[np.argpartition(-part_scores, shortlist - 1)[:shortlist]]
+            candidates.append(part_rows)
+
+        # Exact rescoring: only the shortlisted float rows are read from disk
+        union = np.unique(np.concatenate(candidates))
+        exact = np.asarray(matrix[union]) @ queries.T
+        results = []
+        for j, part_rows in enumerate(candidates):
+            scores = exact[np.searchsorted(union, part_rows), j]
+            order = np.argsort(-scores)[:k]
+            results.append((part_rows[order].tolist(), scores[order].tolist()))
+        return results
+
+    def search_bytes(self):
+        _, _, matrix = self._load()
+        if matrix is None:
+            return 0
+        return sum(codes.nbytes + (0 if scales is None else scales.nbytes)
+                   for codes, scales in self._synced_segments(matrix))
+
+    def persist(self):
+        _, _, matrix = self._load()
+        if matrix is None:
+            return
+        segments = self._synced_segments(matrix)
+        compactions = self._segments[0]
+        covered = sum(len(codes) for codes, _ in segments)
+        rows_key, compactions_key = f"ann_{self.codes}_rows", f"ann_{self.codes}_compactions"
+        with self._codes_lock, self._write_lock, self._db() as db:
+            # Writing to meta first takes the database write lock, so processes append one at a time
+            db.execute("INSERT INTO meta (key, value) VALUES (?, '0') "
+                       "ON CONFLICT (key) DO UPDATE SET value = value", (rows_key,))
+            if compactions != self._compactions():
+                return
+            meta = dict(db.execute("SELECT key, value FROM meta WHERE key IN (?, ?)",
+                                   (rows_key, compactions_key)).fetchall())
+            saved_rows = int(meta[rows_key])
+            if int(meta.get(compactions_key, -1)) != compactions:
+                saved_rows = 0
+            if saved_rows >= covered:
+                return
+
+            codes, scales = self._codes_for(segments, np.arange(saved_rows, covered))
+            with open(self.codes_path, "ab") as f:
+                f.truncate(saved_rows * codes.shape[1])
+                f.write(np.ascontiguousarray(codes).tobytes())
+            if scales is not None:
+                with open(self.scales_path, "ab") as f:
+                    f.truncate(saved_rows * 4)
+                    f.write(scales.tobytes())
+            db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           [(rows_key, str(covered)), (compactions_key, str(compactions))])
+        # Searches switch to the memory-mapped file and the in-memory tail is freed
+        self._segments = None
+
+
+class PartitionedBackend:
+    """
+    One store per partition: a PDF (group_size=1) or a group of group_size
+    consecutive pdf ids. open_partition(key) creates/opens a partition's
+    store, list_partitions() returns the keys that exist on disk (in any
+    process's view, so uploads from ingest workers are seen straight away).
+
+    Searches scoped to some PDFs touch only their partitions. "All PDFs"
+    searches run on every partition in parallel on a thread pool (the
+    backends' matrix products and Chroma queries release the GIL) and keep
+    the best k with a heap. With one PDF per partition, deleting a PDF drops
+    its whole partition instead of marking rows dead in a shared index.
+
+    Chunk ids are routed by the pdf id encoded in them (chunk_pdf_id), so
+    get(ids=...) doesn't have to ask every partition.
+
+    The partition list is kept for list_ttl seconds (0: listed on every
+    call) and updated straight away by this backend's own adds and drops;
+    a PDF whose partition isn't in the list yet triggers a fresh listing,
+    so only "all PDFs" searches can miss another process's newest partition,
+    for at most list_ttl.
+    """
+
+    name = "partitioned"
+
+    def __init__(self, open_partition, list_partitions, embedding, group_size=1, chunk_pdf_id=None,
+                 workers=8, list_ttl=0.0):
+        self.open_partition = open_partition
+        self.list_partitions = list_partitions
+        self.embedding = embedding
+        self.group_size = max(1, int(group_size))
+        self.chunk_pdf_id = chunk_pdf_id
+        self.workers = workers
+        self.list_ttl = list_ttl
+        self._stores = {}
+        self._stores_lock = threading.Lock()
+        self._executor = None
+        self._partitions = None  # (monotonic time listed, frozenset of keys)
+
+    # --- Routing ----------------------------------------------------------
+
+    def partition_key(self, pdf_id):
+        return int(pdf_id) // self.group_size
+
+    def _store(self, key):
+        with self._stores_lock:
+            store = self._stores.get(key)
+            if store is None:
+                store = self._stores[key] = self.open_partition(key)
+            return store
+
+    def _existing(self, wanted=()):
+        """Partition keys on disk, listed again once stale or when a wanted key isn't among them."""
+        cached = self._partitions
+        if cached is not None and time.monotonic() - cached[0] < self.list_ttl and cached[1].issuperset(wanted):
+            return cached[1]
+        listed_at = time.monotonic()
+        existing = frozenset(self.list_partitions())
+        self._partitions = (listed_at, existing)
+        return existing
+
+    def _update_partitions(self, added=(), removed=()):
+        with self._stores_lock:
+            if self._partitions is not None:
+                listed_at, keys = self._partitions
+                self._partitions = (listed_at, (keys | set(added)) - set(removed))
+
+    def _keys(self, scope=None):
+        """Existing partition keys, all of them or those holding the given pdf ids."""
+        if scope is None:
+            return sorted(self._existing())
+        wanted = {self.partition_key(pdf_id) for pdf_id in scope}
+        return sorted(self._existing(wanted) & wanted)
+
+    def _partition_filter(self, key, scope):
+        """The filter a partition needs: none when it only holds the requested PDFs."""
+        if scope is None or self.group_size == 1:
+            return None
+        pdf_ids = sorted(pdf_id for pdf_id in scope if self.partition_key(pdf_id) == key)
+        return {"pdf_id": pdf_ids[0]} if len(pdf_ids) == 1 else {"pdf_id": {"$in": pdf_ids}}
+
+    def _map(self, fn, keys):
+        """fn(key) for every key, in parallel when there is more than one."""
+        if len(keys) <= 1:
+            return [fn(key) for key in keys]
+        if self._executor is None:
+            with self._stores_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rag-fanout")
+        return list(self._executor.map(fn, keys))
+
+    def _keys_for_ids(self, ids):
+        by_key = {}
+        unrouted = []
+        for doc_id in ids:
+            pdf_id = self.chunk_pdf_id(doc_id) if self.chunk_pdf_id else None
+            if pdf_id is None:
+                unrouted.append(doc_id)
+            else:
+                by_key.setdefault(self.partition_key(pdf_id), []).append(doc_id)
+        existing = self._existing(by_key)
+        by_key = {key: key_ids for key, key_ids in by_key.items() if key in existing}
+        if unrouted:
+            # Ids without a pdf id in them could be anywhere
+            for key in existing:
+                by_key.setdefault(key, []).extend(unrouted)
+        return by_key
+
+    # --- Writes -----------------------------------------------------------
+
+    def add_texts(self, texts, metadatas, ids):
+        embeddings = self.embedding.embed_documents(list(texts))
+        self.add_embeddings(ids, embeddings, texts, metadatas)
+        return ids
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        groups = {}
+        for i, meta in enumerate(metadatas):
+            pdf_id = (meta or {}).get("pdf_id")
+            if pdf_id is None:
+                raise ValueError(f"Chunk {ids[i]!r} has no pdf_id to pick a partition with")
+            groups.setdefault(self.partition_key(pdf_id), []).append(i)
+        for key, rows in groups.items():
+            self._store(key).add_embeddings(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                texts=[texts[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+            )
+        self._update_partitions(added=groups)
+
+    def delete(self, ids=None, where=None):
+        if ids:
+            for key, key_ids in self._keys_for_ids(ids).items():
+                self._store(key).delete(ids=key_ids)
+        scope = pdf_ids_from_filter(where)
+        if not scope:
+            return
+        for key in self._keys(scope):
+            if self.group_size == 1:
+                self._drop_partition(key)
+            else:
+                self._store(key).delete(where=self._partition_filter(key, scope))
+
+    def _drop_partition(self, key):
+        store = self._store(key)
+        with self._stores_lock:
+            self._stores.pop(key, None)
+        store.drop()
+        self._update_partitions(removed=[key])
+
+    def persist(self):
+        with self._stores_lock:
+            stores = list(self._stores.values())
+        for store in stores:
+            store.persist()
+
+    def drop(self):
+        for key in self._keys():
+            self._drop_partition(key)
+
+    # --- Reads ------------------------------------------------------------
+
+    def count(self):
+        return sum(self._map(lambda key: self._store(key).count(), self._keys()))
+
+    def similarity_search_by_vectors_with_scores(self, embeddings, k=4, filter=None):
+        if not len(embeddings):
+            return []
+        scope = pdf_ids_from_filter(filter)
+        partials = self._map(
+            lambda key: self._store(key).similarity_search_by_vectors_with_scores(
+                embeddings, k=k, filter=self._partition_filter(key, scope)),
+            self._keys(scope),
+        )
+        return [heapq.nlargest(k, (hit for partial in partials for hit in partial[i]), key=lambda hit: hit[1])
+                for i in range(len(embeddings))]
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        """Several query vectors sharing a filter; a list of Documents per vector."""
+        return [[doc for doc, _ in hits]
+                for hits in self.similarity_search_by_vectors_with_scores(embeddings, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return self.similarity_search_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k=k, filter=filter)
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        scope = pdf_ids_from_filter(where)
+        keys = self._keys(scope)
+        if ids is not None:
+            by_key = self._keys_for_ids(ids)
+            keys = [key for key in keys if key in by_key]
+
+        if len(keys) == 1 and ids is None:
+            # Paging within one partition (e.g. copying a PDF's chunks) stays in that store
+            return self._store(keys[0]).get(where=self._partition_filter(keys[0], scope), include=include,
+                                            limit=limit, offset=offset)
+
+        parts = self._map(
+            lambda key: self._store(key).get(
+                ids=None if ids is None else by_key[key],
+                where=self._partition_filter(key, scope),
+                include=include),
+            keys,
+        )
+        result = {"ids": [], "documents": None, "metadatas": None, "embeddings": None}
+        for field in ("documents", "metadatas", "embeddings"):
+            if field in include:
+                result[field] = []
+        for part in parts:
+            result["ids"].extend(part["ids"])
+            for field in ("documents", "metadatas", "embeddings"):
+                if field in include:
+                    result[field].extend(part[field])
+        if limit is not None or offset:
+            end = None if limit is None else (offset or 0) + limit
+            result = {field: None if values is None else values[offset or 0:end] for field, values in result.items()}
+        return result
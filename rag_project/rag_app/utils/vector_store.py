@@ -1,47 +1,258 @@
 # vector_store.py
 import os
-from langchain_chroma import Chroma
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
 from langchain_core.documents import Document
-from .embeddings import get_embeddings
+from .embeddings import get_embeddings, embeddings_key
+from .index_state import active_index, is_legacy, live_indexes
+from .registry import registry
+from .timing import span
+from .vector_backends import ChromaBackend, FaissBackend, NumpyBackend, PartitionedBackend, QuantizedBackend
+
+DB_PATH = settings.BASE_DIR / "chroma_db_data"
+# Seconds a partitioned store trusts its list of partitions (see PartitionedBackend)
+PARTITION_LIST_TTL = 2.0
+
+
+def _backend_settings():
+    return (
+        getattr(settings, "RAG_VECTOR_BACKEND", "chroma"),
+        getattr(settings, "RAG_CHROMA_DIR", DB_PATH),
+        getattr(settings, "RAG_FAISS_INDEX_TYPE", "flat"),
+        getattr(settings, "RAG_FAISS_INDEX_DIR", settings.BASE_DIR / "faiss_index"),
+        getattr(settings, "RAG_NUMPY_INDEX_DIR", settings.BASE_DIR / "numpy_index"),
+        getattr(settings, "RAG_QUANTIZATION", "int8"),
+        getattr(settings, "RAG_RESCORE_FACTOR", None),  # None: 4 for int8, 10 for binary
+        getattr(settings, "RAG_PARTITION_WORKERS", 8),
+    )
+
+
+def _vectorstore_config():
+    # The store holds a reference to the embedding model, so it has to be
+    # rebuilt whenever the embedding config (or the active index) changes too.
+    return (_backend_settings(), active_index().name, embeddings_key())
+
+
+def build_backend(backend, embedding, directory, collection_name="rag_collection", index_type="flat",
+                  index_version=None, quantization="int8", rescore_factor=None):
+    """Creates one of the RAG_VECTOR_BACKEND stores: "chroma", "faiss", "numpy" or "quantized"."""
+    if backend == "chroma":
+        return ChromaBackend(collection_name, directory, embedding, index_version=index_version)
+    if backend == "faiss":
+        return FaissBackend(directory, embedding, index_type=index_type, index_version=index_version)
+    if backend == "numpy":
+        return NumpyBackend(directory, embedding, index_version=index_version)
+    if backend == "quantized":
+        return QuantizedBackend(directory, embedding, codes=quantization, rescore_factor=rescore_factor,
+                                index_version=index_version)
+    raise ValueError(f"Unknown RAG_VECTOR_BACKEND: {backend!r}")
+
+
+def open_vectorstore(index, embedding=None):
+    """
+    The vector store of any VectorIndex generation. Chroma keeps every
+    generation as a collection in one database; the on-disk backends get a
+    folder per generation (the pre-versioning index stays where it was).
+    "quantized" shares the numpy folder: its codes are derived from the
+    same vector file, so switching between the two needs no re-upload.
+
+    Indexes built with a "partition_size" (RAG_VECTOR_PARTITION_SIZE) get a
+    collection or subfolder per partition, behind a PartitionedBackend.
+    """
+    (backend, chroma_dir, index_type, faiss_dir, numpy_dir, quantization, rescore_factor,
+     partition_workers) = _backend_settings()
+    directory = {"chroma": chroma_dir, "faiss": faiss_dir, "numpy": numpy_dir, "quantized": numpy_dir}.get(backend)
+    if backend != "chroma" and not is_legacy(index):
+        directory = os.path.join(str(directory), index.name)
+
+    def build(directory, collection_name):
+        return build_backend(backend, embedding, directory, collection_name, index_type,
+                             index_version=index.version, quantization=quantization, rescore_factor=rescore_factor)
+
+    partition_size = index.config.get("partition_size")
+    if not partition_size:
+        return build(directory, index.name)
+    return build_partitioned(build, backend, directory, index.name, partition_size, embedding,
+                             workers=partition_workers)
+
+
+def build_partitioned(build, backend, directory, collection_name, group_size, embedding=None, workers=8):
+    """
+    A PartitionedBackend whose partitions are build(directory, collection_name)
+    stores: Chroma collections "<collection_name>_p<key>", or for the on-disk
+    backends subfolders "p<key>" of `directory`.
+    """
+    if backend == "chroma":
+        pattern = re.compile(rf"^{re.escape(collection_name)}_p(\d+)$")
+
+        def open_partition(key):
+            return build(directory, f"{collection_name}_p{key}")
+
+        def list_partitions():
+            return [int(m.group(1)) for m in map(pattern.match, ChromaBackend.collection_names(directory)) if m]
+    else:
+        pattern = re.compile(r"^p(\d+)$")
+
+        def open_partition(key):
+            return build(os.path.join(str(directory), f"p{key}"), collection_name)
+
+        def list_partitions():
+            if not os.path.isdir(directory):
+                return []
+            return [int(m.group(1)) for m in map(pattern.match, os.listdir(directory))
+                    if m and os.path.exists(os.path.join(directory, m.group(0), "chunks.sqlite3"))]
+
+    return PartitionedBackend(open_partition, list_partitions, embedding, group_size=group_size,
+                              chunk_pdf_id=chunk_pdf_id, workers=workers, list_ttl=PARTITION_LIST_TTL)
+
+
+def _build_vectorstore():
+    return open_vectorstore(active_index(), get_embeddings())
+
+
+registry.register("vectorstore", _build_vectorstore, config=_vectorstore_config)
 
-DB_PATH = "./chroma_db_data"
 
 def get_vectorstore():
     """Returns the singleton vector store instance."""
-    embedding_func = get_embeddings()
-    return Chroma(
-        collection_name="rag_collection",
-        embedding_function=embedding_func,
-        persist_directory=DB_PATH
-    )
+    return registry.get("vectorstore")
 
-def create_vector_store(documents: list[Document], pdf_id: int):
-    """Adds pre-created documents to the vector store, attaching the PDF ID."""
+_CHUNK_ID_PREFIX = re.compile(r"^pdf(\d+)_")
+
+
+def chunk_id(pdf_id, n):
+    return f"pdf{pdf_id}_c{n}"
+
+
+def chunk_pdf_id(doc_id):
+    """The pdf id a chunk id was made from, or None for ids of another shape."""
+    match = _CHUNK_ID_PREFIX.match(doc_id)
+    return int(match.group(1)) if match else None
+
+
+def rebase_chunk_id(old_id, pdf_id):
+    """The id a chunk gets when it is copied to another PDF."""
+    if _CHUNK_ID_PREFIX.match(old_id):
+        return _CHUNK_ID_PREFIX.sub(f"pdf{pdf_id}_", old_id)
+    return f"pdf{pdf_id}_{old_id}"
+
+
+def add_documents_streaming(documents, pdf_id: int, batch_size=None, progress=None, on_batch=None):
+    """
+    Embeds and upserts documents in fixed-size batches as they arrive from a
+    generator, so memory stays bounded by one batch regardless of document size.
+
+    Chunk ids are deterministic (pdf id + running index), so re-running an
+    ingestion overwrites the same rows instead of duplicating them. Chunks go
+    to the active index and are tagged with its version.
+    progress(done) is called after every batch, on_batch(docs, ids) too.
+    Returns throughput stats: {"chunks", "batches", "seconds", "chunks_per_sec"}.
+    """
     vectorstore = get_vectorstore()
-    
-    # Inject pdf_id into each document's metadata
-    for doc in documents:
-        doc.metadata["pdf_id"] = pdf_id
-    
-    vectorstore.add_documents(documents)
-
-def delete_from_vector_store(pdf_id: int):
-    """Deletes all chunks belonging to a specific PDF."""
+    version = active_index().version
+    batch_size = batch_size or getattr(settings, "RAG_EMBED_BATCH_SIZE", 64)
+
+    documents = iter(documents)
+    done = 0
+    batches = 0
+    start = time.perf_counter()
+
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            break
+
+        # Inject pdf_id and the index version into each document's metadata
+        for doc in batch:
+            doc.metadata["pdf_id"] = pdf_id
+            doc.metadata["index_version"] = version
+
+        ids = [chunk_id(pdf_id, done + i) for i in range(len(batch))]
+        texts = [doc.page_content for doc in batch]
+        with span("embed"):
+            embeddings = vectorstore.embedding.embed_documents(texts)
+        with span("upsert"):
+            vectorstore.add_embeddings(
+                ids=ids,
+                embeddings=embeddings,
+                texts=texts,
+                metadatas=[doc.metadata for doc in batch],
+            )
+        done += len(batch)
+        batches += 1
+        if on_batch:
+            on_batch(batch, ids)
+        if progress:
+            progress(done)
+
+    with span("upsert"):
+        vectorstore.persist()
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": done,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def clone_pdf_vectors(source_pdf_id: int, pdf_id: int, batch_size=None):
+    """
+    Copies the stored chunks and vectors of one PDF to another (used when an
+    identical file is uploaded again), without re-embedding anything.
+    Returns the number of chunks copied.
+    """
     vectorstore = get_vectorstore()
-    
-    # Chroma doesn't have a simple "delete by metadata" in all versions yet,
-    # but we can get IDs by metadata and delete them.
-    # Note: This implementation depends on your specific Chroma version.
-    # A generic safe way for simple apps is often just checking the metadata matches.
-    
-    # 1. Get all data
-    data = vectorstore.get()
-    
-    ids_to_delete = []
-    if data and "ids" in data and "metadatas" in data:
-        for doc_id, meta in zip(data["ids"], data["metadatas"]):
-            if meta.get("pdf_id") == pdf_id:
-                ids_to_delete.append(doc_id)
-                
-    if ids_to_delete:
-        vectorstore.delete(ids=ids_to_delete)
\ No newline at end of file
+    batch_size = batch_size or getattr(settings, "RAG_EMBED_BATCH_SIZE", 64)
+
+    copied = 0
+    while True:
+        data = vectorstore.get(
+            where={"pdf_id": source_pdf_id},
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=copied,
+        )
+        if not data["ids"]:
+            break
+
+        metadatas = [dict(meta, pdf_id=pdf_id) for meta in data["metadatas"]]
+        vectorstore.add_embeddings(
+            ids=[rebase_chunk_id(old_id, pdf_id) for old_id in data["ids"]],
+            embeddings=data["embeddings"],
+            texts=data["documents"],
+            metadatas=metadatas,
+        )
+        copied += len(data["ids"])
+    vectorstore.persist()
+    return copied
+
+
+def create_vector_store(documents: list[Document], pdf_id: int):
+    """Adds pre-created documents to the vector store, attaching the PDF ID."""
+    return add_documents_streaming(documents, pdf_id)
+
+
+def delete_from_vector_store(pdf_ids):
+    """
+    Deletes all chunks belonging to one PDF id or a list of them, from the
+    active index and from any index being built by `manage.py reindex`.
+    Every backend filters on the pdf_id metadata itself, so this never has
+    to pull every id in the collection into Python; a partitioned index just
+    drops the PDF's partition.
+    """
+    if isinstance(pdf_ids, int):
+        pdf_ids = [pdf_ids]
+    pdf_ids = [int(pdf_id) for pdf_id in pdf_ids]
+    if not pdf_ids:
+        return
+
+    where = {"pdf_id": pdf_ids[0]} if len(pdf_ids) == 1 else {"pdf_id": {"$in": pdf_ids}}
+    active = active_index()
+    for index in live_indexes():
+        vectorstore = get_vectorstore() if index.pk == active.pk else open_vectorstore(index)
+        vectorstore.delete(where=where)
+        vectorstore.persist()
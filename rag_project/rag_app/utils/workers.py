@@ -0,0 +1,36 @@
+# workers.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+
+
+# Set in pool children, whose inherited sys.argv would otherwise make
+# RagAppConfig.ready() think they are serving (and warm up models and the LLM)
+POOL_WORKER_ENV = "RAG_POOL_WORKER"
+
+
+def is_pool_worker():
+    return os.environ.get(POOL_WORKER_ENV) == "1"
+
+
+def init_django_worker():
+    """Pool initializer: worker processes need Django set up before they can unpickle tasks."""
+    os.environ[POOL_WORKER_ENV] = "1"
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_project.settings')
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def process_pool(max_workers):
+    """
+    A process pool for CPU-heavy work. Uses "spawn" so children don't inherit
+    the parent's DB connections or half-initialised torch threads.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_django_worker,
+    )
@@ -1,76 +1,73 @@
-import os
-import re # For robust JSON extraction
 import json  # Required for parsing LLM output
-import shutil
-from io import BytesIO
 
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
-from django.core.files.base import ContentFile
-
-# Requires: pip install pymupdf (fitz)
-import fitz # PyMuPDF
-
-from .models import UploadedPDF, PDFPage
-from .utils.pdf_loader import extract_text_from_pdf
-from .utils.text_splitter import split_text
-from .utils.vector_store import create_vector_store, get_vectorstore, delete_from_vector_store
-from .utils.llm import get_llm
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404, StreamingHttpResponse
+from django.core.files.storage import default_storage
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import UploadedPDF, PDFPage, IngestionJob
+from .utils.page_text import iter_page_text
+from .utils.vector_store import delete_from_vector_store
+from .utils.lexical_index import delete_from_lexical_index
+from .utils.index_state import active_index, building_indexes
+from .utils.retrieval import default_weights
+from .utils.registry import registry
+from .utils.embeddings import embedding_cache_stats
+from .utils.answer_cache import answer_cache
+from .utils.concurrency import Overloaded, llm_admission, run_blocking
+from .utils.metrics import render_metrics
+from .utils import batch_qa, ingestion, page_renderer, qa
 
 
 def upload_pdf(request):
     """
-    Handle PDF upload, text extraction, vector store creation,
-    and generating images for EVERY page (for visual citations).
+    Handle PDF upload. Processing (text extraction, vector store, page images)
+    runs in the background; each file gets an IngestionJob whose progress
+    can be polled via /jobs/<id>/.
     """
     msg = None
     if request.method == "POST":
         files = request.FILES.getlist("pdfs")
+        jobs = []
         for pdf_file in files:
-            # 1. Save PDF in DB
+            # Save PDF in DB, then hand it to the ingestion queue
             pdf_obj = UploadedPDF.objects.create(file=pdf_file)
+            jobs.append(ingestion.enqueue(pdf_obj))
 
-            # 2. Extract text and create vector store
-            pages_data = extract_text_from_pdf(pdf_obj.file.path)
-            documents = split_text(pages_data)
-            create_vector_store(documents, pdf_obj.id)
+        if request.headers.get("Accept") == "application/json":
+            return JsonResponse({"jobs": [job.as_dict() for job in jobs]}, status=202)
 
-            # 3. Generate Images for EVERY Page
-            try:
-                # Use PyMuPDF (fitz) instead of pdf2image to avoid Poppler dependency
-                doc = fitz.open(pdf_obj.file.path)
-                
-                for i, page in enumerate(doc):
-                    page_number = i + 1
-                    
-                    # Render page to image (pixmap)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2)) # 2x zoom for better quality
-                    img_data = pix.tobytes("jpg")
-                    
-                    page_obj = PDFPage(pdf=pdf_obj, page_number=page_number)
-                    file_name = f"{pdf_obj.id}_page_{page_number}.jpg"
-                    
-                    # Save directly from bytes
-                    page_obj.image.save(file_name, ContentFile(img_data), save=True)
-
-                    if page_number == 1:
-                        pdf_obj.cover_image = page_obj.image
-                        pdf_obj.save()
-                        
-                doc.close()
-                        
-            except Exception as e:
-                print(f"⚠️ Could not process PDF images: {e}")
-
-        msg = f"{len(files)} PDF(s) processed successfully"
+        msg = f"{len(files)} PDF(s) queued for processing"
 
     pdfs = UploadedPDF.objects.all().order_by('-uploaded_at')
     return render(request, "rag_app/upload.html", {"msg": msg, "pdfs": pdfs})
 
 
-def ask_question(request):
+def job_status(request, job_id):
+    """Per-stage progress of an ingestion job (extract, split, embed, render, summarize)."""
+    job = get_object_or_404(IngestionJob, id=job_id)
+    return JsonResponse(job.as_dict())
+
+
+def retry_job(request, job_id):
+    """Re-queue a failed ingestion job, or a running one whose worker stopped reporting."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    job = get_object_or_404(IngestionJob, id=job_id)
+    if not ingestion.retry(job):
+        return JsonResponse({"error": f"Job is {job.status}, only failed or stalled jobs can be retried"}, status=409)
+
+    job.refresh_from_db()
+    return JsonResponse(job.as_dict(), status=202)
+
+
+async def ask_question(request):
     """
     Handle Q&A. Returns a STRUCTURED JSON object (Title, Subtitle, Content, Points).
+    Async so that, under asgi.py, waiting on the model doesn't hold a worker thread.
     """
     question = request.GET.get("q")
     pdf_id = request.GET.get("pdf_id")
@@ -79,160 +76,231 @@ def ask_question(request):
         return JsonResponse({"error": "Question is required"}, status=400)
 
     try:
-        vectorstore = get_vectorstore()
-        search_kwargs = {"k": 6}
-
-        if pdf_id != "all":
-            search_kwargs["filter"] = {"pdf_id": int(pdf_id)}
-
-        docs = vectorstore.similarity_search(question, **search_kwargs)
-
-        if not docs:
-            return JsonResponse({
-                "answer": {
-                    "title": "No Info Found", 
-                    "subtitle": "Search Result", 
-                    "content": "I couldn't find relevant information in the uploaded documents.", 
-                    "points": []
-                }
-            })
-
-        # --- Retrieve specific page image ---
-        source_image_url = None
-        best_doc = docs[0]
-        
-        # Get metadata safely
-        matched_pdf_id = best_doc.metadata.get('pdf_id') 
-        # Metadata 'page' is now 1-based from our new loader
-        source_page_num = best_doc.metadata.get('page', 1)
-        
+        return JsonResponse(await qa.answer_question_async(question, pdf_id, weights=_hybrid_weights(request),
+                                                           timer=getattr(request, "timer", None)))
+
+    except Overloaded as e:
+        response = JsonResponse({"answer": {"title": "Busy", "content": str(e)}}, status=503)
+        response["Retry-After"] = "5"
+        return response
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return JsonResponse({"answer": {"title": "Error", "content": "Server Error occurred"}}, status=500)
+
+
+def _hybrid_weights(request):
+    """Optional per-query RRF weights: ?dense_weight=1&lexical_weight=0.5"""
+    dense = request.GET.get("dense_weight")
+    lexical = request.GET.get("lexical_weight")
+    if dense is None and lexical is None:
+        return None
+    defaults = default_weights()
+    try:
+        return (
+            float(dense) if dense is not None else defaults[0],
+            float(lexical) if lexical is not None else defaults[1],
+        )
+    except ValueError:
+        return None
+
+
+async def ask_question_stream(request):
+    """
+    Streaming Q&A over Server-Sent Events: retrieval results first, then the
+    answer tokens as the model produces them, then the final parsed answer.
+    Serve through asgi.py (e.g. uvicorn) to get the tokens incrementally.
+    """
+    question = request.GET.get("q")
+    pdf_id = request.GET.get("pdf_id")
+
+    if not question:
+        return JsonResponse({"error": "Question is required"}, status=400)
+
+    async def events():
         try:
-            if matched_pdf_id:
-                page_obj = PDFPage.objects.filter(
-                    pdf_id=matched_pdf_id, 
-                    page_number=source_page_num
-                ).first()
-                if page_obj and page_obj.image:
-                    source_image_url = page_obj.image.url
+            async for event, data in qa.stream_answer(question, pdf_id, weights=_hybrid_weights(request),
+                                                      timer=getattr(request, "timer", None)):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Overloaded as e:
+            error = {"answer": {"title": "Busy", "content": str(e)}}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
         except Exception as e:
-            print(f"Error fetching source image: {e}")
-
-        # --- Generate Answer in Semantic Format ---
-        # Add page numbers to context for the LLM
-        context = ""
-        for doc in docs:
-            p_num = doc.metadata.get('page', '?')
-            context += f"[Page {p_num}] {doc.page_content}\n\n"
-
-        llm = get_llm()
-        
-        # Explicit JSON Prompt with Strict Context Rules
-        prompt = f"""You are a strict AI assistant designed to answer questions based ONLY on the provided context from a PDF document.
-
-**CRITICAL INSTRUCTIONS:**
-1.  **NO OUTSIDE KNOWLEDGE:** Do not use your own knowledge. If the answer is not explicitly in the Context below, you MUST say "I cannot find the answer in the document."
-2.  **JSON ONLY:** Output your answer in valid JSON format.
-3.  **JSON STRUCTURE:**
-    {{
-        "title": "A short headline",
-        "subtitle": "Context summary",
-        "content": "The answer found in the text. if not found, say 'I cannot find the answer in the document.'",
-        "points": ["Key point 1", "Key point 2"] (optional, can be empty)
-    }}
-
-Context:
-{context}
-
-Question: {question}
-"""
-
-        response = llm.invoke(prompt)
-        raw_answer = getattr(response, "content", str(response))
-
-        # --- Robust JSON Extraction ---
+            print(f"❌ Error: {e}")
+            error = {"answer": {"title": "Error", "content": "Server Error occurred"}}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Stop nginx from buffering the stream
+    return response
+
+
+@csrf_exempt  # Called by scripts (nightly evaluations), not the browser
+async def ask_question_batch(request):
+    """
+    Batch Q&A. POST a JSON body:
+        {"questions": ["...", {"id": "q7", "question": "...", "pdf_id": 3}], "pdf_id": "all"}
+    Answers stream back as JSON Lines, one object per question in the order
+    they finish (each carries its "index"). Questions share one embedding
+    batch and one vector search per pdf scope; see utils/batch_qa.py.
+    Serve through asgi.py to receive the lines as they are produced.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    try:
+        body = json.loads(request.body or b"{}")
+        questions = body["questions"]
+        if not isinstance(questions, list):
+            raise ValueError("questions must be a list")
+        batch_qa.parse_items(questions, body.get("pdf_id", "all"))
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({"error": f"Invalid batch: {e}"}, status=400)
+
+    limit = getattr(settings, "RAG_BATCH_MAX_QUESTIONS", 1000)
+    if len(questions) > limit:
+        return JsonResponse({"error": f"At most {limit} questions per batch"}, status=400)
+
+    timer = getattr(request, "timer", None)
+
+    async def lines():
+        results = batch_qa.answer_batch(questions, body.get("pdf_id", "all"),
+                                        weights=_hybrid_weights(request), timer=timer)
         try:
-            # Look for something that starts with { and ends with } (including newlines)
-            match = re.search(r'\{.*\}', raw_answer, re.DOTALL)
-            if match:
-                cleaned_answer = match.group(0)
-                answer_json = json.loads(cleaned_answer)
-            else:
-                raise ValueError("No JSON object found")
-                
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"JSON Parse Error: {e}. Raw output: {raw_answer}")
-            answer_json = {
-                "title": "Answer",
-                "subtitle": "Generated Response",
-                "content": raw_answer, # Fallback to showing whatever the model spit out
-                "points": []
-            }
-
-        # Get source PDF details
-        source_pdf_url = ""
-        
-        # LOGIC CHANGE: Only provide source if the answer was actually found
-        # We check for the specific phrase the prompt is instructed to use.
-        ans_content = answer_json.get("content", "").lower()
-        if "cannot find the answer" in ans_content:
-            # Answer not found, suppress source link
-            source_pdf_url = ""
-            source_page_num = None
-        elif matched_pdf_id:
+            while True:
+                # The batch generator blocks (embedding, search, waiting on the LLM pool)
+                result = await run_blocking(next, results, None)
+                if result is None:
+                    break
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            yield json.dumps({"error": "Server Error occurred"}) + "\n"
+        finally:
             try:
-                pdf_obj = UploadedPDF.objects.get(id=matched_pdf_id)
-                if pdf_obj.file:
-                    source_pdf_url = pdf_obj.file.url
-            except UploadedPDF.DoesNotExist:
-                pass
-
-        return JsonResponse({
-            "answer": answer_json,
-            "source_image": source_image_url,
-            "pdf_url": source_pdf_url,
-            "page_number": source_page_num
-        })
+                results.close()
+            except ValueError:
+                pass  # Still running in the pool (client went away); it stops when collected
 
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        return JsonResponse({"answer": {"title": "Error", "content": "Server Error occurred"}}, status=500)
+    response = StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def page_image(request, pdf_id, page_number):
+    """
+    Serve a page image (?size=thumb for the thumbnail), rendering it
+    and recording the PDFPage the first time it is requested.
+    """
+    pdf = get_object_or_404(UploadedPDF, id=pdf_id)
+    page_obj = page_renderer.get_page(pdf, page_number)
+    if page_obj is None:
+        raise Http404("Page out of range")
+
+    image = page_obj.thumbnail if request.GET.get("size") == "thumb" else page_obj.image
+    response = FileResponse(image.open("rb"))
+    patch_cache_control(response, public=True, max_age=86400)
+    return response
 
 
 def delete_pdf(request, pdf_id):
     try:
         pdf = get_object_or_404(UploadedPDF, id=pdf_id)
-        if pdf.file:
-            pdf.file.delete(save=False)
-        pdf.delete()
-        delete_from_vector_store(pdf_id)
+        _delete_pdfs([pdf])
     except Exception as e:
         print(f"Error deleting PDF: {e}")
     return redirect("upload_pdf")
 
 
+def delete_pdfs(request):
+    """Bulk delete: POST pdf_ids=1&pdf_ids=2... removes them in one batched pass."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    pdfs = list(UploadedPDF.objects.filter(id__in=request.POST.getlist("pdf_ids")))
+    try:
+        _delete_pdfs(pdfs)
+    except Exception as e:
+        print(f"Error deleting PDFs: {e}")
+        return JsonResponse({"error": "Could not delete documents"}, status=500)
+    return JsonResponse({"deleted": [pdf.id for pdf in pdfs]})
+
+
+def _delete_pdfs(pdfs):
+    """Removes PDFs with their chunks, rendered page images, thumbnails and covers."""
+    if not pdfs:
+        return
+    pdf_ids = [pdf.id for pdf in pdfs]
+
+    # One filtered delete for every chunk of every PDF
+    delete_from_vector_store(pdf_ids)
+    delete_from_lexical_index(pdf_ids)
+
+    # Collect every file before the rows (and their references) are gone
+    files = set()
+    for image, thumbnail in PDFPage.objects.filter(pdf_id__in=pdf_ids).values_list("image", "thumbnail"):
+        files.update(name for name in (image, thumbnail) if name)
+    for pdf in pdfs:
+        files.update(name for name in (pdf.file.name, pdf.cover_image.name) if name)
+
+    UploadedPDF.objects.filter(id__in=pdf_ids).delete()  # cascades to pages and jobs
+    answer_cache.invalidate(pdf_ids)
+
+    for name in files:
+        try:
+            default_storage.delete(name)
+        except OSError as e:
+            print(f"Could not delete {name}: {e}")
+
+
 def download_transcript(request, pdf_id):
     """
-    Generate and download a text transcript of the PDF.
+    Stream a text transcript of the PDF from the page text stored at ingest.
     """
     pdf = get_object_or_404(UploadedPDF, id=pdf_id)
-    
-    try:
-        pages_data = extract_text_from_pdf(pdf.file.path)
-        full_text = f"Transcript for: {pdf.filename}\n"
-        full_text += f"Uploaded: {pdf.uploaded_at}\n"
-        full_text += "="*50 + "\n\n"
-        
-        for data in pages_data:
-            full_text += f"--- Page {data['page']} ---\n"
-            full_text += data['text'] + "\n\n"
-            
-        response = HttpResponse(full_text, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="transcript_{pdf.filename}.txt"'
-        return response
-        
-    except Exception as e:
-        print(f"Error generating transcript: {e}")
-        return HttpResponse("Error generating transcript", status=500)
+
+    def transcript():
+        yield f"Transcript for: {pdf.filename}\n"
+        yield f"Uploaded: {pdf.uploaded_at}\n"
+        yield "=" * 50 + "\n\n"
+        try:
+            for data in iter_page_text(pdf):
+                yield f"--- Page {data['page']} ---\n{data['text']}\n\n"
+        except Exception as e:
+            # Headers are already sent, so all we can do is end the file with a note
+            print(f"Error generating transcript: {e}")
+            yield "\n[Transcript incomplete: error reading the document]\n"
+
+    response = StreamingHttpResponse(transcript(), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="transcript_{pdf.filename}.txt"'
+    return response
+
+
+def resource_stats(request):
+    """
+    Load-time and hit counters for the cached embedding model / vector store,
+    plus the persistent embedding cache hit ratio and the index generations.
+    POST with reload=1 (optionally name=<resource>) to drop and rebuild them.
+    """
+    if request.method == "POST" and request.POST.get("reload"):
+        registry.reload(request.POST.get("name") or None)
+    return JsonResponse({
+        **registry.stats(),
+        "embedding_cache_hits": embedding_cache_stats(),
+        "answer_cache": answer_cache.stats(),
+        "llm_admission": llm_admission.stats(),
+        "index": {
+            "active": active_index().as_dict(),
+            "building": [index.as_dict() for index in building_indexes()],
+            "pdfs": UploadedPDF.objects.count(),
+        },
+    })
+
+
+def metrics(request):
+    """Prometheus scrape endpoint (this process's request, stage and render latency histograms)."""
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 def home(request):
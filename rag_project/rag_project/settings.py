@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rag_app.middleware.TimingMiddleware',  # First, so its timings cover the other middleware too
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -116,3 +117,174 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Where FAISS indexes will be stored
 FAISS_INDEX_DIR = BASE_DIR / "faiss_index"
+
+# RAG pipeline
+RAG_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RAG_EMBEDDING_DEVICE = "cpu"  # or "cuda" if you have GPU
+RAG_COLLECTION_NAME = "rag_collection"
+
+# Chunking. These and RAG_EMBEDDING_MODEL describe the *target* index: the
+# live index keeps the config it was built with until `manage.py reindex`
+# has rebuilt every PDF (from stored page text, across RAG_REINDEX_WORKERS
+# processes) into a new index and switched over.
+# "document" chunks each PDF as one stream, in embedding-model tokens (the
+# MiniLM default reads at most 256), ending chunks at paragraph breaks and
+# starting them at headings; chunks may run over a page break.
+# "recursive_character" is the older per-page splitter sized in characters
+# (RAG_CHUNK_SIZE / RAG_CHUNK_OVERLAP).
+RAG_SPLITTER = "document"
+RAG_CHUNK_TOKENS = 256
+RAG_CHUNK_OVERLAP_TOKENS = 32
+RAG_CHUNK_SIZE = 500
+RAG_CHUNK_OVERLAP = 50
+RAG_REINDEX_WORKERS = 2
+
+# Load the embedding model and vector store once when the server starts
+RAG_WARMUP_ON_STARTUP = True
+
+# Background ingestion: "pool" (local process pool), "worker" (leave jobs
+# for `manage.py ingest_worker`) or "sync" (process inside the request)
+RAG_INGEST_MODE = "pool"
+RAG_INGEST_WORKERS = 2
+
+# Page images for visual citations. "lazy" renders a page the first time it
+# is cited, "eager" renders every page at upload time across RAG_RENDER_WORKERS.
+RAG_PAGE_RENDER_MODE = "lazy"
+RAG_RENDER_WORKERS = 4
+RAG_PAGE_ZOOM = 2.0
+RAG_PAGE_FORMAT = "jpg"  # "jpg", "png" or "webp"
+RAG_PAGE_QUALITY = 85
+RAG_THUMBNAIL_WIDTH = 200
+
+# Text extraction: documents with at least RAG_EXTRACT_PARALLEL_MIN_PAGES
+# pages are extracted by RAG_EXTRACT_WORKERS processes. Text blocks in the
+# top/bottom RAG_EXTRACT_MARGIN of a page that repeat across the document
+# (running headers, footers, page numbers) are dropped.
+RAG_EXTRACT_WORKERS = 4
+RAG_EXTRACT_PARALLEL_MIN_PAGES = 200
+RAG_EXTRACT_MARGIN = 0.08
+RAG_EXTRACT_STRIP_REPEATED = True
+
+# OCR for pages without a text layer (scans): None (skip them), "tesseract"
+# (a local Tesseract install, driven by PyMuPDF) or the dotted path of a
+# callable(page, language, dpi) -> str
+RAG_OCR_BACKEND = None
+RAG_OCR_LANGUAGE = "eng"
+RAG_OCR_DPI = 300
+
+# Embedding throughput: chunks per Chroma upsert, sentences per encoder call,
+# and CPU threads for the encoder (None = the backend's default, all cores)
+RAG_EMBED_BATCH_SIZE = 64
+RAG_ENCODER_BATCH_SIZE = 32
+RAG_ENCODER_THREADS = None
+
+# Encoder runtime: "torch" (sentence-transformers) or "onnx" (ONNX Runtime,
+# `pip install onnxruntime`; no torch import, faster on CPU). Same model and
+# vectors, so switching needs no reindex; `manage.py bench_embedding_backends`
+# compares them. RAG_ONNX_QUANTIZE converts the weights to int8 once (needs
+# `pip install onnx`), cached in RAG_ONNX_CACHE_DIR. RAG_ONNX_MODEL_DIR: a
+# local model.onnx + tokenizer.json instead of the Hugging Face download.
+RAG_EMBEDDING_BACKEND = "torch"
+RAG_ONNX_QUANTIZE = False
+RAG_ONNX_MODEL_DIR = None
+RAG_ONNX_CACHE_DIR = BASE_DIR / "onnx_cache"
+
+# Persistent (model, chunk text hash) -> vector cache; None disables it
+RAG_EMBEDDING_CACHE_PATH = BASE_DIR / "embedding_cache.sqlite3"
+
+# /ask_question/ answer cache: entries, seconds to live, and the cosine
+# similarity above which a reworded question reuses an answer (None = exact only)
+RAG_ANSWER_CACHE_SIZE = 512
+RAG_ANSWER_CACHE_TTL = 3600
+RAG_ANSWER_CACHE_THRESHOLD = 0.95
+
+# Async Q&A: threads for blocking Chroma/embedding/ORM work, concurrent LLM
+# calls, how many more may queue (beyond that requests get a 503 straight
+# away) and how long a queued request may wait
+RAG_QA_EXECUTOR_WORKERS = 8
+RAG_LLM_CONCURRENCY = 2
+RAG_LLM_QUEUE_SIZE = 8
+RAG_LLM_QUEUE_TIMEOUT = 30
+
+# Ollama client, shared by all requests of a process. RAG_LLM_POOL_SIZE
+# keep-alive connections (per event loop for async views); RAG_LLM_KEEP_ALIVE
+# is how long Ollama keeps the model loaded after a call (-1: forever, 0:
+# unload straight away); RAG_LLM_WARMUP loads it at startup and primes the
+# server's prompt cache with the fixed instruction prefix of the Q&A prompt.
+RAG_LLM_MODEL = "llama3.2"
+RAG_OLLAMA_BASE_URL = None  # None: $OLLAMA_HOST or http://localhost:11434
+RAG_LLM_KEEP_ALIVE = "30m"
+RAG_LLM_POOL_SIZE = 8
+RAG_LLM_TIMEOUT = 120  # seconds
+RAG_LLM_WARMUP = True
+
+# Batch Q&A (/ask_question/batch/, rag_pipeline.get_answers): concurrent LLM
+# calls per batch (separate from the interactive limit above) and batch size
+RAG_BATCH_LLM_CONCURRENCY = 2
+RAG_BATCH_MAX_QUESTIONS = 1000
+
+# Retrieval: "hybrid" fuses BM25 and dense rankings with reciprocal rank
+# fusion, "dense" is vector similarity only. Weights can also be set per
+# query with ?dense_weight=&lexical_weight=
+RAG_RETRIEVAL_MODE = "hybrid"
+RAG_HYBRID_DENSE_WEIGHT = 1.0
+RAG_HYBRID_LEXICAL_WEIGHT = 1.0
+RAG_LEXICAL_INDEX_DIR = BASE_DIR / "lexical_index"
+
+# Vector store backend: "chroma", "faiss" (needs faiss-cpu), "numpy"
+# (exact search over a memory-mapped matrix; fine for small corpora) or
+# "quantized" (below).
+# Switching backends starts from an empty index, so re-upload afterwards.
+RAG_VECTOR_BACKEND = "chroma"
+RAG_CHROMA_DIR = BASE_DIR / "chroma_db_data"
+RAG_FAISS_INDEX_DIR = FAISS_INDEX_DIR
+RAG_FAISS_INDEX_TYPE = "flat"  # "flat", "ivf" or "hnsw"
+RAG_NUMPY_INDEX_DIR = BASE_DIR / "numpy_index"
+# "quantized": the numpy index (same folder) searched through compact codes,
+# "int8" (4x smaller than float32) or "binary" (32x smaller), with the best
+# RAG_RESCORE_FACTOR * k candidates rescored exactly (None: 4 / 10).
+RAG_QUANTIZATION = "int8"
+RAG_RESCORE_FACTOR = None
+# Partition the index: 1 = a store per PDF, N = per group of N consecutive
+# PDF ids, 0 = one shared store. Single-PDF questions search only their
+# partition, "all PDFs" questions fan out over RAG_PARTITION_WORKERS
+# threads, and deleting a PDF drops its partition. Takes effect through
+# `python manage.py reindex`.
+RAG_VECTOR_PARTITION_SIZE = 0
+RAG_PARTITION_WORKERS = 8
+
+# Document summaries (UploadedPDF.summary), made at the end of ingestion:
+# pages are summarized in sections of RAG_SUMMARY_SECTION_CHARS characters,
+# RAG_SUMMARY_CONCURRENCY LLM calls at a time, and the section summaries
+# combined RAG_SUMMARY_FAN_IN at a time until one is left. Intermediate
+# summaries are cached in RAG_SUMMARY_CACHE_PATH (None disables the cache).
+# Overview questions ("what is this document about?") get the stored summary.
+RAG_SUMMARY_ENABLED = True
+RAG_SUMMARY_SECTION_CHARS = 6000
+RAG_SUMMARY_FAN_IN = 6
+RAG_SUMMARY_CONCURRENCY = 2
+RAG_SUMMARY_CACHE_PATH = BASE_DIR / "summary_cache.sqlite3"
+
+# Cross-encoder reranking: over-fetch RAG_RERANK_CANDIDATES chunks, rescore
+# them on the CPU and keep the best. Falls back to the retrieval order when
+# scoring would take longer than RAG_RERANK_BUDGET_MS.
+RAG_RERANK_ENABLED = False
+RAG_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RAG_RERANK_CANDIDATES = 24
+RAG_RERANK_BATCH_SIZE = 16
+RAG_RERANK_BUDGET_MS = 400
+
+# Prompt context packing: adjacent chunks of a page are merged, near-duplicate
+# chunks (MinHash Jaccard >= threshold) dropped, and the rest added best-first
+# up to this many (estimated) tokens
+RAG_CONTEXT_TOKEN_BUDGET = 1500
+RAG_CONTEXT_DEDUP_THRESHOLD = 0.8
+
+# Latency instrumentation: per-stage timings are exported at /metrics
+# (Prometheus format) and, per request, in a Server-Timing header. With
+# RAG_PROFILE_ENABLED, ?profile=1 samples a single request's stacks into
+# RAG_PROFILE_DIR (collapsed format, for flamegraph.pl / speedscope).
+RAG_SERVER_TIMING = True
+RAG_PROFILE_ENABLED = DEBUG
+RAG_PROFILE_INTERVAL_MS = 5
+RAG_PROFILE_DIR = BASE_DIR / "profiles"